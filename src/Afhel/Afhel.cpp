@@ -6,10 +6,10 @@
  *  addition, multiplication, scalar product and others.
  *
  *  Afhel implements a higher level of abstraction than HElib, and handles
- *  Cyphertexts using an unordered map (key-value pairs) that is accessed
- *  via keys of type string. This is done in order to manage Cyphertext 
- *  using references (the keys), which will allow Pyfhel to work only 
- *  using strings (keeping the Cyphertexts in C++). Afhel also compresses
+ *  Cyphertexts using a slab of slots that is accessed via integer handles.
+ *  This is done in order to manage Cyphertext using references (the
+ *  handles), which will allow Pyfhel to work only using integers (keeping
+ *  the Cyphertexts in C++). Afhel also compresses
  *  the Context setup and Key generation into one single KeyGen function
  *  with multiple parameter selection.
  *  --------------------------------------------------------------------
@@ -45,16 +45,36 @@
 #include <iostream>
 #include <cstddef>
 #include <sys/time.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <cstdint>
+#include <cstring>
+#include <streambuf>
+#include <mutex>
+#include <map>
+#include <thread>
+#include <functional>
+#include <algorithm>
 
 #include <FHE.h>
 #include <timing.h>
 #include <EncryptedArray.h>
+#include <polyEval.h>
 #include "Afhel.h"
 
 using namespace std;
 
-Afhel::Afhel(){}
-Afhel::~Afhel(){}
+Afhel::Afhel(){
+        long nCPUs = std::thread::hardware_concurrency();
+        setNumThreads(std::max(nCPUs, 1L));             // Default to all CPUs
+}
+Afhel::~Afhel(){
+        for(size_t i=0; i<ctxtSlab.size(); i++){       // Free all stored ciphertexts
+            delete ctxtSlab[i].ctxt;
+        }
+        delete workerPool;
+}
 
 // ------------------------------ CRYPTOGRAPHY --------------------------------
 // KEY GENERATION
@@ -83,6 +103,7 @@ void Afhel::keyGen(long p, long r, long c, long d, long sec, long w,
         global_m = m;
         global_p = p;
         global_r = r;
+        global_L = L;
         context = new FHEcontext(m, p, r, gens, ords);  // Initialize context
         buildModChain(*context, L, c);                  // Add primes to modulus chain
         if(flagPrint){std::cout << "  - Created Context: " 
@@ -104,109 +125,1316 @@ void Afhel::keyGen(long p, long r, long c, long d, long sec, long w,
         if(flagPrint){std::cout << "  - Created Public/Private Key Pair" << endl;} 
 
         // Additional initializations
-        addSome1DMatrices(*secretKey);                  // Key-switch matrices for relin.
+        if(rotationKeys == ROTKEYS_SOME){               // Key-switch matrices for rotations
+            addSome1DMatrices(*secretKey);
+        }
         ea = new EncryptedArray(*context, G);           // Object for packing in subfields
         nslots = ea->size();
+        clearPtxtCache();                               // Encodings depend on context
+        levelsPerMult = 0;
 
 
         if(flagPrint){std::cout << "Afhel::keyGen COMPLETED" << endl;}
 }
 
 // ENCRYPTION
-string Afhel::encrypt(vector<long> plaintext) {
-        Ctxt cyphertext(*publicKey);                    // Empty cyphertext object
+long Afhel::encrypt(vector<long> plaintext) {
+        std::unique_ptr<Ctxt> cyphertext(new Ctxt(*publicKey));  // Empty cyphertext object
         //TODO: create a vector of size nddSlots and fill it first with values from plaintext, then with zeros
-        ea->encrypt(cyphertext, *publicKey, plaintext); // Encrypt plaintext
-        string id1 = store(&cyphertext);
+        ea->encrypt(*cyphertext, *publicKey, plaintext);// Encrypt plaintext
+        dropToDepth(*cyphertext);
+        long id1 = adopt(cyphertext.release());         // Moved into the slab
         if(flagPrint){
             std::cout << "  Afhel::encrypt({ID" << id1 << "}[" << plaintext <<  "])" << endl;
         }
         return id1;
 }
 
+// BATCHED ENCRYPTION
+vector<long> Afhel::encryptArray(const long* data, long nRows, long nCols,
+                                 long fill, long nThreads) {
+        if(nCols > nslots){
+            throw std::invalid_argument("Afhel::encryptArray: more columns than plaintext slots");
+        }
+        vector<Ctxt*> cyphertexts(nRows, NULL);
+        try{
+            parallelFor(nRows, nThreads, [&](long i){
+                vector<long> plaintext(nslots, fill);   // Row padded with fill
+                std::copy(data + i*nCols, data + (i+1)*nCols, plaintext.begin());
+                Ctxt* cyphertext = new Ctxt(*publicKey);
+                cyphertexts[i] = cyphertext;
+                ea->encrypt(*cyphertext, *publicKey, plaintext);
+                dropToDepth(*cyphertext);
+            });
+        }
+        catch(...){
+            for(long i=0; i<nRows; i++){ delete cyphertexts[i]; }
+            throw;
+        }
+        vector<long> ids(nRows);
+        for(long i=0; i<nRows; i++){                    // Store in row order
+            ids[i] = adopt(cyphertexts[i]);
+        }
+        if(flagPrint){
+            std::cout << "  Afhel::encryptArray(" << nRows << " rows)" << endl;
+        }
+        return ids;
+}
+
 // DECRYPTION
-vector<long> Afhel::decrypt(string id1) {
+vector<long> Afhel::decrypt(long id1) {
         vector<long> res(nslots, 0);                    // Empty vector of values
-        ea->decrypt(ctxtMap.at(id1), *secretKey, res);  // Decrypt cyphertext
+        ea->decrypt(at(id1), *secretKey, res);          // Decrypt cyphertext
         if(flagPrint){
             std::cout << "  Afhel::decrypt({ID" << id1 << "}[" << res << "])" << endl;
         }
         return res;
 }
 
+// BATCHED DECRYPTION
+void Afhel::decryptArray(const vector<long>& ids, long* out, long nCols,
+                         long nThreads) {
+        if(nCols > nslots){
+            throw std::invalid_argument("Afhel::decryptArray: more columns than plaintext slots");
+        }
+        long nRows = ids.size();
+        vector<Ctxt*> cyphertexts(nRows);
+        for(long i=0; i<nRows; i++){                    // Resolve handles upfront
+            cyphertexts[i] = &at(ids[i]);
+        }
+        parallelFor(nRows, nThreads, [&](long i){
+            vector<long> res(nslots, 0);
+            ea->decrypt(*cyphertexts[i], *secretKey, res);
+            std::copy(res.begin(), res.begin() + nCols, out + i*nCols);
+        });
+        if(flagPrint){
+            std::cout << "  Afhel::decryptArray(" << nRows << " rows)" << endl;
+        }
+}
+
 
 // ---------------------------- OPERATIONS ------------------------------------
 // ADDITION
-void Afhel::add(string id1, string id2, bool negative){
-        ctxtMap.at(id1).addCtxt(ctxtMap.at(id2), negative);
+void Afhel::add(long id1, long id2, bool negative){
+        std::unique_ptr<Ctxt> tmp;
+        Ctxt& ctxt = at(id1);
+        ctxt.addCtxt(levelled(ctxt, at(id2), tmp), negative);
+        guard(id1);
+}
+
+void Afhel::add(const vector<long>& ids1, const vector<long>& ids2, bool negative){
+        checkSizes(ids1, ids2);
+        parallelFor(ids1.size(), 0, [&](long i){ add(ids1[i], ids2[i], negative); });
+}
+
+// ADDITION OF CONSTANT
+void Afhel::addConstant(long id1, long c, bool negative){
+        addConstantTo(at(id1), negative? -c : c);
+        guard(id1);
+}
+
+void Afhel::addConstant(long id1, vector<long> ptxt_vect, bool negative){
+        if(negative){
+            for(size_t i=0; i<ptxt_vect.size(); i++){ ptxt_vect[i] = -ptxt_vect[i]; }
+        }
+        addConstantTo(at(id1), ptxt_vect);
+        guard(id1);
+}
+
+void Afhel::addConstantTo(Ctxt& ctxt, long c){
+        long ptxtSpace = ctxt.getPtxtSpace();
+        ctxt.addConstant(to_ZZ(((c % ptxtSpace) + ptxtSpace) % ptxtSpace));
+}
+
+void Afhel::addConstantTo(Ctxt& ctxt, const vector<long>& ptxt_vect){
+        if(ptxtCacheBudget > 0){                        // Reuse cached encoding
+            ctxt.addConstant(*encodeCached(ptxt_vect, ctxt.getPrimeSet()));
+        }
+        else{
+            ZZX poly;
+            encode(poly, ptxt_vect);
+            ctxt.addConstant(poly);
+        }
 }
 
 // MULTIPLICATION
-void Afhel::mult(string id1, string id2){
-        ctxtMap.at(id1).multiplyBy(ctxtMap.at(id2));
+void Afhel::mult(long id1, long id2){
+        KeyLock keys(keySwitchMutex);                   // Relinearization matrix
+        std::unique_ptr<Ctxt> tmp;
+        Ctxt& ctxt = at(id1);
+        ctxt.multiplyBy(levelled(ctxt, at(id2), tmp));
+        guard(id1);
+}
+
+void Afhel::mult(const vector<long>& ids1, const vector<long>& ids2){
+        checkSizes(ids1, ids2);
+        KeyLock keys(keySwitchMutex);
+        parallelFor(ids1.size(), 0, [&](long i){
+            std::unique_ptr<Ctxt> tmp;
+            Ctxt& ctxt = at(ids1[i]);
+            ctxt.multiplyBy(levelled(ctxt, at(ids2[i]), tmp));
+            guard(ids1[i]);
+        });
 }
 
 // MULTIPLICATION BY 2
-void Afhel::mult3(string id1, string id2, string id3){
-        ctxtMap.at(id1).multiplyBy2(ctxtMap.at(id2), ctxtMap.at(id3));
+void Afhel::mult3(long id1, long id2, long id3){
+        KeyLock keys(keySwitchMutex);
+        mult3To(id1, id2, id3);
+}
+
+void Afhel::mult3To(long id1, long id2, long id3){
+        std::unique_ptr<Ctxt> tmp2, tmp3;
+        Ctxt& ctxt = at(id1);
+        const Ctxt* ctxt2 = &levelled(ctxt, at(id2), tmp2);
+        const Ctxt& ctxt3 = levelled(ctxt, at(id3), tmp3);
+        ctxt2 = &levelled(ctxt, *ctxt2, tmp2);          // id3 may be the lowest
+        ctxt.multiplyBy2(*ctxt2, ctxt3);
+        guard(id1);
+}
+
+void Afhel::mult3(const vector<long>& ids1, const vector<long>& ids2,
+                  const vector<long>& ids3){
+        checkSizes(ids1, ids2);
+        checkSizes(ids1, ids3);
+        KeyLock keys(keySwitchMutex);
+        parallelFor(ids1.size(), 0, [&](long i){ mult3To(ids1[i], ids2[i], ids3[i]); });
+}
+
+// OUT-OF-PLACE OPERATIONS
+vector<long> Afhel::outOfPlace(const vector<long>& ids,
+                               const std::function<void(long, Ctxt&)>& op){
+        long n = ids.size();
+        vector<Ctxt*> results(n, NULL);
+        try{
+            parallelFor(n, 0, [&](long i){
+                results[i] = new Ctxt(at(ids[i]));      // Only copy: into the result
+                op(i, *results[i]);
+            });
+        }
+        catch(...){
+            for(long i=0; i<n; i++){ delete results[i]; }
+            throw;
+        }
+        vector<long> newIds(n);
+        for(long i=0; i<n; i++){
+            newIds[i] = adopt(results[i]);
+            guard(newIds[i]);
+        }
+        return newIds;
+}
+
+long Afhel::addNew(long id1, long id2, bool negative){
+        return addNew(vector<long>(1, id1), vector<long>(1, id2), negative)[0];
+}
+
+long Afhel::multNew(long id1, long id2){
+        return multNew(vector<long>(1, id1), vector<long>(1, id2))[0];
+}
+
+vector<long> Afhel::addNew(const vector<long>& ids1, const vector<long>& ids2,
+                           bool negative){
+        checkSizes(ids1, ids2);
+        return outOfPlace(ids1, [&](long i, Ctxt& ctxt){
+            std::unique_ptr<Ctxt> tmp;
+            ctxt.addCtxt(levelled(ctxt, at(ids2[i]), tmp), negative);
+        });
+}
+
+vector<long> Afhel::multNew(const vector<long>& ids1, const vector<long>& ids2){
+        checkSizes(ids1, ids2);
+        KeyLock keys(keySwitchMutex);
+        return outOfPlace(ids1, [&](long i, Ctxt& ctxt){
+            std::unique_ptr<Ctxt> tmp;
+            ctxt.multiplyBy(levelled(ctxt, at(ids2[i]), tmp));
+        });
+}
+
+vector<long> Afhel::addConstantNew(const vector<long>& ids, long c, bool negative){
+        return outOfPlace(ids, [&](long i, Ctxt& ctxt){ addConstantTo(ctxt, negative? -c : c); });
+}
+
+vector<long> Afhel::addConstantNew(const vector<long>& ids,
+                                   const vector<vector<long>>& ptxts, bool negative){
+        checkSizes(ids, vector<long>(ptxts.size()));
+        return outOfPlace(ids, [&](long i, Ctxt& ctxt){
+            if(negative){
+                vector<long> neg(ptxts[i]);
+                for(size_t k=0; k<neg.size(); k++){ neg[k] = -neg[k]; }
+                addConstantTo(ctxt, neg);
+            }
+            else{ addConstantTo(ctxt, ptxts[i]); }
+        });
+}
+
+vector<long> Afhel::multByConstantNew(const vector<long>& ids, long c){
+        return outOfPlace(ids, [&](long i, Ctxt& ctxt){ multByConstantTo(ctxt, c); });
+}
+
+vector<long> Afhel::multByConstantNew(const vector<long>& ids,
+                                      const vector<vector<long>>& ptxts){
+        checkSizes(ids, vector<long>(ptxts.size()));
+        return outOfPlace(ids, [&](long i, Ctxt& ctxt){ multByConstantTo(ctxt, ptxts[i]); });
+}
+
+vector<long> Afhel::powerNew(const vector<long>& ids, long n){
+        if(n < 1){
+            throw std::invalid_argument("Afhel::powerNew: exponent must be >= 1");
+        }
+        KeyLock keys(keySwitchMutex);
+        return outOfPlace(ids, [&](long i, Ctxt& ctxt){ powerOf(ctxt, n); });
+}
+
+// LAZY RELINEARIZATION
+void Afhel::multNoRelin(long id1, long id2){
+        std::unique_ptr<Ctxt> tmp;
+        Ctxt& ctxt = at(id1);
+        ctxt.multLowLvl(levelled(ctxt, at(id2), tmp));  // Up to 3 parts, no key switching
+        guard(id1);
+}
+
+void Afhel::multNoRelin(const vector<long>& ids1, const vector<long>& ids2){
+        checkSizes(ids1, ids2);
+        parallelFor(ids1.size(), 0, [&](long i){ multNoRelin(ids1[i], ids2[i]); });
+}
+
+void Afhel::relinearize(long id1){
+        KeyLock keys(keySwitchMutex);
+        at(id1).reLinearize();
+        guard(id1);
+}
+
+void Afhel::relinearize(const vector<long>& ids){
+        KeyLock keys(keySwitchMutex);
+        parallelFor(ids.size(), 0, [&](long i){
+            at(ids[i]).reLinearize();
+            guard(ids[i]);
+        });
+}
+
+long Afhel::sumOfProducts(const vector<long>& ids1, const vector<long>& ids2){
+        long id1 = adopt(productSum(ids1, ids2));
+        guard(id1);
+        return id1;
+}
+
+Ctxt* Afhel::productSum(const vector<long>& ids1, const vector<long>& ids2){
+        checkSizes(ids1, ids2);
+        if(ids1.empty()){
+            throw std::invalid_argument("Afhel::sumOfProducts: no ciphertexts given");
+        }
+        long n = ids1.size();
+        vector<Ctxt*> products(n, NULL);
+        try{
+            parallelFor(n, 0, [&](long i){              // Unrelinearized products
+                std::unique_ptr<Ctxt> tmp;
+                products[i] = new Ctxt(at(ids1[i]));
+                products[i]->multLowLvl(levelled(*products[i], at(ids2[i]), tmp));
+            });
+            for(long i=1; i<n; i++){                    // Accumulate 3-part ctxts
+                matchLevels(*products[0], *products[i]);
+                products[0]->addCtxt(*products[i]);
+            }
+            KeyLock keys(keySwitchMutex);
+            products[0]->reLinearize();                 // Single key switching
+        }
+        catch(...){
+            for(long i=0; i<n; i++){ delete products[i]; }
+            throw;
+        }
+        for(long i=1; i<n; i++){ delete products[i]; }
+        return products[0];
+}
+
+// FUSED MULTIPLY-ADD
+void Afhel::fma(long acc, long id1, long id2){
+        KeyLock keys(keySwitchMutex);
+        fmaTo(acc, id1, id2);
+}
+
+void Afhel::fmaTo(long acc, long id1, long id2){
+        std::unique_ptr<Ctxt> tmp;
+        Ctxt product(at(id1));                          // Single temporary
+        product.multiplyBy(levelled(product, at(id2), tmp));
+        Ctxt& accCtxt = at(acc);
+        matchLevels(accCtxt, product);
+        accCtxt.addCtxt(product);
+        guard(acc);
+}
+
+void Afhel::fma(const vector<long>& accs, const vector<long>& ids1,
+                const vector<long>& ids2){
+        checkSizes(accs, ids1);
+        checkSizes(ids1, ids2);
+        KeyLock keys(keySwitchMutex);
+        parallelFor(accs.size(), 0, [&](long i){ fmaTo(accs[i], ids1[i], ids2[i]); });
+}
+
+void Afhel::fmaPlain(long acc, long id1, long c){
+        Ctxt product(at(id1));
+        multByConstantTo(product, c);
+        Ctxt& accCtxt = at(acc);
+        matchLevels(accCtxt, product);
+        accCtxt.addCtxt(product);
+        guard(acc);
+}
+
+void Afhel::fmaPlain(long acc, long id1, const vector<long>& ptxt_vect){
+        Ctxt product(at(id1));
+        multByConstantTo(product, ptxt_vect);
+        Ctxt& accCtxt = at(acc);
+        matchLevels(accCtxt, product);
+        accCtxt.addCtxt(product);
+        guard(acc);
+}
+
+void Afhel::fmaPlain(const vector<long>& accs, const vector<long>& ids,
+                     const vector<vector<long>>& ptxts){
+        checkSizes(accs, ids);
+        checkSizes(ids, vector<long>(ptxts.size()));
+        parallelFor(accs.size(), 0, [&](long i){ fmaPlain(accs[i], ids[i], ptxts[i]); });
+}
+
+void Afhel::fmaSum(long acc, const vector<long>& ids1, const vector<long>& ids2){
+        std::unique_ptr<Ctxt> sum(productSum(ids1, ids2));
+        Ctxt& accCtxt = at(acc);
+        matchLevels(accCtxt, *sum);
+        accCtxt.addCtxt(*sum);
+        guard(acc);
+}
+
+void Afhel::fmaPlainSum(long acc, const vector<long>& ids,
+                        const vector<vector<long>>& ptxts){
+        checkSizes(ids, vector<long>(ptxts.size()));
+        long n = ids.size();
+        vector<Ctxt*> products(n, NULL);
+        try{
+            parallelFor(n, 0, [&](long i){
+                products[i] = new Ctxt(at(ids[i]));
+                multByConstantTo(*products[i], ptxts[i]);
+            });
+            Ctxt& accCtxt = at(acc);
+            for(long i=0; i<n; i++){
+                matchLevels(accCtxt, *products[i]);
+                accCtxt.addCtxt(*products[i]);
+            }
+        }
+        catch(...){
+            for(long i=0; i<n; i++){ delete products[i]; }
+            throw;
+        }
+        for(long i=0; i<n; i++){ delete products[i]; }
+        guard(acc);
+}
+
+// MULTIPLICATION BY CONSTANT
+void Afhel::multByConstant(long id1, long c){
+        multByConstantTo(at(id1), c);
+        guard(id1);
+}
+
+void Afhel::multByConstant(long id1, vector<long> ptxt_vect){
+        multByConstantTo(at(id1), ptxt_vect);
+        guard(id1);
+}
+
+void Afhel::multByConstantTo(Ctxt& ctxt, long c){
+        long ptxtSpace = ctxt.getPtxtSpace();
+        ctxt.multByConstant(to_ZZ(((c % ptxtSpace) + ptxtSpace) % ptxtSpace));
+}
+
+void Afhel::multByConstantTo(Ctxt& ctxt, const vector<long>& ptxt_vect){
+        if(ptxtCacheBudget > 0){                        // Reuse cached encoding
+            ctxt.multByConstant(*encodeCached(ptxt_vect, ctxt.getPrimeSet()));
+        }
+        else{
+            ZZX poly;
+            encode(poly, ptxt_vect);
+            ctxt.multByConstant(poly);
+        }
 }
 
 // SCALAR PRODUCT
-void Afhel::scalarProd(string id1, string id2, int partitionSize){
-        ctxtMap.at(id1).multiplyBy(ctxtMap.at(id2));
-        totalSums(*ea, ctxtMap.at(id1));
+void Afhel::scalarProd(long id1, long id2, int partitionSize){
+        KeyLock keys = ensureRotationKeys(partitionSumAmounts(partitionSize));
+        std::unique_ptr<Ctxt> tmp;
+        Ctxt& ctxt = at(id1);
+        ctxt.multiplyBy(levelled(ctxt, at(id2), tmp));
+        partitionSumTo(ctxt, partitionSize);
+        guard(id1);
+}
+
+void Afhel::scalarProd(const vector<long>& ids1, const vector<long>& ids2,
+                       int partitionSize){
+        checkSizes(ids1, ids2);
+        KeyLock keys = ensureRotationKeys(partitionSumAmounts(partitionSize));
+        parallelFor(ids1.size(), 0, [&](long i){
+            std::unique_ptr<Ctxt> tmp;
+            Ctxt& ctxt = at(ids1[i]);
+            ctxt.multiplyBy(levelled(ctxt, at(ids2[i]), tmp));
+            partitionSumTo(ctxt, partitionSize);
+            guard(ids1[i]);
+        });
+}
+
+void Afhel::windowSumTo(Ctxt& ctxt, long width, long step, bool cyclic){
+        // Doubling: block holds the sums over windows of len slots, and the
+        //  windows selected by the bits of width are added at their offset
+        Ctxt block(ctxt);
+        long offset = 0;
+        bool empty = true;
+        for(long len = 1; len <= width; len *= 2){
+            if(width & len){
+                Ctxt part(block);
+                if(offset != 0){
+                    if(cyclic){ ea->rotate(part, -step*offset); }
+                    else{ ea->shift(part, -step*offset); }
+                }
+                if(empty){ ctxt = part; empty = false; }
+                else{ ctxt.addCtxt(part); }
+                offset += len;
+            }
+            if(2*len <= width){
+                Ctxt moved(block);
+                if(cyclic){ ea->rotate(moved, -step*len); }
+                else{ ea->shift(moved, -step*len); }
+                block.addCtxt(moved);
+            }
+        }
+}
+
+vector<long> Afhel::windowSumAmounts(long width, long step){
+        vector<long> amounts;
+        long offset = 0;
+        for(long len = 1; len <= width; len *= 2){
+            if(width & len){
+                if(offset != 0){ amounts.push_back(-step*offset); }
+                offset += len;
+            }
+            if(2*len <= width){ amounts.push_back(-step*len); }
+        }
+        return amounts;
+}
+
+void Afhel::partitionSumTo(Ctxt& ctxt, long partitionSize){
+        if(partitionSize == 0 || partitionSize == nslots){
+            totalSums(*ea, ctxt);
+            return;
+        }
+        if(partitionSize < 0 || partitionSize > nslots || nslots % partitionSize != 0){
+            throw std::invalid_argument("Afhel::scalarProd: partitionSize must divide the number of slots");
+        }
+        if(partitionSize == 1){ return; }
+        windowSumTo(ctxt, partitionSize, 1, true);      // Block sums at block starts
+        vector<long> mask(nslots, 0);
+        for(long i=0; i<nslots; i+=partitionSize){ mask[i] = 1; }
+        multByConstantTo(ctxt, mask);
+        windowSumTo(ctxt, partitionSize, -1, true);     // Replicated along each block
+}
+
+vector<long> Afhel::partitionSumAmounts(long partitionSize){
+        if(partitionSize == 0 || partitionSize == nslots){ return totalSumsAmounts(); }
+        vector<long> amounts = windowSumAmounts(partitionSize, 1);
+        vector<long> back = windowSumAmounts(partitionSize, -1);
+        amounts.insert(amounts.end(), back.begin(), back.end());
+        return amounts;
 }
 
 // CUMULATIVE SUM
-void Afhel::cumSum(string id1){
-        totalSums(*ea, ctxtMap.at(id1));
+void Afhel::cumSum(long id1){
+        KeyLock keys = ensureRotationKeys(totalSumsAmounts());
+        totalSums(*ea, at(id1));
+        guard(id1);
+}
+
+void Afhel::cumSum(const vector<long>& ids){
+        KeyLock keys = ensureRotationKeys(totalSumsAmounts());
+        parallelFor(ids.size(), 0, [&](long i){
+            totalSums(*ea, at(ids[i]));
+            guard(ids[i]);
+        });
+}
+
+// PREFIX SUM
+void Afhel::prefixSum(long id1){
+        KeyLock keys = ensureRotationKeys(prefixSumAmounts());
+        prefixSumTo(at(id1));
+        guard(id1);
+}
+
+void Afhel::prefixSum(const vector<long>& ids){
+        KeyLock keys = ensureRotationKeys(prefixSumAmounts());
+        parallelFor(ids.size(), 0, [&](long i){
+            prefixSumTo(at(ids[i]));
+            guard(ids[i]);
+        });
+}
+
+void Afhel::prefixSumTo(Ctxt& ctxt){
+        for(long s = 1; s < nslots; s *= 2){            // Hillis-Steele scan
+            Ctxt moved(ctxt);
+            ea->shift(moved, s);
+            ctxt.addCtxt(moved);
+        }
+}
+
+vector<long> Afhel::prefixSumAmounts(){
+        vector<long> amounts;
+        for(long s = 1; s < nslots; s *= 2){ amounts.push_back(s); }
+        return amounts;
+}
+
+// WINDOW SUM
+void Afhel::windowSum(long id1, long width){
+        if(width < 1 || width > nslots){
+            throw std::invalid_argument("Afhel::windowSum: width must be between 1 and the number of slots");
+        }
+        KeyLock keys = ensureRotationKeys(windowSumAmounts(width, -1));
+        windowSumTo(at(id1), width, -1, false);
+        guard(id1);
+}
+
+void Afhel::windowSum(const vector<long>& ids, long width){
+        if(width < 1 || width > nslots){
+            throw std::invalid_argument("Afhel::windowSum: width must be between 1 and the number of slots");
+        }
+        KeyLock keys = ensureRotationKeys(windowSumAmounts(width, -1));
+        parallelFor(ids.size(), 0, [&](long i){
+            windowSumTo(at(ids[i]), width, -1, false);
+            guard(ids[i]);
+        });
 }
 
 // SQUARE
-void Afhel::square(string id1){
-        ctxtMap.at(id1).square();
+void Afhel::square(long id1){
+        KeyLock keys(keySwitchMutex);
+        at(id1).square();
+        guard(id1);
+}
+
+void Afhel::square(const vector<long>& ids){
+        KeyLock keys(keySwitchMutex);
+        parallelFor(ids.size(), 0, [&](long i){
+            at(ids[i]).square();
+            guard(ids[i]);
+        });
 }
 
 // CUBE
-void Afhel::cube(string id1){
-        ctxtMap.at(id1).cube();
+void Afhel::cube(long id1){
+        KeyLock keys(keySwitchMutex);
+        at(id1).cube();
+        guard(id1);
+}
+
+void Afhel::cube(const vector<long>& ids){
+        KeyLock keys(keySwitchMutex);
+        parallelFor(ids.size(), 0, [&](long i){
+            at(ids[i]).cube();
+            guard(ids[i]);
+        });
+}
+
+// POWER
+void Afhel::power(long id1, long n){
+        if(n < 1){
+            throw std::invalid_argument("Afhel::power: exponent must be >= 1");
+        }
+        KeyLock keys(keySwitchMutex);
+        powerOf(at(id1), n);
+        guard(id1);
+}
+
+void Afhel::powerOf(Ctxt& ctxt, long n){
+        if(n == 1){ return; }
+        if(n == 2){ ctxt.square(); return; }
+        if(n == 3){ ctxt.cube(); return; }
+        Ctxt base(ctxt);                                // x^(2^i) at step i
+        bool first = true;
+        while(n > 0){
+            if(n & 1){                                  // Multiply in set bits
+                if(first){ ctxt = base; first = false; }
+                else     { ctxt.multiplyBy(base); }
+            }
+            n >>= 1;
+            if(n > 0){ base.square(); }
+        }
+}
+
+void Afhel::power(const vector<long>& ids, long n){
+        if(n < 1){
+            throw std::invalid_argument("Afhel::power: exponent must be >= 1");
+        }
+        KeyLock keys(keySwitchMutex);
+        parallelFor(ids.size(), 0, [&](long i){
+            powerOf(at(ids[i]), n);
+            guard(ids[i]);
+        });
+}
+
+// POLYNOMIAL EVALUATION
+void Afhel::polyEval(long id1, vector<long> coeffs){
+        if(coeffs.empty()){
+            throw std::invalid_argument("Afhel::polyEval: no coefficients given");
+        }
+        Ctxt& ctxt = at(id1);
+        long ptxtSpace = ctxt.getPtxtSpace();
+        ZZX poly;
+        for(long i=0; i<(long)coeffs.size(); i++){     // Coeffs reduced mod p^r
+            SetCoeff(poly, i, ((coeffs[i] % ptxtSpace) + ptxtSpace) % ptxtSpace);
+        }
+        if(deg(poly) <= 0){                             // Constant polynomial
+            ctxt.multByConstant(to_ZZ(0));
+            if(deg(poly) == 0){ ctxt.addConstant(ConstTerm(poly)); }
+            guard(id1);
+            return;
+        }
+        KeyLock keys(keySwitchMutex);
+        Ctxt res(*publicKey);
+        ::polyEval(res, poly, ctxt);                    // Paterson-Stockmeyer
+        ctxt = res;
+        guard(id1);
+}
+
+void Afhel::polyEvalCtxt(long id1, vector<long> coeffIds){
+        if(coeffIds.empty()){
+            throw std::invalid_argument("Afhel::polyEvalCtxt: no coefficients given");
+        }
+        Ctxt& ctxt = at(id1);
+        Vec<Ctxt> poly(INIT_SIZE, coeffIds.size(), Ctxt(*publicKey));
+        for(long i=0; i<(long)coeffIds.size(); i++){
+            poly[i] = at(coeffIds[i]);
+        }
+        KeyLock keys(keySwitchMutex);
+        Ctxt res(*publicKey);
+        ::polyEval(res, poly, ctxt);                    // Baby-step/giant-step
+        ctxt = res;
+        guard(id1);
 }
 
 // NEGATE
-void Afhel::negate(string id1){
-        ctxtMap.at(id1).negate();
+void Afhel::negate(long id1){
+        at(id1).negate();
+        guard(id1);
+}
+
+void Afhel::negate(const vector<long>& ids){
+        parallelFor(ids.size(), 0, [&](long i){ negate(ids[i]); });
 }
 
 // COMPARE EQUALS
-bool Afhel::equalsTo(string id1, string id2, bool comparePkeys){
-        return ctxtMap.at(id1).equalsTo(ctxtMap.at(id2), comparePkeys);
+bool Afhel::equalsTo(long id1, long id2, bool comparePkeys){
+        return at(id1).equalsTo(at(id2), comparePkeys);
 }
 
 // ROTATE
-void Afhel::rotate(string id1, long c){
-        ea->rotate(ctxtMap.at(id1), c);
+void Afhel::rotate(long id1, long c){
+        KeyLock keys = ensureRotationKeys(vector<long>(1, c));
+        ea->rotate(at(id1), c);
+        guard(id1);
+}
+
+void Afhel::rotate(const vector<long>& ids, long c){
+        KeyLock keys = ensureRotationKeys(vector<long>(1, c));
+        parallelFor(ids.size(), 0, [&](long i){
+            ea->rotate(at(ids[i]), c);
+            guard(ids[i]);
+        });
+}
+
+// ROTATE MANY
+vector<vector<long>> Afhel::rotateMany(const vector<long>& ids, const vector<long>& amounts){
+        vector<long> distinct;                          // Distinct amounts mod nslots
+        vector<long> which(amounts.size());
+        for(size_t a=0; a<amounts.size(); a++){
+            long c = ((amounts[a] % nslots) + nslots) % nslots;
+            which[a] = std::find(distinct.begin(), distinct.end(), c) - distinct.begin();
+            if(which[a] == (long)distinct.size()){ distinct.push_back(c); }
+        }
+        KeyLock keys = ensureRotationKeys(distinct);
+        long n = ids.size(), nd = distinct.size();
+        vector<Ctxt*> rotated(n*nd, NULL);
+        try{
+            parallelFor(n*nd, 0, [&](long t){
+                rotated[t] = new Ctxt(at(ids[t / nd]));
+                if(distinct[t % nd] != 0){ ea->rotate(*rotated[t], distinct[t % nd]); }
+            });
+        }
+        catch(...){
+            for(long t=0; t<n*nd; t++){ delete rotated[t]; }
+            throw;
+        }
+        vector<bool> used(n*nd, false);
+        vector<vector<long>> newIds(amounts.size(), vector<long>(n));
+        for(size_t a=0; a<amounts.size(); a++){
+            for(long i=0; i<n; i++){
+                long t = i*nd + which[a];
+                newIds[a][i] = used[t]? store(rotated[t]) : adopt(rotated[t]);
+                used[t] = true;
+                guard(newIds[a][i]);
+            }
+        }
+        return newIds;
 }
 
 // SHIFT
-void Afhel::shift(string id1, long c){
-        ea->shift(ctxtMap.at(id1), c);
+void Afhel::shift(long id1, long c){
+        KeyLock keys = ensureRotationKeys(vector<long>(1, c));
+        ea->shift(at(id1), c);
+        guard(id1);
+}
+
+void Afhel::shift(const vector<long>& ids, long c){
+        KeyLock keys = ensureRotationKeys(vector<long>(1, c));
+        parallelFor(ids.size(), 0, [&](long i){
+            ea->shift(at(ids[i]), c);
+            guard(ids[i]);
+        });
+}
+
+
+// ------------------------------- LINEAR ALGEBRA -----------------------------
+// MATRIX-VECTOR PRODUCT
+vector<long> Afhel::matVec(const vector<long>& ids, const vector<vector<long>>& matrix){
+        long m = matrix.size();
+        long n = (m > 0)? matrix[0].size() : 0;
+        if(m == 0 || m > nslots || n == 0 || n > nslots){
+            throw std::invalid_argument("Afhel::matVec: matrix must have between 1 and nslots rows and columns");
+        }
+        for(long j=0; j<m; j++){
+            if((long)matrix[j].size() != n){
+                throw std::invalid_argument("Afhel::matVec: all the rows must have the same length");
+            }
+        }
+        // Rotations are cyclic over nslots: unless n == nslots, the vector is
+        //  replicated so that slot t holds v[t mod n] for every t < m+n-1
+        long copies = (n == nslots)? 1 : (m + n - 2)/n + 1;
+        if(copies * n > nslots){
+            throw std::invalid_argument("Afhel::matVec: matrix too large for the number of slots");
+        }
+        long baby = (long)ceil(sqrt((double)n));
+        long giant = (n + baby - 1)/baby;
+
+        // Diagonal i (slot j holds M[j][(j+i) mod n]) goes with baby step
+        //  i%baby and is pre-rotated back by its giant step, then encoded once
+        vector<ZZX> diags(n);
+        vector<bool> nonZero(n, false);
+        vector<bool> babyUsed(baby, false);
+        for(long i=0; i<n; i++){
+            long g = i / baby;
+            vector<long> diag(nslots, 0);
+            for(long j=0; j<m; j++){
+                long v = matrix[j][(j+i) % n];
+                diag[(j + g*baby) % nslots] = v;
+                if(v != 0){ nonZero[i] = true; }
+            }
+            if(nonZero[i]){
+                encode(diags[i], diag);
+                babyUsed[i % baby] = true;
+            }
+        }
+        vector<long> amounts;
+        if(copies > 1){ amounts = windowSumAmounts(copies, -n); }
+        for(long k=1; k<baby; k++){ if(babyUsed[k]){ amounts.push_back(-k); } }
+        for(long g=1; g<giant; g++){ amounts.push_back(-g*baby); }
+        KeyLock keys = ensureRotationKeys(amounts);
+
+        return outOfPlace(ids, [&](long, Ctxt& ctxt){
+            if(copies > 1){ windowSumTo(ctxt, copies, -n, true); }
+            vector<std::unique_ptr<Ctxt>> rotated(baby);  // Baby steps, done once
+            for(long k=0; k<baby; k++){
+                if(!babyUsed[k]){ continue; }
+                rotated[k].reset(new Ctxt(ctxt));
+                if(k > 0){ ea->rotate(*rotated[k], -k); }
+            }
+            std::unique_ptr<Ctxt> result;
+            for(long g=0; g<giant; g++){
+                std::unique_ptr<Ctxt> inner;
+                for(long k=0; k<baby && g*baby+k < n; k++){
+                    long i = g*baby + k;
+                    if(!nonZero[i]){ continue; }
+                    Ctxt term(*rotated[k]);
+                    term.multByConstant(diags[i]);
+                    if(inner){ inner->addCtxt(term); }
+                    else{ inner.reset(new Ctxt(term)); }
+                }
+                if(!inner){ continue; }
+                if(g > 0){ ea->rotate(*inner, -g*baby); }  // Giant step
+                if(result){ result->addCtxt(*inner); }
+                else{ result.swap(inner); }
+            }
+            if(result){ ctxt = *result; }
+            else{ multByConstantTo(ctxt, 0L); }             // Zero matrix
+        });
+}
+
+
+// MATRIX-MATRIX PRODUCT
+vector<long> Afhel::matMul(const vector<long>& idsA, const vector<long>& idsB, long d){
+        checkSizes(idsA, idsB);
+        long D = d*d;
+        if(d < 1 || (D != nslots && 2*D > nslots)){
+            throw std::invalid_argument("Afhel::matMul: d*d must be the number of slots, or at most half of it");
+        }
+
+        // Masks of a permutation of the D slots, grouped by rotation amount.
+        //  source(i, j) is the slot read to fill slot d*i+j.
+        auto diagonals = [&](const std::function<long(long, long)>& source) -> Diagonals {
+            std::map<long, vector<long>> masks;
+            for(long i=0; i<d; i++){
+                for(long j=0; j<d; j++){
+                    long r = ((source(i, j) - (d*i + j)) % D + D) % D;
+                    vector<long>& mask = masks[r];
+                    if(mask.empty()){ mask.assign(nslots, 0); }
+                    mask[d*i + j] = 1;
+                }
+            }
+            Diagonals diags;
+            for(std::map<long, vector<long>>::iterator it = masks.begin(); it != masks.end(); ++it){
+                diags.push_back(std::make_pair(it->first, ZZX()));
+                encode(diags.back().second, it->second);
+            }
+            return diags;
+        };
+        Diagonals sigma = diagonals([&](long i, long j){ return d*i + (i+j)%d; });
+        Diagonals tau = diagonals([&](long i, long j){ return d*((i+j)%d) + j; });
+        vector<Diagonals> phi(d);                       // Column shifts of A
+        for(long k=1; k<d; k++){
+            phi[k] = diagonals([&](long i, long j){ return d*i + (j+k)%d; });
+        }
+
+        vector<long> amounts;
+        if(D < nslots){ amounts = windowSumAmounts(2, -D); }
+        for(long k=0; k<d; k++){
+            const Diagonals& diags = (k == 0)? sigma : phi[k];
+            for(size_t t=0; t<diags.size(); t++){ amounts.push_back(-diags[t].first); }
+            if(k > 0){ amounts.push_back(-d*k); }       // Row shifts of B
+        }
+        for(size_t t=0; t<tau.size(); t++){ amounts.push_back(-tau[t].first); }
+        KeyLock keys = ensureRotationKeys(amounts);
+
+        return outOfPlace(idsA, [&](long p, Ctxt& ctxt){
+            replicate(ctxt, D);
+            std::unique_ptr<Ctxt> a0(applyDiagonals(ctxt, sigma));
+            Ctxt b(at(idsB[p]));
+            matchLevels(ctxt, b);
+            replicate(b, D);
+            std::unique_ptr<Ctxt> b0(applyDiagonals(b, tau));
+            replicate(*b0, D);
+            ctxt = *a0;                                 // 0 from D on, and so the products
+            ctxt.multiplyBy(*b0);
+            replicate(*a0, D);
+            for(long k=1; k<d; k++){
+                std::unique_ptr<Ctxt> ak(applyDiagonals(*a0, phi[k]));
+                Ctxt bk(*b0);
+                ea->rotate(bk, -d*k);
+                ak->multiplyBy(bk);
+                ctxt.addCtxt(*ak);
+            }
+        });
+}
+
+Ctxt* Afhel::applyDiagonals(const Ctxt& ctxt, const Diagonals& diags){
+        std::unique_ptr<Ctxt> result;
+        for(size_t t=0; t<diags.size(); t++){
+            Ctxt term(ctxt);
+            if(diags[t].first != 0){ ea->rotate(term, -diags[t].first); }
+            term.multByConstant(diags[t].second);
+            if(result){ result->addCtxt(term); }
+            else{ result.reset(new Ctxt(term)); }
+        }
+        return result.release();
+}
+
+void Afhel::replicate(Ctxt& ctxt, long D){
+        if(D < nslots){ windowSumTo(ctxt, 2, -D, true); }
+}
+
+
+// ------------------------------- NOISE & CAPACITY ---------------------------
+double Afhel::capacity(long id1){
+    return -at(id1).log_of_ratio()/log(2.0);    // log2(modulus/noise)
+}
+
+double Afhel::noiseBound(long id1){
+    const Ctxt& ctxt = at(id1);
+    if(ctxt.getNoiseVar() == 0){ return 0.0; }
+    return log(ctxt.getNoiseVar())/(2*log(2.0));  // log2(stdev)
+}
+
+void Afhel::setCapacityGuard(double minBits){
+    capacityGuard = std::max(minBits, 0.0);
+}
+
+double Afhel::getCapacityGuard(){ return capacityGuard; }
+
+void Afhel::checkCapacity(long id1){
+    double bits = capacity(id1);
+    if(bits < capacityGuard){
+        throw std::range_error("Afhel: capacity of ciphertext " + std::to_string(id1) +
+            " dropped to " + std::to_string(bits) + " bits, below the guard of " +
+            std::to_string(capacityGuard) + " bits");
+    }
+}
+
+
+// ------------------------------- LEVEL MANAGEMENT ---------------------------
+long Afhel::level(long id1){
+    return at(id1).findBaseLevel();
+}
+
+void Afhel::modDownTo(long id1, long lvl){
+    if(lvl < 1){
+        throw std::invalid_argument("Afhel::modDownTo: level must be >= 1");
+    }
+    Ctxt& ctxt = at(id1);
+    if(ctxt.findBaseLevel() > lvl){ ctxt.modDownToLevel(lvl); }
+}
+
+void Afhel::modDownTo(const vector<long>& ids, long lvl){
+    parallelFor(ids.size(), 0, [&](long i){ modDownTo(ids[i], lvl); });
+}
+
+void Afhel::setAutoModSwitch(bool on){ autoModSwitch = on; }
+
+bool Afhel::getAutoModSwitch(){ return autoModSwitch; }
+
+void Afhel::matchLevels(Ctxt& ctxt1, Ctxt& ctxt2){
+    if(!autoModSwitch){ return; }
+    long lvl1 = ctxt1.findBaseLevel(), lvl2 = ctxt2.findBaseLevel();
+    if(lvl1 > lvl2)     { ctxt1.modDownToLevel(lvl2); }
+    else if(lvl2 > lvl1){ ctxt2.modDownToLevel(lvl1); }
+}
+
+const Ctxt& Afhel::levelled(Ctxt& dest, const Ctxt& other, std::unique_ptr<Ctxt>& tmp){
+    if(!autoModSwitch || &dest == &other){ return other; }
+    long lvlDest = dest.findBaseLevel(), lvlOther = other.findBaseLevel();
+    if(lvlDest > lvlOther){ dest.modDownToLevel(lvlOther); }
+    else if(lvlOther > lvlDest){                // Switch a copy, other stays as is
+        if(tmp.get() != &other){ tmp.reset(new Ctxt(other)); }
+        tmp->modDownToLevel(lvlDest);
+        return *tmp;
+    }
+    return other;
+}
+
+void Afhel::setDepthHint(long depth){
+    if(depth < 0){
+        throw std::invalid_argument("Afhel::setDepthHint: depth must be >= 0");
+    }
+    depthHint = depth;
+}
+
+long Afhel::getDepthHint(){ return depthHint; }
+
+void Afhel::dropToDepth(Ctxt& ctxt){
+    if(depthHint <= 0){ return; }
+    long lvl = (depthHint + 1) * getLevelsPerMult();    // Products, plus one to decrypt
+    if(ctxt.findBaseLevel() > lvl){ ctxt.modDownToLevel(lvl); }
+}
+
+long Afhel::getLevelsPerMult(){
+    std::lock_guard<std::mutex> lock(levelsPerMultMutex);
+    if(levelsPerMult == 0){
+        Ctxt probe(*publicKey);
+        ea->encrypt(probe, *publicKey, vector<long>(nslots, 1));
+        long top = probe.findBaseLevel();
+        KeyLock keys(keySwitchMutex);
+        probe.square();
+        probe.square();
+        levelsPerMult = std::max((top - probe.findBaseLevel() + 1) / 2, 1L);
+    }
+    return levelsPerMult;
+}
+
+
+// ------------------------------- ROTATION KEYS ------------------------------
+void Afhel::setRotationKeys(long mode){
+    if(mode != ROTKEYS_SOME && mode != ROTKEYS_NONE && mode != ROTKEYS_LAZY){
+        throw std::invalid_argument("Afhel::setRotationKeys: unknown rotation keys mode");
+    }
+    rotationKeys = mode;
+}
+
+long Afhel::getRotationKeys(){ return rotationKeys; }
+
+void Afhel::rotationAutomorphisms(long c, vector<long>& vals){
+    const PAlgebra& zMStar = context->zMStar;
+    vals.clear();
+    c = ((c % nslots) + nslots) % nslots;       // Rotations are cyclic
+    if(c == 0){ return; }
+    for(long i=0; i<zMStar.numOfGens(); i++){   // ea rotates along each dimension
+        long ord = zMStar.OrderOf(i);           //  by the coordinate of c (+1 for
+        long ci = zMStar.coordinate(i, c);      //  the carry from lower dimensions)
+        for(long e = ci; e <= ci+1; e++){
+            if(e % ord == 0){ continue; }
+            vals.push_back(zMStar.genToPow(i, e % ord));
+            if(!zMStar.SameOrd(i)){             // Bad dimensions also wrap around
+                vals.push_back(zMStar.genToPow(i, e % ord - ord));
+            }
+        }
+    }
+}
+
+Afhel::KeyLock Afhel::ensureRotationKeys(const vector<long>& amounts){
+    vector<long> vals;
+    if(rotationKeys == ROTKEYS_LAZY){               // Missing matrices, added exclusively
+        std::unique_lock<std::shared_timed_mutex> lock(keySwitchMutex);
+        bool added = false;
+        for(size_t i=0; i<amounts.size(); i++){
+            rotationAutomorphisms(amounts[i], vals);
+            for(size_t j=0; j<vals.size(); j++){
+                if(!secretKey->haveKeySWmatrix(1, vals[j], 0, 0)){
+                    secretKey->GenKeySWmatrix(1, vals[j], 0, 0);
+                    added = true;
+                }
+            }
+        }
+        if(added){ secretKey->setKeySwitchMap(); }
+    }
+    KeyLock keys(keySwitchMutex);                   // Shared while the matrices are used
+    if(rotationKeys == ROTKEYS_NONE){               // SOME: HElib finds a path of matrices
+        for(size_t i=0; i<amounts.size(); i++){
+            rotationAutomorphisms(amounts[i], vals);
+            for(size_t j=0; j<vals.size(); j++){
+                if(!secretKey->haveKeySWmatrix(1, vals[j], 0, 0)){
+                    throw std::invalid_argument("Afhel: no key-switching matrix to rotate by " +
+                        std::to_string(amounts[i]) + " slots, declare it with addRotationKeys");
+                }
+            }
+        }
+    }
+    return keys;
+}
+
+vector<long> Afhel::totalSumsAmounts(){
+    vector<long> amounts;                       // Same steps as HElib's totalSums
+    long e = 1;
+    for(long i = NumBits(nslots)-2; i >= 0; i--){
+        amounts.push_back(e);
+        e = 2*e;
+        if(bit(nslots, i)){
+            amounts.push_back(e);
+            e += 1;
+        }
+    }
+    return amounts;
+}
+
+void Afhel::addRotationKeys(const vector<long>& amounts){
+    std::unique_lock<std::shared_timed_mutex> lock(keySwitchMutex);
+    vector<long> vals;
+    for(size_t i=0; i<amounts.size(); i++){
+        rotationAutomorphisms(amounts[i], vals);
+        for(size_t j=0; j<vals.size(); j++){
+            if(!secretKey->haveKeySWmatrix(1, vals[j], 0, 0)){
+                secretKey->GenKeySWmatrix(1, vals[j], 0, 0);
+            }
+        }
+    }
+    secretKey->setKeySwitchMap();
+}
+
+void Afhel::addFrobeniusKeys(const vector<long>& powers){
+    std::unique_lock<std::shared_timed_mutex> lock(keySwitchMutex);
+    const PAlgebra& zMStar = context->zMStar;
+    for(size_t i=0; i<powers.size(); i++){
+        long val = zMStar.genToPow(-1, powers[i]);  // X -> X^(p^j)
+        if(val != 1 && !secretKey->haveKeySWmatrix(1, val, 0, 0)){
+            secretKey->GenKeySWmatrix(1, val, 0, 0);
+        }
+    }
+    secretKey->setKeySwitchMap();
+}
+
+
+// ------------------------------ PLAINTEXT CACHE -----------------------------
+void Afhel::setPtxtCacheBudget(long nBytes){
+    std::lock_guard<std::mutex> lock(ptxtCacheMutex);
+    ptxtCacheBudget = std::max(nBytes, 0L);
+    while(ptxtCacheBytes > ptxtCacheBudget && !ptxtCache.empty()){
+        ptxtCacheBytes -= ptxtCache.back().bytes;       // Evict LRU entries
+        ptxtCacheIndex.erase(ptxtCache.back().slots);
+        ptxtCache.pop_back();
+    }
+}
+
+void Afhel::clearPtxtCache(){
+    std::lock_guard<std::mutex> lock(ptxtCacheMutex);
+    ptxtCache.clear();
+    ptxtCacheIndex.clear();
+    ptxtCacheBytes = 0;
+    ptxtCacheHits = 0;
+    ptxtCacheMisses = 0;
+}
+
+long Afhel::getPtxtCacheBudget(){ return ptxtCacheBudget; }
+long Afhel::getPtxtCacheBytes(){ return ptxtCacheBytes; }
+long Afhel::getPtxtCacheHits(){ return ptxtCacheHits; }
+long Afhel::getPtxtCacheMisses(){ return ptxtCacheMisses; }
+
+std::shared_ptr<DoubleCRT> Afhel::encodeCached(const vector<long>& ptxt_vect,
+                                          const IndexSet& primeSet){
+    vector<long> slots(ptxt_vect);
+    slots.resize(nslots, 0);                            // Key is the padded vector
+    std::lock_guard<std::mutex> lock(ptxtCacheMutex);
+    boost::unordered_map<vector<long>, PtxtCacheIter>::iterator found =
+        ptxtCacheIndex.find(slots);
+    if(found != ptxtCacheIndex.end()){                  // HIT: move to LRU front
+        ptxtCacheHits++;
+        ptxtCache.splice(ptxtCache.begin(), ptxtCache, found->second);
+        PtxtCacheEntry& entry = ptxtCache.front();
+        if(!(entry.dcrt->getIndexSet() == primeSet)){   // Re-lift to new primes
+            entry.dcrt = std::make_shared<DoubleCRT>(entry.poly, *context, primeSet);
+        }
+        return entry.dcrt;
+    }
+    ptxtCacheMisses++;                                  // MISS: encode & insert
+    PtxtCacheEntry entry;
+    entry.slots = slots;
+    encode(entry.poly, slots);
+    entry.dcrt = std::make_shared<DoubleCRT>(entry.poly, *context, primeSet);
+    entry.bytes = sizeof(long) * context->zMStar.getPhiM() * (card(primeSet) + 1);
+    std::shared_ptr<DoubleCRT> dcrt = entry.dcrt;
+    if(entry.bytes > ptxtCacheBudget){                  // Too big to be cached
+        return dcrt;
+    }
+    ptxtCache.push_front(entry);
+    ptxtCacheIndex[slots] = ptxtCache.begin();
+    ptxtCacheBytes += entry.bytes;
+    while(ptxtCacheBytes > ptxtCacheBudget){            // Evict LRU entries
+        ptxtCacheBytes -= ptxtCache.back().bytes;
+        ptxtCacheIndex.erase(ptxtCache.back().slots);
+        ptxtCache.pop_back();
+    }
+    return dcrt;
 }
 
 
 // ------------------------------------- I/O ----------------------------------
+// Binary formats store integers with the host byte order.
+static void writeU64(ostream& out, uint64_t v){
+    out.write((const char*)&v, sizeof(v));
+}
+static uint64_t readU64(istream& in){
+    uint64_t v;
+    if(!in.read((char*)&v, sizeof(v))){
+        throw std::runtime_error("Afhel: truncated data");
+    }
+    return v;
+}
+
+// Read-only stream buffer over a memory region (no copies)
+struct MemBuf : std::streambuf{
+    MemBuf(const char* data, size_t size){
+        char* p = const_cast<char*>(data);
+        setg(p, p, p + size);
+    }
+};
+
+// Read-only memory mapping of a whole file, unmapped on destruction
+struct MappedFile{
+    const char* data = NULL;
+    size_t size = 0;
+    MappedFile(const string& path){
+        int fd = open(path.c_str(), O_RDONLY);
+        if(fd < 0){ throw std::runtime_error("Afhel: cannot open " + path); }
+        struct stat st;
+        if(fstat(fd, &st) != 0){
+            close(fd);
+            throw std::runtime_error("Afhel: cannot stat " + path);
+        }
+        size = st.st_size;
+        void* mapped = (size > 0)? mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0) : NULL;
+        close(fd);
+        if(mapped == MAP_FAILED){ throw std::runtime_error("Afhel: cannot map " + path); }
+        data = (const char*)mapped;
+    }
+    ~MappedFile(){ if(data != NULL){ munmap((void*)data, size); } }
+};
+
+// 64-bit FNV-1a hash, used as checksum of the binary formats
+static uint64_t fnv1a(const char* data, size_t size, uint64_t h=1469598103934665603ULL){
+    for(size_t i=0; i<size; i++){
+        h ^= (unsigned char)data[i];
+        h *= 1099511628211ULL;
+    }
+    return h;
+}
+
+// Output buffer which forwards every byte to another one, hashing and
+//  counting them on the way
+struct HashingBuf : std::streambuf{
+    std::streambuf* sink;
+    uint64_t hash = 1469598103934665603ULL;
+    uint64_t count = 0;
+    HashingBuf(std::streambuf* sink): sink(sink){}
+protected:
+    int_type overflow(int_type c){
+        if(traits_type::eq_int_type(c, traits_type::eof())){ return traits_type::not_eof(c); }
+        char ch = traits_type::to_char_type(c);
+        hash = fnv1a(&ch, 1, hash);
+        count++;
+        return sink->sputc(ch);
+    }
+    std::streamsize xsputn(const char* data, std::streamsize n){
+        hash = fnv1a(data, n, hash);
+        count += n;
+        return sink->sputn(data, n);
+    }
+};
+
+// Checksummed .aenv header: magic, version, m, p, r, payload size and
+//  checksum of the payload followed by the header fields. The payload holds
+//  the context base, the context, the secret key and G in HElib's text
+//  stream encoding, the same as the legacy format.
+static const char ENV_MAGIC[4] = {'A','E','N','V'};
+static const uint32_t ENV_VERSION = 3;
+struct EnvHeader{
+    char magic[4];
+    uint32_t version;
+    uint64_t m, p, r;
+    uint64_t payloadSize;
+    uint64_t checksum;
+};
+
+static uint64_t envChecksum(const EnvHeader& h, uint64_t payloadHash){
+    return fnv1a((const char*)&h, offsetof(EnvHeader, checksum), payloadHash);
+}
+
 // SAVE ENVIRONMENT
-bool Afhel::saveEnv(string fileName){
+bool Afhel::saveEnv(string fileName, bool checksummed){
     bool res=1;
     try{
-        fstream keyFile(fileName+".aenv", fstream::out|fstream::trunc);
+        fstream keyFile(fileName+".aenv", fstream::out|fstream::trunc|fstream::binary);
         assert(keyFile.is_open());
+        EnvHeader h;
+        memset(&h, 0, sizeof(h));
+        if(checksummed){                        // Placeholder, filled in at the end
+            keyFile.write((const char*)&h, sizeof(h));
+        }
+        HashingBuf hashing(keyFile.rdbuf());    // Payload streamed to the file
+        ostream out(&hashing);
 
-        writeContextBase(keyFile, *context);    // Write m, p, r, gens, ords
-        keyFile << *context << endl;            // Write the rest of the context
-        keyFile << *secretKey << endl;          // Write Secret key
-        keyFile << G <<endl;                    // Write G poly (ea can't be written, we save
+        writeContextBase(out, *context);        // Write m, p, r, gens, ords
+        out << *context << endl;                // Write the rest of the context
+        out << *secretKey << endl;              // Write Secret key
+        out << G <<endl;                        // Write G poly (ea can't be written, we save
                                                 //  G in order to reconstruct ea in restoreEnv)
+        if(out.fail()){ keyFile.setstate(ios::failbit); }
+        if(checksummed){                        // Header with the payload checksum
+            memcpy(h.magic, ENV_MAGIC, 4);
+            h.version = ENV_VERSION;
+            h.m = global_m;
+            h.p = global_p;
+            h.r = global_r;
+            h.payloadSize = hashing.count;
+            h.checksum = envChecksum(h, hashing.hash);
+            keyFile.seekp(0);
+            keyFile.write((const char*)&h, sizeof(h));
+        }
         keyFile.close();
+        res = !keyFile.fail();
     }
     catch(exception& e){
         res=0;
@@ -220,8 +1448,24 @@ bool Afhel::restoreEnv(string fileName){
     unsigned long m1, p1, r1;
     vector<long> gens, ords;
     try{
-        fstream keyFile(fileName+".aenv", fstream::in);
-        assert(keyFile.is_open());
+        MappedFile file(fileName+".aenv");      // Checksummed or legacy text format
+        const char* payload = file.data;
+        size_t payloadSize = file.size;
+        if(file.size >= 4 && memcmp(file.data, ENV_MAGIC, 4) == 0){
+            EnvHeader h;
+            if(file.size < sizeof(h)){
+                throw std::runtime_error("Afhel::restoreEnv: truncated header");
+            }
+            memcpy(&h, file.data, sizeof(h));
+            payload = file.data + sizeof(h);
+            if(h.version != ENV_VERSION || h.payloadSize != file.size - sizeof(h) ||
+               h.checksum != envChecksum(h, fnv1a(payload, h.payloadSize))){
+                throw std::runtime_error("Afhel::restoreEnv: corrupted environment file");
+            }
+            payloadSize = h.payloadSize;
+        }
+        MemBuf buf(payload, payloadSize);
+        istream keyFile(&buf);
 
         readContextBase(keyFile, m1, p1, r1, gens, ords);   
                                                             // Read m, p, r, gens, ords
@@ -235,9 +1479,253 @@ bool Afhel::restoreEnv(string fileName){
         ea = new EncryptedArray(*context, G);   // Reconstruct ea using G
         publicKey = (FHEPubKey*) secretKey;     // Reconstruct Public Key from Secret Key
         nslots = ea->size();                    // Refill nslots
+        clearPtxtCache();                       // Encodings depend on context
+        levelsPerMult = 0;
         global_m = m1;
         global_p = p1; 
         global_r = r1;
+        global_L = -1;
+    }
+    catch(exception& e){
+        res=0;
+    }
+    return res;                                 // 1 if all OK, 0 otherwise
+}
+
+
+// --------------------------- EXPRESSION PROGRAMS ----------------------------
+vector<long> Afhel::evalProgram(const vector<long>& code,
+                                const vector<vector<long>>& inputs,
+                                const vector<vector<vector<long>>>& consts){
+    if(code.size() % 4 != 0){
+        throw std::invalid_argument("Afhel::evalProgram: malformed program");
+    }
+    checkSizes(vector<long>(inputs.size()), vector<long>(consts.size()));
+    vector<long> amounts;                       // Rotations used by the program
+    for(size_t k=0; k<code.size(); k+=4){
+        if(code[k] == EVAL_SUMS){
+            vector<long> sums = partitionSumAmounts(code[k+3]);
+            amounts.insert(amounts.end(), sums.begin(), sums.end());
+        }
+        else if(code[k] == EVAL_SHIFT){ amounts.push_back(code[k+3]); }
+    }
+    KeyLock keys = ensureRotationKeys(amounts);
+    long n = inputs.size();
+    vector<Ctxt*> results(n, NULL);
+    try{
+        parallelFor(n, 0, [&](long j){ results[j] = runProgram(code, inputs[j], consts[j]); });
+    }
+    catch(...){
+        for(long j=0; j<n; j++){ delete results[j]; }
+        throw;
+    }
+    vector<long> ids(n);
+    for(long j=0; j<n; j++){
+        ids[j] = adopt(results[j]);
+        guard(ids[j]);
+    }
+    return ids;
+}
+
+Ctxt* Afhel::runProgram(const vector<long>& code, const vector<long>& inputs,
+                        const vector<vector<long>>& consts){
+    vector<Ctxt*> regs;
+    Ctxt* result = NULL;
+    auto src = [&](long s) -> Ctxt& {           // Register or input ciphertext
+        if(s < 0){ return at(inputs.at(-s-1)); }
+        if(s >= (long)regs.size() || regs[s] == NULL){
+            throw std::invalid_argument("Afhel::evalProgram: read of an empty register");
+        }
+        return *regs[s];
+    };
+    try{
+        for(size_t k=0; k<code.size(); k+=4){
+            long op = code[k], dst = code[k+1], s = code[k+2], arg = code[k+3];
+            if(dst < 0){
+                throw std::invalid_argument("Afhel::evalProgram: invalid register");
+            }
+            if(dst >= (long)regs.size()){ regs.resize(dst+1, NULL); }
+            if(op == EVAL_COPY){
+                Ctxt* copy = new Ctxt(src(s));
+                delete regs[dst];
+                regs[dst] = copy;
+                continue;
+            }
+            Ctxt& d = src(dst);
+            switch(op){
+                case EVAL_ADD:   d.addCtxt(src(s), arg != 0);            break;
+                case EVAL_MUL:   d.multiplyBy(src(s));                   break;
+                case EVAL_MULNR: d.multLowLvl(src(s));                   break;
+                case EVAL_RELIN: d.reLinearize();                        break;
+                case EVAL_NEG:   d.negate();                             break;
+                case EVAL_ADDC:  addConstantTo(d, arg);                  break;
+                case EVAL_ADDV:  addConstantTo(d, consts.at(arg));       break;
+                case EVAL_MULC:  multByConstantTo(d, arg);               break;
+                case EVAL_MULV:  multByConstantTo(d, consts.at(arg));    break;
+                case EVAL_POW:
+                    if(arg < 1){
+                        throw std::invalid_argument("Afhel::evalProgram: exponent must be >= 1");
+                    }
+                    powerOf(d, arg);
+                    break;
+                case EVAL_SUMS:  partitionSumTo(d, arg);                 break;
+                case EVAL_SHIFT: ea->shift(d, arg);                      break;
+                case EVAL_FREE:  delete regs[dst]; regs[dst] = NULL;     break;
+                case EVAL_RET:
+                    delete result;                  // Only the last one counts
+                    result = regs[dst];
+                    regs[dst] = NULL;
+                    break;
+                default:
+                    throw std::invalid_argument("Afhel::evalProgram: unknown opcode");
+            }
+        }
+    }
+    catch(...){
+        for(size_t i=0; i<regs.size(); i++){ delete regs[i]; }
+        delete result;
+        throw;
+    }
+    for(size_t i=0; i<regs.size(); i++){ delete regs[i]; }
+    if(result == NULL){
+        throw std::invalid_argument("Afhel::evalProgram: program returns no result");
+    }
+    return result;
+}
+
+
+// ------------------------------ PARALLELISM ---------------------------------
+void Afhel::setNumWorkers(long n){
+    std::lock_guard<std::mutex> lock(workerPoolMutex);
+    delete workerPool;                          // Pool is rebuilt with new size
+    workerPool = NULL;
+    nWorkers = std::max(n, 1L);
+    if(nWorkers > 1){
+        workerPool = new NTL::BasicThreadPool(nWorkers);
+    }
+}
+
+long Afhel::getNumWorkers(){ return nWorkers; }
+
+void Afhel::setNumThreads(long n){
+    n = std::max(n, 1L);
+    SetNumThreads(n);                           // NTL pool for DoubleCRT ops
+    setNumWorkers(n);                           // Worker pool across ctxts
+}
+
+long Afhel::getNumThreads(){ return AvailableThreads(); }
+
+void Afhel::setParallelMode(long mode){
+    if(mode != PARALLEL_AUTO && mode != PARALLEL_INTRA && mode != PARALLEL_INTER){
+        throw std::invalid_argument("Afhel::setParallelMode: unknown parallel mode");
+    }
+    parallelMode = mode;
+}
+
+long Afhel::getParallelMode(){ return parallelMode; }
+
+void Afhel::parallelFor(long n, long nThreads, const std::function<void(long)>& body){
+    bool useWorkers = (nThreads <= 0);          // Default to the parallel mode
+    if(useWorkers){
+        bool inter = (parallelMode == PARALLEL_INTER) ||
+                     (parallelMode == PARALLEL_AUTO && n >= nWorkers);
+        nThreads = inter? nWorkers : 1;         // INTRA: NTL pool inside each op
+    }
+    nThreads = std::min(nThreads, n);
+    if(nThreads <= 1){                          // Sequential in calling thread
+        for(long i=0; i<n; i++){ body(i); }
+        return;
+    }
+    auto chunk = [&](long first, long last){
+        for(long i=first; i<last; i++){ body(i); }
+    };
+    std::unique_lock<std::mutex> lock(workerPoolMutex, std::try_to_lock);
+    if(lock.owns_lock() && workerPool != NULL &&
+       (useWorkers || nThreads == workerPool->NumThreads())){
+        workerPool->exec_range(n, chunk);       // Reuse the idle worker pool
+    }
+    else{
+        if(lock.owns_lock()){ lock.unlock(); }
+        NTL::BasicThreadPool pool(nThreads);    // Pool busy or of another size
+        pool.exec_range(n, chunk);
+    }
+}
+
+void Afhel::checkSizes(const vector<long>& ids1, const vector<long>& ids2){
+    if(ids1.size() != ids2.size()){
+        throw std::invalid_argument("Afhel: handle vectors have mismatched lengths");
+    }
+}
+
+
+// CIPHERTEXT SERIALIZATION
+static const char CTXT_MAGIC[4]  = {'A','C','T','X'};
+static const char CTXTS_MAGIC[4] = {'A','C','T','S'};
+static const uint32_t CTXT_VERSION = 1;
+
+// Parse a serialized ctxt blob laid out in memory
+static Ctxt* parseCtxt(const char* data, size_t size, const FHEPubKey& pubKey){
+    if(size < 4 + sizeof(uint32_t) + sizeof(uint64_t) ||
+       memcmp(data, CTXT_MAGIC, 4) != 0){
+        throw std::runtime_error("Afhel::deserialize: not a serialized ciphertext");
+    }
+    uint32_t version;
+    uint64_t payloadSize;
+    memcpy(&version, data + 4, sizeof(version));
+    memcpy(&payloadSize, data + 4 + sizeof(version), sizeof(payloadSize));
+    size_t headerSize = 4 + sizeof(version) + sizeof(payloadSize);
+    if(version != CTXT_VERSION){
+        throw std::runtime_error("Afhel::deserialize: unsupported ciphertext format version");
+    }
+    if(payloadSize > size - headerSize){
+        throw std::runtime_error("Afhel: truncated ciphertext data");
+    }
+    MemBuf buf(data + headerSize, payloadSize);
+    istream in(&buf);
+    Ctxt* ctxt = new Ctxt(pubKey);
+    in >> *ctxt;
+    if(in.fail()){
+        delete ctxt;
+        throw std::runtime_error("Afhel::deserialize: corrupted ciphertext data");
+    }
+    return ctxt;
+}
+
+string Afhel::serialize(long id1){
+    ostringstream payload;
+    payload << at(id1);
+    string body = payload.str();
+    ostringstream out;
+    out.write(CTXT_MAGIC, 4);
+    out.write((const char*)&CTXT_VERSION, sizeof(CTXT_VERSION));
+    writeU64(out, body.size());
+    out << body;
+    return out.str();
+}
+
+long Afhel::deserialize(const string& data){
+    return adopt(parseCtxt(data.data(), data.size(), *publicKey));
+}
+
+// SAVE CIPHERTEXTS
+bool Afhel::saveCtxts(string fileName, const vector<long>& ids,
+                      const vector<long>& lens){
+    checkSizes(ids, lens);
+    bool res=1;
+    try{
+        ofstream ctxtFile(fileName+".actx", ofstream::out|ofstream::trunc|ofstream::binary);
+        if(!ctxtFile.is_open()){ return 0; }
+        ctxtFile.write(CTXTS_MAGIC, 4);
+        ctxtFile.write((const char*)&CTXT_VERSION, sizeof(CTXT_VERSION));
+        writeU64(ctxtFile, ids.size());
+        for(size_t i=0; i<ids.size(); i++){
+            string blob = serialize(ids[i]);
+            writeU64(ctxtFile, lens[i]);        // Length, size & blob per ctxt
+            writeU64(ctxtFile, blob.size());
+            ctxtFile.write(blob.data(), blob.size());
+        }
+        ctxtFile.close();
+        res = !ctxtFile.fail();
     }
     catch(exception& e){
         res=0;
@@ -245,6 +1733,83 @@ bool Afhel::restoreEnv(string fileName){
     return res;                                 // 1 if all OK, 0 otherwise
 }
 
+// LOAD CIPHERTEXTS
+vector<long> Afhel::loadCtxts(string fileName, vector<long>& lens, bool useMmap){
+    string path = fileName+".actx";
+    vector<Ctxt*> ctxts;
+    lens.clear();
+    size_t headerSize = 4 + sizeof(uint32_t) + sizeof(uint64_t);
+    try{
+        if(useMmap){                            // Parse straight from the mapping
+            MappedFile file(path);
+            const char* data = file.data;
+            size_t size = file.size;
+            uint32_t version;
+            uint64_t count;
+            if(size < headerSize || memcmp(data, CTXTS_MAGIC, 4) != 0){
+                throw std::runtime_error("Afhel::loadCtxts: not a ciphertext file " + path);
+            }
+            memcpy(&version, data + 4, sizeof(version));
+            if(version != CTXT_VERSION){
+                throw std::runtime_error("Afhel::loadCtxts: unsupported ciphertext file version in " + path);
+            }
+            memcpy(&count, data + 4 + sizeof(version), sizeof(count));
+            size_t offset = headerSize;
+            for(uint64_t i=0; i<count; i++){
+                uint64_t len, blobSize;
+                if(offset + 2*sizeof(uint64_t) > size){
+                    throw std::runtime_error("Afhel: truncated ciphertext data");
+                }
+                memcpy(&len, data + offset, sizeof(len));
+                memcpy(&blobSize, data + offset + sizeof(len), sizeof(blobSize));
+                offset += 2*sizeof(uint64_t);
+                if(blobSize > size - offset){
+                    throw std::runtime_error("Afhel: truncated ciphertext data");
+                }
+                ctxts.push_back(parseCtxt(data + offset, blobSize, *publicKey));
+                lens.push_back(len);
+                offset += blobSize;
+            }
+        }
+        else{                                   // Large buffered reads
+            ifstream ctxtFile(path, ifstream::in|ifstream::binary);
+            if(!ctxtFile.is_open()){ throw std::runtime_error("Afhel::loadCtxts: cannot open " + path); }
+            vector<char> streamBuf(1 << 20);
+            ctxtFile.rdbuf()->pubsetbuf(streamBuf.data(), streamBuf.size());
+            char magic[4];
+            uint32_t version;
+            if(!ctxtFile.read(magic, 4) || memcmp(magic, CTXTS_MAGIC, 4) != 0 ||
+               !ctxtFile.read((char*)&version, sizeof(version))){
+                throw std::runtime_error("Afhel::loadCtxts: not a ciphertext file " + path);
+            }
+            if(version != CTXT_VERSION){
+                throw std::runtime_error("Afhel::loadCtxts: unsupported ciphertext file version in " + path);
+            }
+            uint64_t count = readU64(ctxtFile);
+            string blob;
+            for(uint64_t i=0; i<count; i++){
+                uint64_t len = readU64(ctxtFile);
+                blob.resize(readU64(ctxtFile));
+                if(!ctxtFile.read(&blob[0], blob.size())){
+                    throw std::runtime_error("Afhel: truncated ciphertext data");
+                }
+                ctxts.push_back(parseCtxt(blob.data(), blob.size(), *publicKey));
+                lens.push_back(len);
+            }
+        }
+    }
+    catch(...){
+        for(size_t i=0; i<ctxts.size(); i++){ delete ctxts[i]; }
+        lens.clear();
+        throw;
+    }
+    vector<long> ids(ctxts.size());
+    for(size_t i=0; i<ctxts.size(); i++){       // Store in file order
+        ids[i] = adopt(ctxts[i]);
+    }
+    return ids;
+}
+
 
 // --------------------------------- AUXILIARY --------------------------------
 
@@ -255,35 +1820,83 @@ long Afhel::numSlots() {
 long Afhel::getM(){ return global_m; }
 long Afhel::getP(){ return global_p; }
 long Afhel::getR(){ return global_r; }
+long Afhel::getL(){ return global_L; }
 
-string Afhel::store(Ctxt* ctxt) {
-    struct timeval tp;
-    gettimeofday(&tp, NULL);
-    long int ms = tp.tv_sec * 1000 + tp.tv_usec / 1000;
-    string id1 = boost::lexical_cast<string>(ms);
-    ctxtMap.insert(make_pair(id1, *ctxt));
+long Afhel::store(Ctxt* ctxt) {
+    return adopt(new Ctxt(*ctxt));
+}
+
+long Afhel::adopt(Ctxt* ctxt) {
+    std::unique_lock<std::shared_timed_mutex> lock(slabMutex);
+    long slot;
+    if(!freeSlots.empty()){                     // Recycle a free slot if any
+        slot = freeSlots.back();
+        freeSlots.pop_back();
+        ctxtSlab[slot].ctxt = ctxt;
+    }
+    else{                                       // Otherwise grow the slab
+        slot = ctxtSlab.size();
+        if(slot > SLOT_MASK){
+            delete ctxt;
+            throw std::length_error("Afhel::store: too many ciphertexts stored");
+        }
+        CtxtSlot newSlot = {-1, ctxt};
+        ctxtSlab.push_back(newSlot);
+    }
+    long id1 = (nextSerial++ << SLOT_BITS) | slot;
+    ctxtSlab[slot].handle = id1;
     return id1;
 }
 
-string Afhel::set(string id1){
-    Ctxt ctxt = ctxtMap.at(id1);
-    return store(&ctxt);
+Ctxt& Afhel::at(long id1) {
+    std::shared_lock<std::shared_timed_mutex> lock(slabMutex);
+    long slot = id1 & SLOT_MASK;
+    if(id1 < 0 || slot >= (long)ctxtSlab.size() || ctxtSlab[slot].handle != id1) {
+        throw std::out_of_range("Afhel: invalid ciphertext handle");
+    }
+    return *(ctxtSlab[slot].ctxt);
+}
+
+void Afhel::encode(ZZX& poly, const vector<long>& ptxt_vect) {
+    if((long)ptxt_vect.size() > nslots){
+        throw std::invalid_argument("Afhel::encode: more values than plaintext slots");
+    }
+    vector<long> slots(ptxt_vect);
+    slots.resize(nslots, 0);                    // Pad with zeros up to nslots
+    ea->encode(poly, slots);
+}
+
+long Afhel::set(long id1){
+    return store(&at(id1));
+}
+
+const Ctxt& Afhel::retrieve(long id1) {
+    return at(id1);
 }
 
-Ctxt Afhel::retrieve(string id1) {
-    return ctxtMap.at(id1);
+void Afhel::replace(long id1, const Ctxt& new_ctxt) {
+    replace(id1, new Ctxt(new_ctxt));
 }
 
-void Afhel::replace(string id1, Ctxt new_ctxt) {
-    boost::unordered_map<string, Ctxt>::const_iterator i = ctxtMap.find(id1);
-    if(i != ctxtMap.end()) {
-        ctxtMap.at(id1) = new_ctxt;
+void Afhel::replace(long id1, Ctxt* new_ctxt) {
+    std::unique_lock<std::shared_timed_mutex> lock(slabMutex);
+    long slot = id1 & SLOT_MASK;
+    if(id1 < 0 || slot >= (long)ctxtSlab.size() || ctxtSlab[slot].handle != id1) {
+        delete new_ctxt;
+        throw std::out_of_range("Afhel: invalid ciphertext handle");
     }
+    delete ctxtSlab[slot].ctxt;                 // Ownership moves into the slab
+    ctxtSlab[slot].ctxt = new_ctxt;
 }
 
-void Afhel::erase(string id1) {
-    if(ctxtMap.find(id1) != ctxtMap.end()) {
-        ctxtMap.erase(id1);
+void Afhel::erase(long id1) {
+    std::unique_lock<std::shared_timed_mutex> lock(slabMutex);
+    long slot = id1 & SLOT_MASK;
+    if(id1 >= 0 && slot < (long)ctxtSlab.size() && ctxtSlab[slot].handle == id1) {
+        delete ctxtSlab[slot].ctxt;
+        ctxtSlab[slot].ctxt = NULL;
+        ctxtSlab[slot].handle = -1;
+        freeSlots.push_back(slot);              // Slot can be recycled by store
     }
 }
 
@@ -6,10 +6,10 @@
  *  addition, multiplication, scalar product and others.
  *
  *  Afhel implements a higher level of abstraction than HElib, and handles
- *  Cyphertexts using an unordered map (key-value pairs) that is accessed
- *  via keys of type string. This is done in order to manage Cyphertext 
- *  using references (the keys), which will allow Pyfhel to work only 
- *  using strings (keeping the Cyphertexts in C++). Afhel also compresses
+ *  Cyphertexts using a slab of slots that is accessed via integer handles.
+ *  This is done in order to manage Cyphertext using references (the
+ *  handles), which will allow Pyfhel to work only using integers (keeping
+ *  the Cyphertexts in C++). Afhel also compresses
  *  the Context setup and Key generation into one single KeyGen function
  *  with multiple parameter selection.
  *  --------------------------------------------------------------------
@@ -43,8 +43,15 @@
 #include <sys/time.h>
 #include <string.h>
 
+#include <stdexcept>
+#include <list>
+#include <memory>
+#include <mutex>
+#include <shared_mutex>
+#include <functional>
+
 #include <boost/unordered_map.hpp>
-#include <boost/lexical_cast.hpp>
+#include <NTL/BasicThreadPool.h>
 
 #include "FHE.h"
 #include "EncryptedArray.h"
@@ -60,20 +67,289 @@ class Afhel{
         ZZX G;                                      // NTL Poly used to create ea
         EncryptedArray *ea;                         // Array used for encryption
 
-        boost::unordered_map<string, Ctxt> ctxtMap; // Unordered map which stores the ciphertexts
+        // A handle is built as (serial << SLOT_BITS) | slot: the serial grows
+        //  with every store, so handles are unique and monotonically increasing,
+        //  while the slot gives O(1) access to the slab and is recycled.
+        static const long SLOT_BITS = 24;
+        static const long SLOT_MASK = (1L << SLOT_BITS) - 1;
+        struct CtxtSlot{
+            long handle;                            // Handle currently owning the slot (-1 if free)
+            Ctxt *ctxt;                             // Ciphertext stored in the slot
+        };
+        vector<CtxtSlot> ctxtSlab;                  // Slab which stores the ciphertexts
+        vector<long> freeSlots;                     // Free list of recyclable slots in ctxtSlab
+        long nextSerial = 0;                        // Serial of the next handle given out
+        // Operations run without the GIL, so the slab is guarded here: handle
+        //  lookups share the lock, while adopt, replace and erase take it
+        //  exclusively. Ciphertexts live on the heap, so the references given
+        //  out by at() stay valid when ctxtSlab grows.
+        mutable std::shared_timed_mutex slabMutex;
+
+        // Cache of encoded plaintexts, keyed by their slot contents. Entries are
+        //  kept in LRU order (most recent first) and evicted past the budget.
+        struct PtxtCacheEntry{
+            vector<long> slots;                     // Slot contents, padded to nslots
+            ZZX poly;                               // Plaintext encoded with ea
+            std::shared_ptr<DoubleCRT> dcrt;        // poly over the last prime set used
+            long bytes;                             // Estimated memory footprint
+        };
+        typedef std::list<PtxtCacheEntry>::iterator PtxtCacheIter;
+        std::list<PtxtCacheEntry> ptxtCache;        // LRU list of cached plaintexts
+        boost::unordered_map<vector<long>, PtxtCacheIter> ptxtCacheIndex;
+        std::mutex ptxtCacheMutex;                  // Guards the cache and its counters
+        long ptxtCacheBudget = 0;                   // Memory budget in bytes (0 = disabled)
+        long ptxtCacheBytes = 0;                    // Memory currently used by the cache
+        long ptxtCacheHits = 0, ptxtCacheMisses = 0;
         
+        // Worker pool used to spread independent ciphertexts across threads
+        NTL::BasicThreadPool *workerPool = NULL;    // NULL when running sequentially
+        std::mutex workerPoolMutex;                 // Taken while the pool is running
+        long nWorkers = 1;                          // Number of threads in the pool
+        long parallelMode = PARALLEL_AUTO;          // Where threads are used in operations
+
+        double capacityGuard = 0;                   // Min. capacity in bits (0 = disabled)
+        bool autoModSwitch = false;                 // Match levels before binary ops
+        long depthHint = 0;                         // Depth left for fresh ctxts (0 = off)
+        long levelsPerMult = 0;                     // Measured on first use (0 = unknown)
+        std::mutex levelsPerMultMutex;              // Guards its measurement
+
+        // Key-switching matrices for rotations
+        long rotationKeys = ROTKEYS_SOME;           // Mode used by keyGen and rotations
+        // Shared by the operations that rotate or relinearize while they use
+        //  the matrices (taken once by the calling thread, never by the workers
+        //  of parallelFor), exclusive while addRotationKeys or ROTKEYS_LAZY add
+        //  new ones
+        std::shared_timed_mutex keySwitchMutex;
+        typedef std::shared_lock<std::shared_timed_mutex> KeyLock;
+
         long global_m, global_p, global_r;
+        long global_L = -1;             // Levels used by the last keyGen
+
+        /**
+        * @brief Store a copy of the ciphertext in a free slot of the slab and
+        * return the handle where it was stored
+        * @param ctxt Ciphertext to store in the slab
+        * @return the handle used to locate this ciphertext in the slab
+        */
+        long store(Ctxt* ctxt);
+
+        /**
+        * @brief Store the ciphertext in a free slot of the slab without copying
+        * it. The slab takes ownership of the pointer.
+        * @param ctxt Heap-allocated ciphertext to store in the slab
+        * @return the handle used to locate this ciphertext in the slab
+        */
+        long adopt(Ctxt* ctxt);
+
+        /**
+        * @brief Access the ciphertext stored in the slab under handle id1
+        * @param id1 handle of ctxt in the slab
+        * @return reference to the ciphertext. Throws std::out_of_range if the
+        *  handle is unknown or was already erased.
+        */
+        Ctxt& at(long id1);
 
         /**
-        * @brief Store the ciphertext in the unordered map and return key where 
-        * it was stored
-        * @param ctxt Ciphertext to store in unordered map
-        * @return the ID used to locate this ciphertext in the unordered map
+        * @brief Encode a plaintext vector into a polynomial using ea. The
+        * vector is padded with zeros up to nslots.
+        * @param poly polynomial where the encoded plaintext is written
+        * @param ptxt_vect plaintext vector to encode
         */
-        string store(Ctxt* ctxt);
+        void encode(ZZX& poly, const vector<long>& ptxt_vect);
+
+        /**
+        * @brief Encode a plaintext vector into a DoubleCRT over primeSet, going
+        * through the plaintext cache. On a hit the encoding is skipped.
+        * @param ptxt_vect plaintext vector to encode
+        * @param primeSet primes of the ciphertext the plaintext is applied to
+        * @return the encoded plaintext, valid even if it is later evicted
+        */
+        std::shared_ptr<DoubleCRT> encodeCached(const vector<long>& ptxt_vect,
+                                                const IndexSet& primeSet);
+
+
+        /**
+        * @brief Run body(i) for every i in [0, n), spreading the indexes across
+        * threads. The first exception thrown by body is rethrown to the caller.
+        * @param n number of indexes
+        * @param nThreads number of threads to use. If <= 0, the parallel mode
+        *  decides: the worker pool (inter-op) or a sequential loop that leaves
+        *  the threads to HElib's DoubleCRT operations (intra-op).
+        * @param body function applied to each index
+        */
+        void parallelFor(long n, long nThreads, const std::function<void(long)>& body);
+
+        /**
+        * @brief Throw std::invalid_argument if both handle vectors differ in size
+        */
+        void checkSizes(const vector<long>& ids1, const vector<long>& ids2);
+
+        /**
+        * @brief Plaintext and power operations over a ciphertext outside the
+        * slab, shared by the operations on handles and by evalProgram. The
+        * caller holds a KeyLock for powerOf.
+        */
+        void addConstantTo(Ctxt& ctxt, long c);
+        void addConstantTo(Ctxt& ctxt, const vector<long>& ptxt_vect);
+        void multByConstantTo(Ctxt& ctxt, long c);
+        void multByConstantTo(Ctxt& ctxt, const vector<long>& ptxt_vect);
+        void powerOf(Ctxt& ctxt, long n);
+
+        /**
+        * @brief Sum of the products ids1[i]*ids2[i] relinearized once, as a
+        * new heap-allocated ciphertext not yet in the slab.
+        */
+        Ctxt* productSum(const vector<long>& ids1, const vector<long>& ids2);
+
+        /**
+        * @brief mult3 and fma on handles, for a caller that already holds a
+        * KeyLock.
+        */
+        void mult3To(long id1, long id2, long id3);
+        void fmaTo(long acc, long id1, long id2);
+
+        /**
+        * @brief Apply op to a new copy of each ciphertext at ids, in parallel,
+        * and store the results in new slots of the slab.
+        * @return IDs of the results in the slab
+        */
+        vector<long> outOfPlace(const vector<long>& ids,
+                                const std::function<void(long, Ctxt&)>& op);
+
+        /**
+        * @brief Run an expression program (see evalProgram) over one set of
+        * inputs and return the resulting ciphertext, not yet in the slab.
+        */
+        Ctxt* runProgram(const vector<long>& code, const vector<long>& inputs,
+                         const vector<vector<long>>& consts);
+
+        /**
+        * @brief Check the capacity of a ciphertext after an operation if the
+        * capacity guard is enabled.
+        * @param id1 ID of ctxt in the slab
+        */
+        void guard(long id1){ if(capacityGuard > 0){ checkCapacity(id1); } }
+        void checkCapacity(long id1);
+
+        /**
+        * @brief If autoModSwitch is enabled, modulus-switch the higher of two
+        * ciphertexts owned by the caller down to the level of the other one.
+        */
+        void matchLevels(Ctxt& ctxt1, Ctxt& ctxt2);
+
+        /**
+        * @brief Operand of a binary operation on dest at the level of dest, if
+        * autoModSwitch is enabled. dest, which the operation overwrites, is
+        * switched in place when it is higher; a higher other is never
+        * modified, a switched copy of it is kept in tmp and returned instead.
+        * @param dest ciphertext the operation writes to
+        * @param other second operand, possibly owned by the caller
+        * @param tmp holds the switched copy of other, if any
+        * @return other or its switched copy
+        */
+        const Ctxt& levelled(Ctxt& dest, const Ctxt& other, std::unique_ptr<Ctxt>& tmp);
+
+        /**
+        * @brief Modulus-switch a fresh ciphertext down to the lowest level
+        * that fits the depth hint, if one is set.
+        */
+        void dropToDepth(Ctxt& ctxt);
+
+        /**
+        * @brief Levels consumed by one multiplication in this context,
+        * measured once per context by squaring a fresh ciphertext twice.
+        */
+        long getLevelsPerMult();
+
+        /**
+        * @brief Automorphisms X -> X^val used by ea to rotate by c slots
+        * @param c number of slots to rotate
+        * @param vals filled with the exponents of the automorphisms
+        */
+        void rotationAutomorphisms(long c, vector<long>& vals);
+
+        /**
+        * @brief Make sure the key-switching matrices to rotate by each amount
+        * are available, generating them in ROTKEYS_LAZY mode. Hold the returned
+        * lock while rotating, so no other thread adds matrices meanwhile.
+        * @param amounts numbers of slots to rotate
+        * @return shared lock on the key-switching matrices
+        * @throws std::invalid_argument if a matrix is missing in ROTKEYS_NONE mode
+        */
+        KeyLock ensureRotationKeys(const vector<long>& amounts);
+
+        /**
+        * @brief Rotation amounts used by totalSums (cumSum and scalarProd)
+        */
+        vector<long> totalSumsAmounts();
+
+        /**
+        * @brief Replace each slot i with the sum of the slots i + step*j for
+        * j in [0, width), with O(log width) rotations (cyclic) or shifts.
+        */
+        void windowSumTo(Ctxt& ctxt, long width, long step, bool cyclic);
+        vector<long> windowSumAmounts(long width, long step);
+
+        /**
+        * @brief Replace each slot i with the sum of slots 0..i, with O(log nslots) shifts.
+        */
+        void prefixSumTo(Ctxt& ctxt);
+
+        /**
+        * @brief Shift amounts used by prefixSum
+        */
+        vector<long> prefixSumAmounts();
+
+        /**
+        * @brief Sum the slots of ctxt inside each block of partitionSize
+        * consecutive slots, replicating each sum in all the slots of its block.
+        * With partitionSize 0 (or nslots) this is totalSums.
+        * @throws std::invalid_argument if partitionSize does not divide nslots
+        */
+        void partitionSumTo(Ctxt& ctxt, long partitionSize);
+        vector<long> partitionSumAmounts(long partitionSize);
+
+        // Generalized diagonals of a linear transform over slots: rotation
+        //  amount and encoded mask
+        typedef vector<std::pair<long, ZZX>> Diagonals;
+
+        /**
+        * @brief Linear transform of the first D slots given by its generalized
+        * diagonals: slot l of the result is the sum over (r, diag) of
+        * diag[l] * x[(l+r) mod D], and the slots from D on are 0. The input
+        * must be replicated (see replicate) if D < nslots.
+        * @return the result, as a new heap-allocated ciphertext
+        */
+        Ctxt* applyDiagonals(const Ctxt& ctxt, const Diagonals& diags);
+
+        /**
+        * @brief Copy the first D slots of ctxt (the others being 0) into the
+        * slots [D, 2D), so that rotations by less than D act as rotations
+        * over D slots. Nothing to do if D == nslots.
+        */
+        void replicate(Ctxt& ctxt, long D);
 
 
     public:
+        // Parallel modes: how threads are used by operations over several
+        //  ciphertexts. INTRA runs them one after another, each one using NTL's
+        //  thread pool at DoubleCRT level. INTER spreads them across the worker
+        //  pool. AUTO picks INTER if there are at least as many ciphertexts as
+        //  workers, INTRA otherwise.
+        enum ParallelMode { PARALLEL_AUTO=0, PARALLEL_INTRA=1, PARALLEL_INTER=2 };
+
+        // Rotation key modes: which key-switching matrices for rotations are
+        //  generated. SOME generates HElib's default set in keyGen. NONE only
+        //  keeps the ones declared with addRotationKeys/addFrobeniusKeys. LAZY
+        //  generates the ones each rotation needs the first time it runs.
+        enum RotationKeys { ROTKEYS_SOME=0, ROTKEYS_NONE=1, ROTKEYS_LAZY=2 };
+
+        // Opcodes of the expression programs run by evalProgram
+        enum EvalOp { EVAL_COPY=0, EVAL_ADD=1, EVAL_MUL=2, EVAL_MULNR=3,
+                      EVAL_RELIN=4, EVAL_NEG=5, EVAL_ADDC=6, EVAL_ADDV=7,
+                      EVAL_MULC=8, EVAL_MULV=9, EVAL_POW=10, EVAL_SUMS=11,
+                      EVAL_SHIFT=12, EVAL_FREE=13, EVAL_RET=14 };
+
         Afhel();
         virtual ~Afhel();
         
@@ -105,127 +381,601 @@ class Afhel{
         // ENCRYPTION
         /**
          * @brief Enctypts a provided plaintext vector and stores the cyphertext
-         * in the unordered map, returning the key(string) used to access it.
+         * in the slab, returning the handle used to access it.
          * The encryption is carried out with HElib. 
          * @param ptxt_vect plaintext vector to encrypt
-         * @return id (string) used to access ciphertext in the ctxtMap.
+         * @return handle used to access ciphertext in the slab.
          */
-        string encrypt(vector<long> ptxt_vect);
+        long encrypt(vector<long> ptxt_vect);
+
+        /**
+         * @brief Encrypts nRows plaintext vectors laid out contiguously in a
+         * row-major buffer. Each row is padded with fill up to nslots. Rows are
+         * spread across nThreads threads (the worker pool if nThreads <= 0),
+         * and the ciphertexts are stored in the slab in row order.
+         * @param data row-major buffer of nRows x nCols plaintext values
+         * @param nRows number of rows (ciphertexts) to encrypt
+         * @param nCols number of values per row, at most nslots
+         * @param fill value used to pad each row up to nslots
+         * @param nThreads number of threads used to encrypt the rows
+         * @return handles used to access the ciphertexts in the slab.
+         */
+        vector<long> encryptArray(const long* data, long nRows, long nCols,
+                                  long fill=0, long nThreads=0);
         
         // DECRYPTION
         /**
-         * @brief Decrypts the cyphertext accessed in the ctxtMap using the id.
+         * @brief Decrypts the cyphertext accessed in the slab using the id.
          * The decryption is carried out with HElib.
-         * @param id (string) used to access ciphertext in the ctxtMap.
+         * @param id1 handle used to access ciphertext in the slab.
          * @return plaintext, the result of decrypting the ciphertext
          */
-        vector<long> decrypt(string id1);
+        vector<long> decrypt(long id1);
+
+        /**
+         * @brief Decrypts the ciphertexts at handles ids into a row-major buffer,
+         * writing the first nCols slots of each one in its own row. Rows are
+         * spread across nThreads threads (the worker pool if nThreads <= 0).
+         * @param ids handles of the ciphertexts in the slab, one per row
+         * @param out row-major buffer of ids.size() x nCols values
+         * @param nCols number of slots written per row, at most nslots
+         * @param nThreads number of threads used to decrypt the rows
+         */
+        void decryptArray(const vector<long>& ids, long* out, long nCols,
+                          long nThreads=0);
         
         // -------------------------- OPERATIONS ------------------------------
         // ADDITION
         /**
          * @brief Add ciphertext at key to ciphertext at other_key and store result
-         * back in unordered map at key
-         * @param id1 ID of ctxt1 in unordered map
-         * @param id2 ID of ctxt2 in unordered map
+         * back in the slab at key
+         * @param id1 ID of ctxt1 in the slab
+         * @param id2 ID of ctxt2 in the slab
          * @param negative if True then perform subtraction
          */
-        void add(string id1, string id2, bool negative=false);
+        void add(long id1, long id2, bool negative=false);
+        void add(const vector<long>& ids1, const vector<long>& ids2,
+                 bool negative=false);
+
+        // ADDITION OF CONSTANT
+        /**
+         * @brief Add a plaintext constant to ciphertext at id1, without
+         * encrypting it. The constant is either a scalar applied to all slots
+         * or a vector with one value per slot (padded with zeros).
+         * @param id1 ID of ctxt in the slab
+         * @param c scalar constant
+         * @param ptxt_vect plaintext vector with per-slot constants
+         * @param negative if True then perform subtraction
+         */
+        void addConstant(long id1, long c, bool negative=false);
+        void addConstant(long id1, vector<long> ptxt_vect, bool negative=false);
         
         // MULTIPLICATION
         /**
          * @breif Multiply ciphertext at key by ciphertext at other_key and store
-         * result in unordered map at key
-         * @param id1 ID of ctxt 1 in unordered map
-         * @param id2 ID of ctxt 2 in unordered map
-         * @param id3 ID of ctxt 3 in unordered map
+         * result in the slab at key
+         * @param id1 ID of ctxt 1 in the slab
+         * @param id2 ID of ctxt 2 in the slab
+         * @param id3 ID of ctxt 3 in the slab
          */
-        void mult(string id1, string id2);
-        void mult3(string id1, string id2, string id3);
+        void mult(long id1, long id2);
+        void mult3(long id1, long id2, long id3);
+        void mult(const vector<long>& ids1, const vector<long>& ids2);
+        void mult3(const vector<long>& ids1, const vector<long>& ids2,
+                   const vector<long>& ids3);
+
+        // OUT-OF-PLACE OPERATIONS
+        /**
+         * @brief Three-address versions of the operations above: the result
+         * is written directly into a newly allocated slot of the slab and the
+         * operands are left untouched, so no separate duplicate is needed.
+         * The vector versions run over all the IDs in parallel.
+         * @param id1 ID (or IDs) of ctxt 1 in the slab
+         * @param id2 ID (or IDs) of ctxt 2 in the slab
+         * @param c scalar constant
+         * @param ptxts plaintext vectors with per-slot constants, one per ID
+         * @param negative if True then perform subtraction
+         * @param n exponent, >= 1
+         * @return ID (or IDs) of the results in the slab
+         */
+        long addNew(long id1, long id2, bool negative=false);
+        long multNew(long id1, long id2);
+        vector<long> addNew(const vector<long>& ids1, const vector<long>& ids2,
+                            bool negative=false);
+        vector<long> multNew(const vector<long>& ids1, const vector<long>& ids2);
+        vector<long> addConstantNew(const vector<long>& ids, long c, bool negative=false);
+        vector<long> addConstantNew(const vector<long>& ids,
+                                    const vector<vector<long>>& ptxts, bool negative=false);
+        vector<long> multByConstantNew(const vector<long>& ids, long c);
+        vector<long> multByConstantNew(const vector<long>& ids,
+                                       const vector<vector<long>>& ptxts);
+        vector<long> powerNew(const vector<long>& ids, long n);
+
+        // LAZY RELINEARIZATION
+        /**
+         * @brief Multiply ciphertext at id1 by ciphertext at id2 without
+         * relinearizing: the result keeps 3 parts until relinearize is called.
+         * Sums of such products can be relinearized once at the end.
+         * @param id1 ID of ctxt 1 in the slab
+         * @param id2 ID of ctxt 2 in the slab
+         */
+        void multNoRelin(long id1, long id2);
+        void multNoRelin(const vector<long>& ids1, const vector<long>& ids2);
+
+        /**
+         * @brief Relinearize ciphertext at id1 back to 2 parts (key switching)
+         * @param id1 ID of ctxt in the slab
+         */
+        void relinearize(long id1);
+        void relinearize(const vector<long>& ids);
+
+        /**
+         * @brief Sum of the products ids1[i]*ids2[i], accumulated without
+         * relinearization and relinearized once at the end.
+         * @param ids1 IDs of the first factors in the slab
+         * @param ids2 IDs of the second factors in the slab
+         * @return ID of the new ciphertext with the result
+         */
+        long sumOfProducts(const vector<long>& ids1, const vector<long>& ids2);
+
+        // FUSED MULTIPLY-ADD
+        /**
+         * @brief Accumulate a product into the ciphertext at acc in a single
+         * call: acc += id1*id2 (fma) or acc += id1*ptxt (fmaPlain). Only one
+         * temporary is used, and the operands are left untouched.
+         * The vector versions run over all the positions in parallel, with one
+         * accumulator per position (accs must not repeat IDs).
+         * @param acc ID (or IDs) of the accumulator ctxt in the slab
+         * @param id1 ID (or IDs) of ctxt 1 in the slab
+         * @param id2 ID (or IDs) of ctxt 2 in the slab
+         * @param c scalar constant
+         * @param ptxt_vect plaintext vector with per-slot constants
+         */
+        void fma(long acc, long id1, long id2);
+        void fma(const vector<long>& accs, const vector<long>& ids1,
+                 const vector<long>& ids2);
+        void fmaPlain(long acc, long id1, long c);
+        void fmaPlain(long acc, long id1, const vector<long>& ptxt_vect);
+        void fmaPlain(const vector<long>& accs, const vector<long>& ids,
+                      const vector<vector<long>>& ptxts);
+
+        /**
+         * @brief Batched fused multiply-add over lists of terms:
+         * acc += sum of ids1[i]*ids2[i] (fmaSum), relinearized only once, or
+         * acc += sum of ids[i]*ptxts[i] (fmaPlainSum). Terms are multiplied in
+         * parallel, and with the plaintext cache enabled repeated plaintexts
+         * are only encoded once.
+         * @param acc ID of the accumulator ctxt in the slab
+         * @param ids1 IDs of the first factors in the slab
+         * @param ids2 IDs of the second factors in the slab
+         * @param ids IDs of the ciphertext factors in the slab
+         * @param ptxts plaintext vectors, one per ID
+         */
+        void fmaSum(long acc, const vector<long>& ids1, const vector<long>& ids2);
+        void fmaPlainSum(long acc, const vector<long>& ids,
+                         const vector<vector<long>>& ptxts);
+
+        // MULTIPLICATION BY CONSTANT
+        /**
+         * @brief Multiply ciphertext at id1 by a plaintext constant, without
+         * encrypting it. The constant is either a scalar applied to all slots
+         * or a vector with one value per slot (padded with zeros).
+         * @param id1 ID of ctxt in the slab
+         * @param c scalar constant
+         * @param ptxt_vect plaintext vector with per-slot constants
+         */
+        void multByConstant(long id1, long c);
+        void multByConstant(long id1, vector<long> ptxt_vect);
 
         // CUMULATIVE SUM
         /**
          * @brief sum all the values in the vector. 
-         * @param id1 ID of ctxt1 in unordered map
+         * @param id1 ID of ctxt1 in the slab
+         */
+        void cumSum(long id1);
+        void cumSum(const vector<long>& ids);
+
+        // PREFIX SUM
+        /**
+         * @brief Running sum over the slots: slot i gets the sum of the slots
+         * 0..i, with log2(nslots) shift-and-add steps.
+         * @param id1 ID of ctxt in the slab
+         */
+        void prefixSum(long id1);
+        void prefixSum(const vector<long>& ids);
+
+        // WINDOW SUM
+        /**
+         * @brief Sliding-window sum over the slots: slot i gets the sum of the
+         * slots i-width+1..i (those before slot 0 count as 0), with
+         * O(log width) shift-and-add steps.
+         * @param id1 ID of ctxt in the slab
+         * @param width size of the window, between 1 and nslots
          */
-        void cumSum(string id1);
+        void windowSum(long id1, long width);
+        void windowSum(const vector<long>& ids, long width);
         
         // SCALAR PRODUCT
         /**
-        * @brief Multiply ciphertext by ciphertext and perform cumulative sum
-        * @param id1 ID of ctxt1 in unordered map
-        * @param id2 ID of ctxt2 in unordered map
+        * @brief Multiply ciphertext by ciphertext and perform cumulative sum.
+        * With a partition size k, the slots are split into blocks of k
+        * consecutive slots and each block holds its own dot product (in all
+        * its slots), with 2*log2(k) rotations instead of a full totalSums.
+        * @param id1 ID of ctxt1 in the slab
+        * @param id2 ID of ctxt2 in the slab
+        * @param partitionSize size of the blocks, dividing nslots (0: all slots)
          */
-         void scalarProd(string id1, string id2, int partitionSize=0);
+         void scalarProd(long id1, long id2, int partitionSize=0);
+         void scalarProd(const vector<long>& ids1, const vector<long>& ids2,
+                         int partitionSize=0);
 
 
         // SQUARE
         /**
          * @brief Square ciphertext at id1 in ctxtMap
-         * @param id1 ID of ctxt in unordered map
+         * @param id1 ID of ctxt in the slab
          */
-        void square(string id1);
+        void square(long id1);
+        void square(const vector<long>& ids);
 
         // CUBE
         /**
          * @brief Cube ciphertext at id1 in ctxtMap
-         * @param id1 ID of ctxt in unordered map
+         * @param id1 ID of ctxt in the slab
          */
-        void cube(string id1);
+        void cube(long id1);
+        void cube(const vector<long>& ids);
+
+        // POWER
+        /**
+         * @brief Raise ciphertext at id1 to the power n using square-and-multiply,
+         * with O(log n) multiplications and multiplicative depth
+         * @param id1 ID of ctxt in the slab
+         * @param n exponent, n >= 1
+         */
+        void power(long id1, long n);
+        void power(const vector<long>& ids, long n);
+
+        // POLYNOMIAL EVALUATION
+        /**
+         * @brief Evaluate a polynomial P(x) = a0 + a1*x + ... + an*x^n on the
+         * ciphertext at id1 and store the result back at id1. Uses HElib's
+         * Paterson-Stockmeyer evaluation over a table of powers of x, with
+         * O(sqrt(n)) non-scalar multiplications and O(log n) depth.
+         * @param id1 ID of ctxt in the slab
+         * @param coeffs plaintext coefficients a0..an, applied to all slots
+         * @param coeffIds IDs of the encrypted coefficients a0..an in the slab
+         */
+        void polyEval(long id1, vector<long> coeffs);
+        void polyEvalCtxt(long id1, vector<long> coeffIds);
 
         // NEGATE
         /**
         * @brief Multiply ciphertext at id1 by -1
-        * @param id1 ID of ctxt in unordered map ctxtMap
+        * @param id1 ID of ctxt in the slab
         */
-        void negate(string id1);
+        void negate(long id1);
+        void negate(const vector<long>& ids);
         
         // COMPARE EQUALS
         /**
         * @brief Compare ciphertext at id1 and ciphertext at id2 
         * to see if they are equal
-        * @param id1 ID of ctxt 1 in unordered map ctxtMap
-        * @param id2 ID of ctxt 2 in unordered map ctxtMap
+        * @param id1 ID of ctxt 1 in the slab
+        * @param id2 ID of ctxt 2 in the slab
         * @param comparePkeys if true then pkeys will be compared
         * @return BOOL --> ctxt(id1) == ctxt(id2)
         */
-        bool equalsTo(string id1, string id2, bool comparePkeys=true);
+        bool equalsTo(long id1, long id2, bool comparePkeys=true);
 
         // ROTATE
         /**
         * @brief Rotate ciphertext at id1 by c spaces
-        * @param id1 ID of ctxt in unordered map ctxtMap
+        * @param id1 ID of ctxt in the slab
         * @param c number of spaces to rotate
         */
-        void rotate(string id1, long c);
+        void rotate(long id1, long c);
+        void rotate(const vector<long>& ids, long c);
+
+        // ROTATE MANY
+        /**
+         * @brief Rotate the ciphertexts at ids by several amounts at once,
+         * into new ciphertexts. The key-switching matrices are set up once
+         * for all the amounts, the rotations of all the ciphertexts run in
+         * parallel, and each distinct amount (modulo nslots) is only computed
+         * once (repeated amounts and 0 are copies).
+         * @param ids IDs of the ctxts in the slab
+         * @param amounts numbers of spaces to rotate
+         * @return IDs of the new ctxts, one vector (with one ID per ctxt in
+         *  ids) per amount
+         */
+        vector<vector<long>> rotateMany(const vector<long>& ids, const vector<long>& amounts);
         
         // SHIFT
         /**
         * @brief Shift ciphertext at id1 by c spaces
-        * @param id1 ID of ctxt in unordered map ctxtMap
+        * @param id1 ID of ctxt in the slab
         * @param c number of spaces to shift
         */
-        void shift(string id1, long c);
+        void shift(long id1, long c);
+        void shift(const vector<long>& ids, long c);
+
+
+        // -------------------------- LINEAR ALGEBRA --------------------------
+        // MATRIX-VECTOR PRODUCT
+        /**
+         * @brief Multiply a plaintext matrix by the vector encrypted in the
+         * first n slots of each ciphertext at ids (the other slots being 0),
+         * with the Halevi-Shoup diagonal method. The diagonals are encoded
+         * once for all the ciphertexts, and baby-step/giant-step takes about
+         * 2*sqrt(n) rotations. Zero diagonals are skipped.
+         * @param ids IDs of the ctxts holding the vectors in the slab
+         * @param matrix m x n plaintext matrix, as a list of rows. Unless
+         *  n == nslots, the vector is replicated over ceil((m+n-1)/n)*n slots,
+         *  which must fit in nslots.
+         * @return IDs of the new ctxts with the m results in their first slots
+         */
+        vector<long> matVec(const vector<long>& ids, const vector<vector<long>>& matrix);
+
+        // MATRIX-MATRIX PRODUCT
+        /**
+         * @brief Multiply the d x d matrices packed in the ciphertexts at
+         * idsA and idsB (slot d*i+j holds X[i][j], the other slots being 0),
+         * with the method of Jiang et al. (CCS'18): A and B are permuted
+         * once, and then d column shifts of A and row shifts of B are
+         * multiplied and added. This takes d ciphertext multiplications and
+         * O(d) rotations, and the permutation masks are encoded once for all
+         * the pairs.
+         * @param idsA IDs of the ctxts holding the left matrices in the slab
+         * @param idsB IDs of the ctxts holding the right matrices in the slab
+         * @param d dimension of the matrices. d*d must be nslots, or at most
+         *  nslots/2 (the matrices are replicated to emulate rotations over d*d).
+         * @return IDs of the new ctxts with the packed products A*B
+         */
+        vector<long> matMul(const vector<long>& idsA, const vector<long>& idsB, long d);
+
+        
+        // ----------------------- EXPRESSION PROGRAMS ------------------------
+        /**
+         * @brief Evaluate a compiled expression over registers of temporary
+         * ciphertexts, in a single pass. Each instruction has 4 values:
+         * opcode (EvalOp), destination register, source and argument. Sources
+         * >= 0 are registers and sources < 0 are inputs (-1 is inputs[0]).
+         * Operations write into the destination register: COPY (from source),
+         * ADD (source, subtracted if argument is 1), MUL, MULNR (without
+         * relinearization), RELIN, NEG, ADDC/MULC (scalar argument), ADDV/MULV
+         * (consts[argument]), POW, SUMS (totalSums, or partition sums over blocks
+         * of argument slots if > 0), SHIFT, FREE and RET (the
+         * result). The program runs once per set of inputs, in parallel.
+         * @param code flat list of instructions
+         * @param inputs IDs of the input ctxts in the slab, one set per run
+         * @param consts plaintext vectors, one set per run
+         * @return IDs of the resulting ctxts in the slab, one per run
+         */
+        vector<long> evalProgram(const vector<long>& code,
+                                 const vector<vector<long>>& inputs,
+                                 const vector<vector<vector<long>>>& consts);
+
+
+        // --------------------------- PARALLELISM ----------------------------
+        // The operations above also accept vectors of handles (ids, or pairs
+        //  ids1[i], ids2[i]). Each entry is processed independently, spread
+        //  across the threads of the worker pool.
+        /**
+         * @brief Set the number of threads in the worker pool used by the
+         * vectorized operations, encryptArray and decryptArray.
+         * @param n number of threads. 1 runs everything sequentially.
+         */
+        void setNumWorkers(long n);
+
+        /**
+         * @brief Number of threads in the worker pool
+         */
+        long getNumWorkers();
+
+        /**
+         * @brief Set the number of threads used both by NTL's thread pool of
+         * the calling thread (DoubleCRT-level parallelism inside HElib
+         * operations) and by the worker pool. Defaults to the number of CPUs.
+         * @param n number of threads. 1 disables multithreading.
+         */
+        void setNumThreads(long n);
+
+        /**
+         * @brief Number of threads available in NTL's thread pool
+         */
+        long getNumThreads();
+
+        /**
+         * @brief Set how threads are used by operations over several
+         * ciphertexts: PARALLEL_AUTO, PARALLEL_INTRA or PARALLEL_INTER.
+         * @param mode one of the ParallelMode values
+         */
+        void setParallelMode(long mode);
+        long getParallelMode();
+
+
+        // ------------------------- NOISE & CAPACITY -------------------------
+        /**
+         * @brief Estimated capacity of a ciphertext: bits of modulus left above
+         * the noise, log2(modulus/noise). Decryption fails around 0.
+         * @param id1 ID of ctxt in the slab
+         * @return capacity in bits
+         */
+        double capacity(long id1);
+
+        /**
+         * @brief Estimated noise of a ciphertext, log2 of the standard
+         * deviation tracked by HElib.
+         * @param id1 ID of ctxt in the slab
+         * @return noise bound in bits
+         */
+        double noiseBound(long id1);
+
+        /**
+         * @brief Enable the capacity guard: every operation throws
+         * std::range_error if its result has less than minBits of capacity.
+         * @param minBits minimum capacity in bits. 0 disables the guard.
+         */
+        void setCapacityGuard(double minBits);
+        double getCapacityGuard();
+
+
+        // -------------------------- LEVEL MANAGEMENT ------------------------
+        /**
+         * @brief Level of a ciphertext: size of its modulus, in HElib levels.
+         * @param id1 ID of ctxt in the slab
+         * @return level of the ciphertext
+         */
+        long level(long id1);
+
+        /**
+         * @brief Modulus-switch a ciphertext down to a lower level, keeping its
+         * value. Smaller moduli make later operations and serialization
+         * cheaper. Ciphertexts already at or below the level are untouched.
+         * @param id1 ID of ctxt in the slab
+         * @param lvl target level
+         */
+        void modDownTo(long id1, long lvl);
+        void modDownTo(const vector<long>& ids, long lvl);
+
+        /**
+         * @brief Enable automatic modulus switching: binary operations (add,
+         * mult, mult3, scalarProd, fma...) first bring their operands down to
+         * a common level. The ciphertext being written is switched in place,
+         * the other operands only through a temporary copy.
+         * @param on true to enable it
+         */
+        void setAutoModSwitch(bool on);
+        bool getAutoModSwitch();
+
+        /**
+         * @brief Set the multiplicative depth still to be evaluated on fresh
+         * ciphertexts: encrypt and encryptArray then modulus-switch them down
+         * to the levels of depth+1 multiplications (one spare to decrypt),
+         * so the whole circuit runs on smaller moduli. The levels used by a
+         * multiplication are measured on the context. 0 disables it.
+         * @param depth multiplicative depth of the circuit
+         */
+        void setDepthHint(long depth);
+        long getDepthHint();
+
+
+        // -------------------------- ROTATION KEYS ---------------------------
+        /**
+         * @brief Choose which key-switching matrices for rotations are
+         * generated: ROTKEYS_SOME, ROTKEYS_NONE or ROTKEYS_LAZY. Set it before
+         * keyGen, which is where ROTKEYS_SOME generates them.
+         * @param mode one of the RotationKeys values
+         */
+        void setRotationKeys(long mode);
+        long getRotationKeys();
+
+        /**
+         * @brief Generate the key-switching matrices needed to rotate (and
+         * shift) by each of the given amounts of slots.
+         * @param amounts numbers of slots to rotate
+         */
+        void addRotationKeys(const vector<long>& amounts);
+
+        /**
+         * @brief Generate the key-switching matrices of the Frobenius maps
+         * X -> X^(p^j) for each of the given powers j.
+         * @param powers powers j of the Frobenius maps
+         */
+        void addFrobeniusKeys(const vector<long>& powers);
+
+
+        // ------------------------- PLAINTEXT CACHE --------------------------
+        /**
+         * @brief Set the memory budget of the encoded plaintext cache, used by
+         * the per-slot versions of multByConstant and addConstant. Least
+         * recently used entries are evicted to fit the budget.
+         * @param nBytes budget in bytes. 0 disables the cache and empties it.
+         */
+        void setPtxtCacheBudget(long nBytes);
+
+        /**
+         * @brief Remove all the entries of the plaintext cache and reset its
+         * hit/miss counters.
+         */
+        void clearPtxtCache();
+
+        /**
+         * @brief Getters for the plaintext cache statistics
+         */
+        long getPtxtCacheBudget();
+        long getPtxtCacheBytes();
+        long getPtxtCacheHits();
+        long getPtxtCacheMisses();
 
         
         // -------------------------------- I/O -------------------------------
         // SAVE ENVIRONMENT
         /**
-         * @brief Saves the context, SecretKey and G polynomial in a .aenv file
+         * @brief Saves the context, SecretKey and G polynomial in a .aenv file,
+         *  streamed straight to disk. The checksummed format prepends a
+         *  versioned header with a checksum of the text payload; otherwise
+         *  only the legacy text is written.
          * @param fileName name of the file without the extention
+         * @param checksummed if true then the checksummed header is written
          * @return BOOL 1 if all ok, 0 otherwise
          */
-        bool saveEnv(string fileName);
+        bool saveEnv(string fileName, bool checksummed=true);
 
         // RESTORE ENVIRONMENT
         /**
-         * @brief Restores the context, SecretKey and G polynomial from a .aenv file.
+         * @brief Restores the context, SecretKey and G polynomial from a .aenv file,
+         *  memory-mapped, in either the checksummed or the legacy text format.
          *  Then it reconstucts publicKey and ea (EncriptedArray) with SecretKey & G.
          * @param fileName name of the file without the extention
          * @return BOOL 1 if all ok, 0 otherwise
          */
         bool restoreEnv(string fileName);
 
+        // CIPHERTEXT SERIALIZATION
+        /**
+         * @brief Serializes the ciphertext at id1 into a binary blob: a header
+         *  (magic "ACTX", format version, payload size) followed by the
+         *  ciphertext parts in HElib's stream encoding.
+         * @param id1 ID of ctxt in the slab
+         * @return the serialized ciphertext
+         */
+        string serialize(long id1);
+
+        /**
+         * @brief Deserializes a blob created by serialize into a new ciphertext.
+         *  The ciphertext must belong to the current context and keys.
+         * @param data serialized ciphertext
+         * @return ID of the new ciphertext in the slab
+         */
+        long deserialize(const string& data);
+
+        // SAVE CIPHERTEXTS
+        /**
+         * @brief Saves the ciphertexts at ids in a .actx file: a header (magic
+         *  "ACTS", format version, count) followed, for each ciphertext, by its
+         *  length (# of meaningful slots), its size and its serialized blob.
+         * @param fileName name of the file without the extention
+         * @param ids IDs of the ctxts in the slab
+         * @param lens # of meaningful slots of each ciphertext
+         * @return BOOL 1 if all ok, 0 otherwise
+         */
+        bool saveCtxts(string fileName, const vector<long>& ids,
+                       const vector<long>& lens);
+
+        // LOAD CIPHERTEXTS
+        /**
+         * @brief Loads all the ciphertexts of a .actx file into the slab. The
+         *  file is either memory-mapped or read through a large buffer.
+         * @param fileName name of the file without the extention
+         * @param lens filled with the # of meaningful slots of each ciphertext
+         * @param useMmap if true then the file is memory-mapped
+         * @return IDs of the loaded ciphertexts in the slab
+         */
+        vector<long> loadCtxts(string fileName, vector<long>& lens,
+                               bool useMmap=true);
+
 
         // ----------------------------- AUXILIARY ----------------------------
         /**
@@ -240,35 +990,38 @@ class Afhel{
         long getM();
         long getP();
         long getR();
+        long getL();                    // -1 if the env was restored from file
 
 
         /**
         * @brief Create a new ciphertext and set it equal to the ciphertext 
-        * stored in unordered map under ID id1
-        * @param id1 ID of ctxt in unordered map ctxtMap
+        * stored in the slab under ID id1
+        * @param id1 ID of ctxt in the slab
         * @return ID corresponding to new ciphertext
         */
-        string set(string id1);
+        long set(long id1);
 
         /**
-        * @brief Retrieve the ciphertext object from the unordered map
-        * @param id1 ID of ctxt in unordered map ctxtMap
+        * @brief Retrieve the ciphertext object from the slab, without copying it
+        * @param id1 ID of ctxt in the slab
         * @return the ciphertext corresponding to the one stored with ID id1
         */
-        Ctxt retrieve(string id1);
+        const Ctxt& retrieve(long id1);
         
         /**
-        * Replace the ciphertext at id1 with the new one provided
-        * @param id1 ID of ctxt in unordered map ctxtMap
-        * @param new_ctxt new Ctxt object to store in the unordered map
+        * Replace the ciphertext at id1 with the new one provided. The pointer
+        * version takes ownership of a heap-allocated ciphertext (no copy).
+        * @param id1 ID of ctxt in the slab
+        * @param new_ctxt new Ctxt object to store in the slab
         */
-        void replace(string id1, Ctxt new_ctxt);
+        void replace(long id1, const Ctxt& new_ctxt);
+        void replace(long id1, Ctxt* new_ctxt);
         
         /**
-        * @brief Delete from the unordered map the entry at key
-        * @param id1 ID of ctxt in unordered map ctxtMap
+        * @brief Delete from the slab the entry at key
+        * @param id1 ID of ctxt in the slab
         */
-        void erase(string id1);
+        void erase(long id1);
 
 };
 
@@ -40,8 +40,8 @@ int main(int argc, char **argv)
         else                { v2.push_back(0);  }}
 
     // Sum
-    string k1 = he.encrypt(v1);
-    string k2 = he.encrypt(v2);
+    long k1 = he.encrypt(v1);
+    long k2 = he.encrypt(v2);
     he.add(k1, k2);
     vector<long> vRes = he.decrypt(k1);
  
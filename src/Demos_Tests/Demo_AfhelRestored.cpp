@@ -35,8 +35,8 @@ int main(int argc, char **argv)
     for(int i=0; i<he.nslots; i++){v2.push_back(2);}
 
     // Sum
-    string k1 = he.encrypt(v1);
-    string k2 = he.encrypt(v2);
+    long k1 = he.encrypt(v1);
+    long k2 = he.encrypt(v2);
     he.add(k1, k2);
     vector<long> vRes = he.decrypt(k1);
  
@@ -266,3 +266,20 @@ print(p(1), ", ", p(2), ", ", p(3), ", ", p(4), ", ", p(5))
 
 
 
+
+
+
+print("------------------TEST Polynomial function of degree 7 with plaintext coefficients----------------------")
+
+coeff7 = [1, 2, 0, 1, 0, 0, 0, 1]
+
+print("Polynome: 1 + 2 * v + v**3 + v**7")
+print("Decrypt(v): ", HE.decrypt(ctxt_poly))
+
+ctxt_polynomial7 = ctxt_poly.polynomialMult(coeff7)
+result7 = HE.decrypt(ctxt_polynomial7)
+print("Polynomial result: ", result7)
+
+p7 = np.poly1d(coeff7[::-1])
+print("Polynomial evaluation on unencrypted vector (mod p^r):")
+print([int(np.mod(p7(x), HE.getModulus())) for x in v_poly])
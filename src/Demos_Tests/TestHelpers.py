@@ -0,0 +1,72 @@
+#
+#   TestHelpers
+#   --------------------------------------------------------------------
+#   Set-up shared by the Pyfhel Test_*.py scripts: the keyGen parameters,
+#   the check of each result against its expected value and the final
+#   PASSED/FAILED summary.
+#   --------------------------------------------------------------------
+#
+from Pyfhel import Pyfhel
+import numpy as np
+
+KEYGEN_PARAMS={ "p":257,      "r":1,
+                "d":1,        "c":2,
+                "sec":80,     "w":64,
+                "L":10,       "m":-1,
+                "R":3,        "s":0,
+                "gens":[],    "ords":[]}
+
+modulus = KEYGEN_PARAMS["p"]**KEYGEN_PARAMS["r"]
+allOk = True
+
+
+# SET UP a Pyfhel object with KEYGEN_PARAMS, overriding the given params
+#   (e.g. setUp("power", L=20) for deeper circuits)
+def setUp(title, HE=None, **params):
+    global modulus
+    runParams = dict(KEYGEN_PARAMS)
+    runParams.update(params)
+    modulus = runParams["p"]**runParams["r"]
+    if HE is None:
+        HE = Pyfhel()
+    print("Pyfhel TEST " + title)
+    print("  Running KeyGen with params:")
+    print(runParams)
+    HE.keyGen(runParams)
+    print("  KeyGen completed")
+    print("  nSlots = %d"%(HE.numSlots()))
+    return HE
+
+
+# CHECK a result against its expected value, both reduced mod p^r
+def check(name, result, expected):
+    expected = reduced(expected)
+    report(name, reduced(result) == expected, result, expected)
+
+
+# Values reduced mod p^r as nested lists, so that the cyphertexts of a PyCtxt
+#   may have different lengths
+def reduced(x):
+    if isinstance(x, (list, tuple)) and any(isinstance(e, (list, tuple, np.ndarray)) for e in x):
+        return [reduced(e) for e in x]
+    return np.mod(np.array(x), modulus).tolist()
+
+
+# CHECK a result is exactly equal to its expected value
+def same(name, result, expected):
+    report(name, result == expected, result, expected)
+
+
+def report(name, ok, result, expected):
+    global allOk
+    allOk = allOk and ok
+    print("    %s: %s"%(name, "OK" if ok else "FAILED"))
+    if not ok:
+        print("      Result:   " + str(result))
+        print("      Expected: " + str(expected))
+
+
+# SUMMARY of all the checks so far
+def summary(title):
+    print("Pyfhel TEST " + title + ": " + ("PASSED" if allOk else "FAILED"))
+    return allOk
@@ -0,0 +1,41 @@
+from TestHelpers import setUp, check, summary
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+import time
+
+HE = setUp("encryptArray / decryptArray")
+modulus = HE.getModulus()
+nSlots = HE.numSlots()
+
+# BATCHED ENCRYPTION
+print(" ENCRYPTARRAY")
+for (nRows, nCols) in [(1, 1), (5, 10), (8, nSlots)]:
+    arr = np.random.randint(0, modulus, (nRows, nCols))
+    for nThreads in [0, 1, 3]:
+        tic = time.time()
+        c = HE.encryptArray(arr, nThreads=nThreads)
+        toc = time.time()
+        check("%dx%d, nThreads=%d (%.3f s)"%(nRows, nCols, nThreads, toc - tic), HE.decrypt(c), arr)
+    check("%dx%d lengths"%(nRows, nCols), c.getLen(), [nCols]*nRows)
+
+# BATCHED DECRYPTION
+print(" DECRYPTARRAY")
+arr = np.random.randint(0, modulus, (6, 12))
+c = HE.encryptArray(arr)
+for nThreads in [0, 1, 3]:
+    tic = time.time()
+    res = HE.decryptArray(c, nThreads=nThreads)
+    toc = time.time()
+    check("new array, nThreads=%d (%.3f s)"%(nThreads, toc - tic), res, arr)
+out = np.zeros((6, 12), dtype=np.int64)
+res = HE.decryptArray(c, out)
+check("into out", out, arr)
+check("out returned", res is out, True)
+c = HE.encryptArray(arr, fill=7)            # Filler values beyond each row
+out = np.zeros((6, nSlots), dtype=np.int64)
+HE.decryptArray(c, out)
+check("filler slots", out[:, 12:], np.full((6, nSlots - 12), 7))
+check("round trip", HE.decryptArray(HE.encryptArray(out)), out)
+
+summary("encryptArray / decryptArray")
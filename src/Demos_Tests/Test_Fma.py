@@ -0,0 +1,50 @@
+from TestHelpers import setUp, check, summary
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+
+HE = setUp("fma / fmaPlain")
+modulus = HE.getModulus()
+
+# Two cyphertexts per PyCtxt, of different lengths
+lens = [10, 4]
+def rand():
+    return [np.random.randint(0, modulus, l) for l in lens]
+def enc(v):
+    return HE.encrypt(PyPtxt([x.tolist() for x in v], HE))
+def dec(c):
+    return np.concatenate([np.array(x) for x in HE.decrypt(c)])
+def flat(v):
+    return np.concatenate(v)
+
+a, x, y, z, w = rand(), rand(), rand(), rand(), rand()
+
+# FMA
+print(" FMA")
+acc, cx, cy = enc(a), enc(x), enc(y)
+HE.fma(acc, cx, cy)
+check("acc += x*y", dec(acc), flat(a) + flat(x)*flat(y))
+check("x unchanged", dec(cx), flat(x))
+check("y unchanged", dec(cy), flat(y))
+acc = enc(a)
+HE.fma(acc, [cx, enc(z)], [cy, enc(w)])
+check("acc += x*y + z*w", dec(acc), flat(a) + flat(x)*flat(y) + flat(z)*flat(w))
+check("x unchanged (sum)", dec(cx), flat(x))
+
+# FMA PLAIN
+print(" FMAPLAIN")
+acc = enc(a)
+HE.fmaPlain(acc, cx, 3)
+check("acc += x*3", dec(acc), flat(a) + 3*flat(x))
+acc = enc(a)
+HE.fmaPlain(acc, cx, [p.tolist() for p in y])
+check("acc += x*list", dec(acc), flat(a) + flat(x)*flat(y))
+acc = enc(a)
+HE.fmaPlain(acc, cx, PyPtxt([p.tolist() for p in y], HE))
+check("acc += x*PyPtxt", dec(acc), flat(a) + flat(x)*flat(y))
+check("x unchanged", dec(cx), flat(x))
+acc = enc(a)
+HE.fmaPlain(acc, [cx, enc(z)], [[p.tolist() for p in y], 5])
+check("acc += x*list + z*5", dec(acc), flat(a) + flat(x)*flat(y) + 5*flat(z))
+
+summary("fma / fmaPlain")
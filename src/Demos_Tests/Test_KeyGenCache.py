@@ -0,0 +1,56 @@
+from TestHelpers import setUp, check, same, summary
+from Pyfhel import Pyfhel
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+import os
+import tempfile
+
+cacheDir = tempfile.mkdtemp()
+v = np.random.randint(0, 20, 10)
+def cached(keys, **params):
+    HE = Pyfhel()
+    HE.setKeyGenCache(cacheDir, keys)
+    return setUp("keyGen cache", HE, **params)
+def files(ext):
+    return sorted(f for f in os.listdir(cacheDir) if f.endswith(ext))
+def works(HE):
+    c = HE.encrypt(PyPtxt(v.tolist(), HE))
+    return HE.decrypt(c * c)[0]
+
+# MISS: keyGen runs and stores the derived m and L, but no keys by default
+print(" MISS")
+HE1 = cached(False)
+same("getKeyGenCache", HE1.getKeyGenCache(), cacheDir)
+same("one entry", len(files(".json")), 1)
+same("no keys stored by default", files(".aenv"), [])
+check("keys work", works(HE1), v*v)
+
+# HIT on m and L in a new Pyfhel, as after a restart
+print(" HIT")
+HE2 = cached(False)
+same("same m", HE2.getM(), HE1.getM())
+same("same L", HE2.getL(), HE1.getL())
+same("still one entry", len(files(".json")), 1)
+check("keys work", works(HE2), v*v)
+
+# HIT on the whole environment with keys=True: the same keys are restored
+print(" HIT WITH KEYS")
+HE3 = cached(True)
+same("keys stored", len(files(".aenv")), 1)
+c = HE3.encrypt(PyPtxt(v.tolist(), HE3))
+HE4 = cached(True)
+same("same m", HE4.getM(), HE3.getM())
+same("same L", HE4.getL(), HE3.getL())
+check("decrypts the cyphertexts of the first one", HE4.decrypt(HE4.fromBytes(HE3.toBytes(c)))[0], v)
+check("keys work", works(HE4), v*v)
+
+# MISS on other parameters: a new entry
+print(" OTHER PARAMETERS")
+HE5 = cached(False, L=12)
+same("new entry", len(files(".json")), 2)
+same("other m or L", HE5.getL() != HE1.getL() or HE5.getM() != HE1.getM(), True)
+check("keys work", works(HE5), v*v)
+same("no temporary files left", files(".tmp"), [])
+
+summary("keyGen cache")
@@ -0,0 +1,60 @@
+from TestHelpers import setUp, check, same, summary
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+
+HE = setUp("lazy expressions")
+nSlots = HE.numSlots()
+
+# Three PyCtxt with two cyphertexts each, of different lengths
+v = [[np.random.randint(0, 20, n) for n in (nSlots//2, 7)] for _ in range(3)]
+def ptxt(x):
+    return PyPtxt([a.tolist() for a in x], HE)
+
+# RUN f on fresh cyphertexts of v eagerly and lazily, and compare the
+#   decrypted results (f returns a PyCtxt or a list of them)
+def compare(name, f):
+    results = []
+    for lazy in [False, True]:
+        HE.setLazy(lazy)
+        res = f(*[HE.encrypt(ptxt(x)) for x in v])
+        HE.setLazy(False)
+        res = res if isinstance(res, list) else [res]
+        if lazy:
+            same(name + ": pending", all(r.isLazy() for r in res), True)
+        results.append([HE.decrypt(r) for r in res])
+    check(name, results[1], results[0])
+
+print(" LAZY VS EAGER")
+def shared(a, b, c):
+    s = a + b
+    return s*s + s*c + s
+compare("shared subexpression", shared)
+compare("a - b - (c - a)", lambda a, b, c: a - b - (c - a))
+compare("int constants", lambda a, b, c: (a + 3)*2 - 5 + b*4)
+compare("list constants", lambda a, b, c: a*[[1, 2, 3], [4]] + [[5, 6], [7, 8, 9]] - b)
+compare("PyPtxt constants", lambda a, b, c: (a - ptxt(v[2]))*ptxt(v[1]) + c)
+compare("mixed constants", lambda a, b, c: ((a + 1)*[[2]*5, [3]] - ptxt(v[0]))*4)
+compare("**", lambda a, b, c: (a + b)**3 + c**2)
+compare("~", lambda a, b, c: ~(a*b + c))
+compare("~ with int", lambda a, b, c: ~(a + 5))
+for k in [k for k in [0, 1, 2, nSlots//2] if k == 0 or nSlots % k == 0]:
+    compare("%% partitionSize=%d"%(k), lambda a, b, c: (a + 1) % (b*c, k))
+    compare("%% int partitionSize=%d"%(k), lambda a, b, c: (a - c) % (3, k))
+compare("<<", lambda a, b, c: ((a + b) << 2) + (c << 1))
+def inplace(a, b, c):
+    e = a*b + a                             # Still pending when a changes
+    a += c
+    a *= 2
+    b **= 2
+    return [e, a, b]
+compare("in-place op on a leaf in use", inplace)
+def chain(a, b, c):
+    d = a
+    d += b
+    d *= c
+    d %= (a, 0)
+    return [d, a]
+compare("in-place chain", chain)
+
+summary("lazy expressions")
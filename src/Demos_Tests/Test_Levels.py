@@ -0,0 +1,72 @@
+from TestHelpers import setUp, check, same, summary
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+
+HE = setUp("level management", L=20)
+modulus = HE.getModulus()
+
+v = [np.random.randint(1, 10, 10) for _ in range(4)]
+def enc(x):
+    return HE.encrypt(PyPtxt(x.tolist(), HE))
+def dec(c):
+    return HE.decrypt(c)[0]
+top = HE.level(enc(v[0]))
+print("  Level of a fresh cyphertext: %d"%(top))
+
+# LEVEL / MODDOWNTO
+print(" MODDOWNTO")
+for lvl in [top, top - 1, top//2, 1]:
+    c = enc(v[0])
+    HE.modDownTo(c, lvl)
+    same("level <= %d"%(lvl), HE.level(c) <= lvl, True)
+    check("value at level %d"%(lvl), dec(c), v[0])
+c = enc(v[0])
+HE.modDownTo(c, top + 5)                    # Never switched up
+same("above the level", HE.level(c), top)
+
+# DEPTH HINT: d multiplications on cyphertexts dropped for depth d
+print(" DEPTH HINT")
+for d in [1, 2, 3]:
+    HE.setDepthHint(d)
+    same("getDepthHint", HE.getDepthHint(), d)
+    cs = [enc(x) for x in v]
+    arr = HE.encryptArray(np.array([x for x in v]))
+    if d == 1:                              # Far below the top of L=20
+        same("depth 1: encrypt dropped", HE.level(cs[0]) < top, True)
+    same("depth %d: encryptArray dropped"%(d), HE.level(arr) == HE.level(cs[0]), True)
+    acc, expected = cs[0], v[0]
+    for i in range(d):
+        acc = acc * cs[i + 1]
+        expected = expected * v[i + 1]
+    check("depth %d: %d multiplications"%(d, d), dec(acc), expected)
+    row = [np.array(x) for x in HE.decrypt(arr)]
+    check("depth %d: encryptArray values"%(d), row, v)
+HE.setDepthHint(0)
+same("disabled", HE.level(enc(v[0])), top)
+
+# AUTOMATIC MODULUS SWITCHING: the caller's operands stay untouched
+print(" AUTOMODSWITCH")
+HE.setAutoModSwitch(True)
+same("getAutoModSwitch", HE.getAutoModSwitch(), True)
+low, high = enc(v[0]), enc(v[1])
+HE.modDownTo(low, top//2)
+lowLevel = HE.level(low)
+check("low * high", dec(low * high), v[0] * v[1])
+check("high * low", dec(high * low), v[1] * v[0])
+same("high untouched by low * high", HE.level(high), top)
+c = HE.duplicate(low)
+c += high
+check("low += high", dec(c), v[0] + v[1])
+same("high untouched by low += high", HE.level(high), top)
+c = HE.duplicate(high)
+c *= low
+check("high *= low", dec(c), v[1] * v[0])
+same("low untouched by high *= low", HE.level(low), lowLevel)
+acc = enc(v[2])
+HE.fma(acc, low, high)
+check("fma", dec(acc), v[2] + v[0] * v[1])
+same("fma operands untouched", [HE.level(low), HE.level(high)], [lowLevel, top])
+HE.setAutoModSwitch(False)
+
+summary("level management")
@@ -0,0 +1,40 @@
+from TestHelpers import setUp, check, summary
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+import time
+
+HE = setUp("matVec / matMul", L=20)
+nSlots = HE.numSlots()
+
+# MATRIX-VECTOR PRODUCT
+print(" MATVEC")
+for (m, n) in [(4, 4), (3, 5), (7, 2)]:
+    M = np.random.randint(0, 10, (m, n))
+    v = np.random.randint(0, 10, n)
+    c = HE.encrypt(PyPtxt(v.tolist(), HE))
+    tic = time.time()
+    r = HE.matVec(M, c)
+    toc = time.time()
+    check("%dx%d (%.3f s)"%(m, n, toc - tic), HE.decrypt(r)[0], M.dot(v))
+
+# MATRIX-MATRIX PRODUCT
+print(" MATMUL")
+dims = [d for d in [2, 3, 4, 8, 16, 32] if 2*d*d <= nSlots or d*d == nSlots]
+for d in dims:
+    A = np.random.randint(0, 10, (d, d))
+    B = np.random.randint(0, 10, (d, d))
+    pA = HE.encryptMatrix(A)
+    pB = HE.encryptMatrix(B)
+    tic = time.time()
+    pC = HE.matMul(pA, pB)
+    toc = time.time()
+    check("%dx%d (%.3f s)"%(d, d, toc - tic), HE.decryptMatrix(pC), A.dot(B))
+if dims:                            # Rectangular matrices padded to the same dim
+    d = dims[-1]
+    A = np.random.randint(0, 10, (d-1, d))
+    B = np.random.randint(0, 10, (d, 2))
+    pC = HE.encryptMatrix(A, d) * HE.encryptMatrix(B, d)
+    check("%dx%d * %dx%d"%(d-1, d, d, 2), HE.decryptMatrix(pC), A.dot(B))
+
+summary("matVec / matMul")
@@ -0,0 +1,53 @@
+from TestHelpers import setUp, check, summary
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+
+HE = setUp("int plaintext constants")
+modulus = HE.getModulus()
+
+# Two cyphertexts shorter than the slot vector, with different lengths: an int
+#   must only reach the slots within each length, never the filler slots
+v = [np.random.randint(0, 20, n) for n in (10, 6)]
+w = [np.random.randint(0, 20, n) for n in (10, 6)]
+def enc(x):
+    return HE.encrypt(PyPtxt([a.tolist() for a in x], HE))
+def total(x):
+    return [np.repeat(np.sum(a), len(a)) for a in x]
+
+# ADDITION
+print(" ADDPLAIN")
+check("c + 5", HE.decrypt(enc(v) + 5), [a + 5 for a in v])
+check("c - 5", HE.decrypt(enc(v) - 5), [a - 5 for a in v])
+c = enc(v)
+c += 5
+check("c += 5", HE.decrypt(c), [a + 5 for a in v])
+check("~(c + 5)", HE.decrypt(~(enc(v) + 5)), total([a + 5 for a in v]))
+check("~(c - 5)", HE.decrypt(~(enc(v) - 5)), total([a - 5 for a in v]))
+c = enc(v)
+c += 5
+check("~(c += 5)", HE.decrypt(~c), total([a + 5 for a in v]))
+check("(c + 5) % (d + 1)", HE.decrypt((enc(v) + 5) % (enc(w) + 1)),
+      total([(a + 5)*(b + 1) for a, b in zip(v, w)]))
+
+# MULTIPLICATION: the filler slots are cleared, as by a zero-padded PyPtxt
+print(" MULTPLAIN")
+filled = HE.encrypt(PyPtxt([a.tolist() for a in v], HE), fill=3)
+check("filled: ~c", HE.decrypt(~HE.duplicate(filled)),
+      [np.repeat(np.sum(a) + 3*(HE.numSlots() - len(a)), len(a)) for a in v])
+check("filled: c * 5", HE.decrypt(filled * 5), [a*5 for a in v])
+check("filled: ~(c * 5)", HE.decrypt(~(filled * 5)), total([a*5 for a in v]))
+c = HE.duplicate(filled)
+c *= 5
+check("filled: ~(c *= 5)", HE.decrypt(~c), total([a*5 for a in v]))
+check("filled: (c * 5) % d", HE.decrypt((filled * 5) % enc(w)),
+      total([a*5*b for a, b in zip(v, w)]))
+acc = enc(w)
+HE.fmaPlain(acc, filled, 5)
+check("filled: ~fmaPlain(acc, c, 5)", HE.decrypt(~acc), total([b + a*5 for a, b in zip(v, w)]))
+acc = enc(w)
+HE.fmaPlain(acc, [filled, filled], [5, 2])
+check("filled: ~fmaPlain(acc, [c, c], [5, 2])", HE.decrypt(~acc),
+      total([b + a*7 for a, b in zip(v, w)]))
+
+summary("int plaintext constants")
@@ -0,0 +1,47 @@
+from TestHelpers import setUp, check, summary
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+import time
+
+HE = setUp("power / polynomial evaluation", L=20)
+modulus = HE.getModulus()
+
+# Python ints, so that large powers do not overflow
+v = np.array([int(x) for x in np.random.randint(0, modulus, 10)], dtype=object)
+
+# POWER
+print(" POWER")
+for n in [0, 1, 2, 3, 5, 8, 11]:
+    c = HE.encrypt(PyPtxt(v.tolist(), HE))
+    tic = time.time()
+    r = c ** n
+    toc = time.time()
+    check("c ** %d (%.3f s)"%(n, toc - tic), HE.decrypt(r)[0], v ** n)
+    check("c ** %d keeps c"%(n), HE.decrypt(c)[0], v)
+    c **= n
+    check("c **= %d"%(n), HE.decrypt(c)[0], v ** n)
+
+# POLYNOMIAL EVALUATION
+#   coeffs[i] is the coefficient of x**i, np.polyval takes the highest first
+print(" POLYEVAL")
+for degree in [0, 1, 3, 8, 9, 15]:
+    coeffs = [int(a) for a in np.random.randint(0, modulus, degree + 1)]
+    expected = np.polyval(np.array(coeffs[::-1], dtype=object), v)
+    c = HE.encrypt(PyPtxt(v.tolist(), HE))
+    tic = time.time()
+    r = c.polynomialMult(coeffs)
+    toc = time.time()
+    check("degree %d (%.3f s)"%(degree, toc - tic), HE.decrypt(r)[0], expected)
+    check("degree %d keeps c"%(degree), HE.decrypt(c)[0], v)
+    HE.polyEval(c, coeffs)
+    check("degree %d in place"%(degree), HE.decrypt(c)[0], expected)
+degree = 8                                  # Encrypted coefficients, one per slot
+coeffs = [np.array([int(a) for a in np.random.randint(0, modulus, len(v))], dtype=object)
+          for _ in range(degree + 1)]
+expected = sum(coeffs[i] * v**i for i in range(degree + 1))
+c = HE.encrypt(PyPtxt(v.tolist(), HE))
+r = c.polynomialMult([HE.encrypt(PyPtxt(a.tolist(), HE)) for a in coeffs])
+check("degree %d, encrypted coefficients"%(degree), HE.decrypt(r)[0], expected)
+
+summary("power / polynomial evaluation")
@@ -0,0 +1,50 @@
+from TestHelpers import setUp, check, summary
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+
+HE = setUp("plaintext cache")
+nSlots = HE.numSlots()
+
+v = np.random.randint(0, 20, nSlots)
+w1 = np.random.randint(0, 20, nSlots)
+w2 = np.random.randint(0, 20, nSlots)
+def multPlain(w):
+    c = HE.encrypt(PyPtxt(v.tolist(), HE))
+    HE.multPlain(c, w.tolist())
+    return HE.decrypt(c)[0]
+
+# HITS
+print(" HITS")
+HE.setPtxtCacheBudget(1 << 26)
+HE.clearPtxtCache()
+check("first use", multPlain(w1), v*w1)
+stats = HE.getPtxtCacheStats()
+check("first use misses", [stats["hits"], stats["misses"]], [0, 1])
+entryBytes = stats["bytes"]
+check("second use", multPlain(w1), v*w1)
+stats = HE.getPtxtCacheStats()
+check("second use hits", [stats["hits"], stats["misses"]], [1, 1])
+check("bytes unchanged", stats["bytes"], entryBytes)
+c = HE.encrypt(PyPtxt(v.tolist(), HE))
+HE.addPlain(c, w1.tolist())                 # Shared with addPlain
+check("addPlain", HE.decrypt(c)[0], v + w1)
+check("addPlain hits", HE.getPtxtCacheStats()["hits"], 2)
+
+# EVICTION
+print(" EVICTION")
+HE.setPtxtCacheBudget(entryBytes)           # Room for a single entry
+HE.clearPtxtCache()
+check("w1", multPlain(w1), v*w1)
+check("w2 evicts w1", multPlain(w2), v*w2)
+check("w1 again", multPlain(w1), v*w1)
+stats = HE.getPtxtCacheStats()
+check("misses after eviction", [stats["hits"], stats["misses"]], [0, 3])
+check("within budget", stats["bytes"] <= stats["budget"], True)
+check("w1 cached", multPlain(w1), v*w1)
+check("hit on the last entry", HE.getPtxtCacheStats()["hits"], 1)
+HE.setPtxtCacheBudget(0)                    # Disabled: nothing kept
+check("disabled", multPlain(w2), v*w2)
+check("disabled bytes", HE.getPtxtCacheStats()["bytes"], 0)
+
+summary("plaintext cache")
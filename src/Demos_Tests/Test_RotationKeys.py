@@ -0,0 +1,67 @@
+from TestHelpers import setUp, check, same, summary
+from Pyfhel import Pyfhel
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+import threading
+
+def enc(HE, x):
+    return HE.encrypt(PyPtxt([a.tolist() for a in x], HE))
+def raises(f):
+    try:
+        f()
+    except ValueError:
+        return True
+    return False
+
+# NONE: only the declared rotations are available
+HE = Pyfhel()
+HE.setRotationKeys("none")
+HE = setUp("rotation keys", HE)
+nSlots = HE.numSlots()
+v = [np.random.randint(0, 20, nSlots) for _ in range(2)]
+print(" NONE")
+same("getRotationKeys", HE.getRotationKeys(), "none")
+same("undeclared rotation raises", raises(lambda: HE.rotate(enc(HE, v), 1)), True)
+HE.addRotationKeys([1, 3])
+for a in [1, 3]:
+    c = enc(HE, v)
+    HE.rotate(c, a)
+    check("declared rotation by %d"%(a), HE.decrypt(c), [np.roll(x, a) for x in v])
+same("other rotation still raises", raises(lambda: HE.rotate(enc(HE, v), 2)), True)
+check("multiplication", HE.decrypt(enc(HE, v) * enc(HE, v)), [x*x for x in v])
+
+# LAZY: each rotation generates its matrices the first time it runs
+HE = Pyfhel()
+HE.setRotationKeys("lazy")
+HE = setUp("rotation keys", HE)
+print(" LAZY")
+same("getRotationKeys", HE.getRotationKeys(), "lazy")
+for a in [1, 2, 5, 1, nSlots//2]:
+    c = enc(HE, v)
+    HE.rotate(c, a)
+    check("rotation by %d"%(a), HE.decrypt(c), [np.roll(x, a) for x in v])
+check("cumSum", HE.decrypt(~enc(HE, v)), [np.repeat(np.sum(x), nSlots) for x in v])
+
+# Multiplications relinearize while other threads add matrices lazily
+products = []
+def multiply():
+    for _ in range(4):
+        c = enc(HE, v)
+        HE.mult(c, enc(HE, v))
+        products.append(HE.decrypt(c))
+threads = [threading.Thread(target=multiply) for _ in range(2)]
+for t in threads:
+    t.start()
+rotations = []
+for a in range(3, 11):
+    c = enc(HE, v)
+    HE.rotate(c, a)
+    rotations.append((a, HE.decrypt(c)))
+for t in threads:
+    t.join()
+for a, res in rotations:
+    check("concurrent rotation by %d"%(a), res, [np.roll(x, a) for x in v])
+check("concurrent multiplications", products, [[x*x for x in v]]*8)
+
+summary("rotation keys")
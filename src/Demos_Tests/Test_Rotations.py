@@ -0,0 +1,37 @@
+from TestHelpers import setUp, check, summary
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+import time
+
+HE = setUp("rotateMany")
+modulus = HE.getModulus()
+nSlots = HE.numSlots()
+
+# Two full cyphertexts in one PyCtxt
+v = [np.random.randint(0, modulus, nSlots) for _ in range(2)]
+c = HE.encrypt(PyPtxt([x.tolist() for x in v], HE))
+
+# Repeated amounts and amounts equal mod nSlots share a single rotation
+amounts = [1, 0, -1, 5, 1, nSlots + 5, nSlots//2, -(nSlots - 3)]
+print(" ROTATEMANY")
+tic = time.time()
+rotated = HE.rotateMany(c, amounts)
+toc = time.time()
+print("  %d rotations in %.3f s"%(len(amounts), toc - tic))
+check("one PyCtxt per amount", len(rotated), len(amounts))
+tic = time.time()
+for a, r in zip(amounts, rotated):
+    single = HE.duplicate(c)
+    HE.rotate(single, a)
+    res = HE.decrypt(r)
+    check("amount %d vs rotate"%(a), res, HE.decrypt(single))
+    check("amount %d vs np.roll"%(a), res, [np.roll(x, a) for x in v])
+    check("amount %d lengths"%(a), r.getLen(), c.getLen())
+toc = time.time()
+print("  %d single rotations in %.3f s"%(len(amounts), toc - tic))
+check("ctxt unchanged", HE.decrypt(c), v)
+HE.rotate(rotated[0], 1)                    # Results must not share cyphertexts
+check("independent results", HE.decrypt(rotated[4]), [np.roll(x, 1) for x in v])
+
+summary("rotateMany")
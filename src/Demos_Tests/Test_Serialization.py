@@ -0,0 +1,52 @@
+from TestHelpers import setUp, same, summary
+from Pyfhel import Pyfhel
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+import os
+import tempfile
+
+HE = setUp("cyphertext serialization")
+
+# Several cyphertexts of different lengths in a single PyCtxt
+v = [list(np.random.randint(0, 257, 10)), list(np.random.randint(0, 257, 3))]
+v = [[int(x) for x in row] for row in v]
+c = HE.encrypt(PyPtxt(v, HE))
+same("encrypt/decrypt", HE.decrypt(c), v)
+
+print(" TO BYTES / FROM BYTES")
+c2 = HE.fromBytes(HE.toBytes(c))
+same("lengths", c2.getLen(), c.getLen())
+same("values", HE.decrypt(c2), v)
+
+print(" SAVE CTXT / LOAD CTXT")
+fileName = os.path.join(tempfile.mkdtemp(), "ctxt")
+same("saveCtxt", bool(HE.saveCtxt(fileName, c)), True)
+for useMmap in [True, False]:
+    c3 = HE.loadCtxt(fileName, useMmap)
+    same("lengths (useMmap=%s)"%(useMmap), c3.getLen(), c.getLen())
+    same("values (useMmap=%s)"%(useMmap), HE.decrypt(c3), v)
+os.remove(fileName + ".actx")
+
+print(" SAVE ENV / RESTORE ENV")
+envName = os.path.join(tempfile.mkdtemp(), "env")
+data = HE.toBytes(c)
+for checksummed in [True, False]:
+    same("saveEnv (checksummed=%s)"%(checksummed), HE.saveEnv(envName, checksummed), True)
+    with open(envName + ".aenv", "rb") as f:
+        same("header (checksummed=%s)"%(checksummed), f.read(4) == b"AENV", checksummed)
+    HE2 = Pyfhel()
+    same("restoreEnv (checksummed=%s)"%(checksummed), HE2.restoreEnv(envName), True)
+    same("modulus (checksummed=%s)"%(checksummed), HE2.getModulus(), HE.getModulus())
+    same("values (checksummed=%s)"%(checksummed), HE2.decrypt(HE2.fromBytes(data)), v)
+HE.saveEnv(envName)                         # Flip one byte of the payload
+with open(envName + ".aenv", "r+b") as f:
+    f.seek(os.path.getsize(envName + ".aenv") // 2)
+    byte = f.read(1)
+    f.seek(-1, os.SEEK_CUR)
+    f.write(bytearray([ord(byte) ^ 1]))
+same("corrupted checksum rejected", Pyfhel().restoreEnv(envName), False)
+same("missing file rejected", Pyfhel().restoreEnv(envName + "_missing"), False)
+os.remove(envName + ".aenv")
+
+summary("cyphertext serialization")
@@ -0,0 +1,55 @@
+from TestHelpers import setUp, check, summary
+from PyPtxt import PyPtxt
+from PyCtxt import PyCtxt
+import numpy as np
+import time
+
+HE = setUp("sums over slots")
+nSlots = HE.numSlots()
+
+# Full slot vectors, so that the ends of the vector are checked too
+x = np.random.randint(0, 20, nSlots)
+y = np.random.randint(0, 20, nSlots)
+def enc(v):
+    return HE.encrypt(PyPtxt(v.tolist(), HE))
+
+# SCALAR PRODUCT PER PARTITION
+print(" SCALARPROD")
+sizes = [k for k in range(1, nSlots + 1) if nSlots % k == 0]
+sizes = [0] + sizes[:3] + sizes[len(sizes)//2:len(sizes)//2 + 1] + sizes[-2:]
+for k in sizes:
+    blocks = np.add.reduceat(x*y, range(0, nSlots, k if k > 0 else nSlots))
+    expected = np.repeat(blocks, k if k > 0 else nSlots)
+    c1, c2 = enc(x), enc(y)
+    tic = time.time()
+    HE.scalarProd(c1, c2, k)
+    toc = time.time()
+    check("partitionSize=%d (%.3f s)"%(k, toc - tic), HE.decrypt(c1)[0], expected)
+    check("partitionSize=%d with %%"%(k), HE.decrypt(enc(x) % (enc(y), k))[0], expected)
+
+# PREFIX SUM
+print(" PREFIXSUM")
+c = enc(x)
+tic = time.time()
+HE.prefixSum(c)
+toc = time.time()
+check("prefixSum (%.3f s)"%(toc - tic), HE.decrypt(c)[0], np.cumsum(x))
+check("PyCtxt.prefixSum", HE.decrypt(enc(x).prefixSum())[0], np.cumsum(x))
+
+# WINDOW SUM: slot i gets x[i-width+1] + ... + x[i], with nothing before slot 0
+print(" WINDOWSUM")
+cs = np.concatenate([[0], np.cumsum(x)])
+for width in [1, 2, 3, 7, nSlots//2 + 1, nSlots - 1, nSlots]:
+    expected = np.array([cs[i+1] - cs[max(0, i+1-width)] for i in range(nSlots)])
+    c = enc(x)
+    tic = time.time()
+    HE.windowSum(c, width)
+    toc = time.time()
+    res = HE.decrypt(c)[0]
+    check("width=%d (%.3f s)"%(width, toc - tic), res, expected)
+    check("width=%d first slots"%(width), res[:width], np.cumsum(x)[:width])
+    check("width=%d last slot"%(width), res[-1], np.sum(x[-width:]))
+check("PyCtxt.windowSum", HE.decrypt(enc(x).windowSum(3))[0],
+      np.array([cs[i+1] - cs[max(0, i-2)] for i in range(nSlots)]))
+
+summary("sums over slots")
@@ -28,6 +28,7 @@
 # Import the other modules from Pyfhel.
 from Pyfhel import Pyfhel
 from PyPtxt import PyPtxt
+from PyExpr import PyExpr
 # Other imports useful for PyCtxt.
 import numbers
 import copy
@@ -44,19 +45,72 @@ class PyCtxt:
 
         self.__pyfhel = pyfhel
         self.__length = length
+        self.__expr = None          # Pending PyExpr in lazy mode
+        self.__owner = None         # PyCtxt owning our IDs once used in an expression
         return
     def __del__(self):
-        self.__pyfhel.delete(self)
+        if self.__expr is None and self.__owner is None:
+            self.__pyfhel.delete(self)
     def getIDs(self):
+        if self.__expr is not None:
+            self.evaluate()
         return self.__ids
     def appendID(self, i):
-        if not isinstance(i, str):
-            raise TypeError("PyCtxt appendID error: ID must be a string")
+        if not isinstance(i, (int, long)):
+            raise TypeError("PyCtxt appendID error: ID must be an integer handle")
         self.__ids.append(i)
     def getPyfhel(self):
         return self.__pyfhel
     def getLen(self):
         return self.__length
+    def toBytes(self):
+        return self.__pyfhel.toBytes(self)
+    def capacity(self):
+        return self.__pyfhel.capacity(self)
+    def level(self):
+        return self.__pyfhel.level(self)
+    def modDownTo(self, level):
+        return self.__pyfhel.modDownTo(self, level)
+
+
+    # ---------------------------- LAZY EVALUATION -------------------------- #
+    # In lazy mode (Pyfhel.setLazy), operators return PyCtxt objects holding
+    #   an expression instead of cyphertexts. It is evaluated when the IDs are
+    #   needed or on evaluate(). Leaves are read at evaluation time, so they
+    #   must not be modified through Pyfhel methods in the meantime.
+    def evaluate(self):
+        if self.__expr is not None:
+            self.__ids = self.__pyfhel.evalExpr(self.__expr)
+            self.__expr = None
+        return self
+    def isLazy(self):
+        return self.__expr is not None
+
+    # Expression node for this PyCtxt. Our cyphertexts are handed to an owner
+    #   PyCtxt, so that in-place operators on us don't alter the expressions.
+    def __node(self):
+        if self.__expr is not None:
+            return self.__expr
+        if self.__owner is None:
+            self.__owner = PyCtxt(self.__pyfhel, self.__length)
+            self.__owner.__ids = self.__ids
+        return PyExpr("ctxt", (self.__owner,))
+
+    def __lazyNode(self, op, other=None, const=None):
+        args = (self.__node(),)
+        if isinstance(other, PyCtxt):
+            args += (other.__node(),)
+        elif other is not None:             # Plaintext operand
+            op, const = op + "Plain", other
+        return PyExpr(op, args, const)
+
+    def __lazyResult(self, node, inplace):
+        if inplace:
+            self.__expr, self.__ids, self.__owner = node, [], None
+            return self
+        res = PyCtxt(self.__pyfhel, self.__length)
+        res.__expr = node
+        return res
     
 
     # -------------------- OVERRIDE ARITHMETIC OPERATORS -------------------- #
@@ -72,155 +126,137 @@ class PyCtxt:
 
     
     """@Description:
-    #The operator + allow to add a PyCtxt object with an other PyCtxt object or an int and to return a PyCtxt object that contain the sum. This operator doesn't modify the first operand.
+    #The operator + allow to add a PyCtxt object with an other PyCtxt object, an int, a list or a PyPtxt and to return a PyCtxt object that contain the sum. This operator doesn't modify the first operand.
 
-    #@param: The method takes a mandatory parameter: a PyCtxt or an int.
-    #-param1: The PyCtxt object or the int to add. 
+    #@param: The method takes a mandatory parameter: a PyCtxt, an int, a list or a PyPtxt.
+    #-param1: The PyCtxt object, the int, the list or the PyPtxt to add. 
     """
     # ADD:
-    # '+'operator -> Accepts both PyCtxt and Int
+    # '+'operator -> Accepts PyCtxt, Int, List and PyPtxt
     def __add__(self, other):
-        # If one wants to add a PyCtxt with an object that is not either a PyCtxt or an int, we throw an error.
-        if not isinstance(other, (PyCtxt, int)):
-            raise TypeError("PyCtxt '+' error: lhs must be of type PyCtxt or int instead of " + str(type(other)))
-        # Create new Ctxt for result
-        newCtxt = self.copy(self) 
-        # Add directly if other is PyCtxt                       
-        if isinstance(other, PyCtxt):                   
-            newCtxt += other
-        #Otherwise, if one wants to add a PyCtxt with an int, we have to create a vector of that int and then encrypted to transform it in PyCtxt.
-        else:
-            # Create new PyCtxt from other if int
-            constCtxt = self.__pyfhel.encrypt(PyPtxt([other for _ in range(self.__length)],self.__pyfhel))
-            # Perform addition like in '+=' operator	
-            newCtxt += constCtxt                        
-            del constCtxt
-        return newCtxt
+        # If one wants to add a PyCtxt with an object that is not either a PyCtxt, an int, a list or a PyPtxt, we throw an error.
+        if not isinstance(other, (PyCtxt, int, list, PyPtxt)):
+            raise TypeError("PyCtxt '+' error: lhs must be of type PyCtxt, int, list or PyPtxt instead of " + str(type(other)))
+        # In lazy mode, build the expression instead
+        if self.__pyfhel.getLazy():
+            return self.__lazyResult(self.__lazyNode("add", other), False)
+        # Compute the addition straight into a new Ctxt, without a copy first
+        if isinstance(other, PyCtxt):
+            return self.__pyfhel.addNew(self, other, False)
+        return self.__pyfhel.addPlainNew(self, other, False)
 
     """@Description:
-    #The operator += allow to add a PyCtxt object with an other PyCtxt object or an int and to return a PyCtxt object that contain the sum. This operator modify the first operand.
+    #The operator += allow to add a PyCtxt object with an other PyCtxt object, an int, a list or a PyPtxt and to return a PyCtxt object that contain the sum. This operator modify the first operand.
 
-    #@param: The method takes a mandatory parameter: a PyCtxt or an int.
-    #-param1: The PyCtxt object or the int to add. 
+    #@param: The method takes a mandatory parameter: a PyCtxt, an int, a list or a PyPtxt.
+    #-param1: The PyCtxt object, the int, the list or the PyPtxt to add. 
     """
     # '+=' operator
     def __iadd__(self, other):
-        # If one wants to add a PyCtxt with an object that is not either a PyCtxt or an int, we throw an error.
-        if not isinstance(other, (PyCtxt, int)):
-            raise TypeError("PyCtxt ADD error: lhs must be of type PyCtxt or int instead of type " + str(type(other)))
+        # If one wants to add a PyCtxt with an object that is not either a PyCtxt, an int, a list or a PyPtxt, we throw an error.
+        if not isinstance(other, (PyCtxt, int, list, PyPtxt)):
+            raise TypeError("PyCtxt ADD error: lhs must be of type PyCtxt, int, list or PyPtxt instead of type " + str(type(other)))
+        # In lazy mode, extend our expression instead
+        if self.__pyfhel.getLazy():
+            return self.__lazyResult(self.__lazyNode("add", other), True)
         # Add directly if other is PyCtxt
         if isinstance(other, PyCtxt):
             self.__pyfhel.add(self, other, False) 
-        #Otherwise, if one wants to add a PyCtxt with an int, we have to create a vector of that int and then encrypted to transform it in PyCtxt.      
+        #Otherwise, other is a plaintext constant: we add it directly, without encrypting it.
         else:
-            # Create new PyCtxt from other if int.
-            constCtxt = self.__pyfhel.encrypt(PyPtxt([other for _ in range(self.__length)],self.__pyfhel))	
-            # Perform addition from Afhel::add
-            self.__pyfhel.add(self, constCtxt, False)   
-            del constCtxt
+            # Perform addition from Afhel::addConstant
+            self.__pyfhel.addPlain(self, other, False)
         return self
 
 
 
     """@Description:
-    #The operator - allow to substract a PyCtxt object with an other PyCtxt object or an int and to return a PyCtxt object that contain the substract. This operator doesn't modify the first operand.
+    #The operator - allow to substract a PyCtxt object with an other PyCtxt object, an int, a list or a PyPtxt and to return a PyCtxt object that contain the substract. This operator doesn't modify the first operand.
 
-    #@param: The method takes a mandatory parameter: a PyCtxt or an int.
-    #-param1: The PyCtxt object or the int to substract. 
+    #@param: The method takes a mandatory parameter: a PyCtxt, an int, a list or a PyPtxt.
+    #-param1: The PyCtxt object, the int, the list or the PyPtxt to substract. 
     """
     # SUBSTRACT:
     # '-' operator
     def __sub__(self, other):
-        # If one wants to substract a PyCtxt with an object that is not either a PyCtxt or an int, we throw an error.
-        if not isinstance(other, PyCtxt):
-            if not isinstance(other, (PyCtxt, int)):
-                raise TypeError("PyCtxt '-' error: lhs must be of type PyCtxt or int instead of " + str(type(other)))
-        # Create new Ctxt for result.
-        newCtxt = self.copy(self)   
-        # Substract directly if other is PyCtxt.                     
+        # If one wants to substract a PyCtxt with an object that is not either a PyCtxt, an int, a list or a PyPtxt, we throw an error.
+        if not isinstance(other, (PyCtxt, int, list, PyPtxt)):
+            raise TypeError("PyCtxt '-' error: lhs must be of type PyCtxt, int, list or PyPtxt instead of " + str(type(other)))
+        # In lazy mode, build the expression instead
+        if self.__pyfhel.getLazy():
+            return self.__lazyResult(self.__lazyNode("sub", other), False)
+        # Compute the substraction straight into a new Ctxt, without a copy first
         if isinstance(other, PyCtxt):
-            newCtxt -= other
-        #Otherwise, if one wants to substract a PyCtxt with an int, we have to create a vector of that int and then encrypted to transform it in PyCtxt.                                
-        else:
-            # Create new PyCtxt from other if int.
-            constCtxt = self.__pyfhel.encrypt(PyPtxt([other for _ in range(self.__length)],self.__pyfhel))	
-            # Perform substraction from Afhel::add
-            newCtxt -= constCtxt                        
-            del constCtxt
-        return newCtxt
+            return self.__pyfhel.addNew(self, other, True)
+        return self.__pyfhel.addPlainNew(self, other, True)
 
 
     """@Description:
-    #The operator -= allow to substract a PyCtxt object with an other PyCtxt object or an int and to return a PyCtxt object that contain the substract. This operator modify the first operand.
+    #The operator -= allow to substract a PyCtxt object with an other PyCtxt object, an int, a list or a PyPtxt and to return a PyCtxt object that contain the substract. This operator modify the first operand.
 
-    #@param: The method takes a mandatory parameter: a PyCtxt or an int.
-    #-param1: The PyCtxt object or the int to substract. 
+    #@param: The method takes a mandatory parameter: a PyCtxt, an int, a list or a PyPtxt.
+    #-param1: The PyCtxt object, the int, the list or the PyPtxt to substract. 
     """
     # '-=' operator
     def __isub__(self, other):
-        # If one wants to substract a PyCtxt with an object that is not either a PyCtxt or an int, we throw an error.
-        if not isinstance(other, (PyCtxt, int)):
-            raise TypeError("PyCtxt '-=' error: lhs must be of type PyCtxt or int instead of type " + str(type(other)))
+        # If one wants to substract a PyCtxt with an object that is not either a PyCtxt, an int, a list or a PyPtxt, we throw an error.
+        if not isinstance(other, (PyCtxt, int, list, PyPtxt)):
+            raise TypeError("PyCtxt '-=' error: lhs must be of type PyCtxt, int, list or PyPtxt instead of type " + str(type(other)))
+        # In lazy mode, extend our expression instead
+        if self.__pyfhel.getLazy():
+            return self.__lazyResult(self.__lazyNode("sub", other), True)
         # Substract directly if other is PyCtxt.                     
         if isinstance(other, PyCtxt):
             self.__pyfhel.add(self, other, True)
-        #Otherwise, if one wants to substract a PyCtxt with an int, we have to create a vector of that int and then encrypted to transform it in PyCtxt.
+        #Otherwise, other is a plaintext constant: we substract it directly, without encrypting it.
         else:
-            # Create new PyCtxt from other if int.
-            constCtxt = self.__pyfhel.encrypt(PyPtxt([other for _ in range(self.__length)],self.__pyfhel))
-            # Perform substraction from Afhel::add
-            self.__pyfhel.add(self, constCtxt, True)
-            del constCtxt
+            # Perform substraction from Afhel::addConstant
+            self.__pyfhel.addPlain(self, other, True)
         return self
 
 
     """@Description:
-    #The operator * allow to multiply a PyCtxt object with an other PyCtxt object or an int and to return a PyCtxt object that contain the multiplication. This operator doesn't modify the first operand.
+    #The operator * allow to multiply a PyCtxt object with an other PyCtxt object, an int, a list or a PyPtxt and to return a PyCtxt object that contain the multiplication. This operator doesn't modify the first operand.
 
-    #@param: The method takes a mandatory parameter: a PyCtxt or an int.
-    #-param1: The PyCtxt object or the int to multiply. 
+    #@param: The method takes a mandatory parameter: a PyCtxt, an int, a list or a PyPtxt.
+    #-param1: The PyCtxt object, the int, the list or the PyPtxt to multiply. 
     """
     # MULTIPLY:
     # '*' operator
     def __mul__(self, other):
-        # If one wants to multiply a PyCtxt with an object that is not either a PyCtxt or an int, we throw an error.
-        if not isinstance(other, (PyCtxt, int)):
-            raise TypeError("PyCtxt '*' error: lhs must be of type PyCtxt or int instead of " + str(type(other)))
-        # Create new Ctxt for result.
-        newCtxt = self.copy(self)                        
-        # Multiply directly if other is PyCtxt.                     
+        # If one wants to multiply a PyCtxt with an object that is not either a PyCtxt, an int, a list or a PyPtxt, we throw an error.
+        if not isinstance(other, (PyCtxt, int, list, PyPtxt)):
+            raise TypeError("PyCtxt '*' error: lhs must be of type PyCtxt, int, list or PyPtxt instead of " + str(type(other)))
+        # In lazy mode, build the expression instead
+        if self.__pyfhel.getLazy():
+            return self.__lazyResult(self.__lazyNode("mult", other), False)
+        # Compute the multiplication straight into a new Ctxt, without a copy first
         if isinstance(other, PyCtxt):
-            newCtxt *= other
-        #Otherwise, if one wants to multiply a PyCtxt with an int, we have to create a vector of that int and then encrypted to transform it in PyCtxt.
-        else:
-            # Create new PyCtxt from other if int.
-            constCtxt = self.__pyfhel.encrypt(PyPtxt([other for _ in range(self.__length)],self.__pyfhel))
-            newCtxt *= constCtxt
-            del constCtxt
-        return newCtxt
+            return self.__pyfhel.multNew(self, other)
+        return self.__pyfhel.multPlainNew(self, other)
 
 
     """@Description:
-    #The operator *= allow to multiply a PyCtxt object with an other PyCtxt object or an int and to return a PyCtxt object that contain the multiplication. This operator modify the first operand.
+    #The operator *= allow to multiply a PyCtxt object with an other PyCtxt object, an int, a list or a PyPtxt and to return a PyCtxt object that contain the multiplication. This operator modify the first operand.
 
-    #@param: The method takes a mandatory parameter: a PyCtxt or an int.
-    #-param1: The PyCtxt object or the int to multiply. 
+    #@param: The method takes a mandatory parameter: a PyCtxt, an int, a list or a PyPtxt.
+    #-param1: The PyCtxt object, the int, the list or the PyPtxt to multiply. 
     """
     # '*=' operator
     def __imul__(self, other):
-        # If one wants to multiply a PyCtxt with an object that is not either a PyCtxt or an int, we throw an error.
-        if not isinstance(other, (PyCtxt, int)):
-            raise TypeError("PyCtxt '*=' error: lhs must be of type PyCtxt or int instead of type " + str(type(other)))
+        # If one wants to multiply a PyCtxt with an object that is not either a PyCtxt, an int, a list or a PyPtxt, we throw an error.
+        if not isinstance(other, (PyCtxt, int, list, PyPtxt)):
+            raise TypeError("PyCtxt '*=' error: lhs must be of type PyCtxt, int, list or PyPtxt instead of type " + str(type(other)))
+        # In lazy mode, extend our expression instead
+        if self.__pyfhel.getLazy():
+            return self.__lazyResult(self.__lazyNode("mult", other), True)
         # Multiply directly if other is PyCtxt.                     
         if isinstance(other, PyCtxt):
             self.__pyfhel.mult(self, other)
-        #Otherwise, if one wants to multiply a PyCtxt with an int, we have to create a vector of that int and then encrypted to transform it in PyCtxt.
+        #Otherwise, other is a plaintext constant: we multiply by it directly, without encrypting it.
         else:
-            # Create new PyCtxt from other if int.
-            constCtxt = self.__pyfhel.encrypt(PyPtxt([other for _ in range(self.__length)],self.__pyfhel))
-            # Perform multiplication from Afhel::mult
-            self.__pyfhel.mult(self, constCtxt)
-            del constCtxt
+            # Perform multiplication from Afhel::multByConstant
+            self.__pyfhel.multPlain(self, other)
         return self
 
 
@@ -228,25 +264,36 @@ class PyCtxt:
     #The operator % allow to perform the scalar product between a PyCtxt object with an other PyCtxt object or an int and to return a PyCtxt object that contain the scalar product (it will be an encrypted vector where all the elements will be the result of the scalar product). This operator doesn't modify the first operand.
 
     #@param: The method takes a mandatory parameter: a PyCtxt or an int.
-    #-param1: The PyCtxt object or the int to perform the scalar product.
+    #-param1: The PyCtxt object or the int to perform the scalar product, or a tuple (PyCtxt or int, partitionSize) to get one scalar product per block of partitionSize slots.
     """
     # SCALAR PRODUCT
     # '%' operator - scalarProd
     def __mod__(self, other):
+        # A tuple (other, partitionSize) computes one scalar product per block of partitionSize slots.
+        partitionSize = 0
+        if isinstance(other, tuple):
+            if len(other) != 2:
+                raise TypeError("PyCtxt '%' error: tuple must be (PyCtxt or int, partitionSize)")
+            other, partitionSize = other
         # If one wants to perform scalar product on a PyCtxt with an object that is not either a PyCtxt or an int, we throw an error.
         if not isinstance(other, (PyCtxt, int)):
             raise TypeError("PyCtxt '%' error: lhs must be of type PyCtxt or int instead of " + str(type(other)))
+        # In lazy mode, build the expression instead (an int is not encrypted)
+        if self.__pyfhel.getLazy():
+            if not isinstance(other, PyCtxt):
+                other = [[other]*l for l in self.__length]
+            return self.__lazyResult(PyExpr("cumSum", (self.__lazyNode("mult", other),), partitionSize), False)
         # Create new Ctxt for result.
         newCtxt = self.copy(self)  
         # Perform the scalar product directly if other is PyCtxt.                                          
         if isinstance(other, PyCtxt):
-            newCtxt %= other
+            newCtxt %= (other, partitionSize)
         #Otherwise, if one wants to perform scalar product on a PyCtxt with an int, we have to create a vector of that int and then encrypted to transform it in PyCtxt.
         else:
             # Create new PyCtxt from other if int.
-            constCtxt = self.__pyfhel.encrypt(PyPtxt([other for _ in range(self.__length)],self.__pyfhel))
+            constCtxt = self.__pyfhel.encrypt(PyPtxt([[other]*l for l in self.__length],self.__pyfhel))
             # Perform scalar product.
-            newCtxt %= constCtxt
+            newCtxt %= (constCtxt, partitionSize)
             del constCtxt
         return newCtxt
 
@@ -255,22 +302,33 @@ class PyCtxt:
     #The operator %= allow to perform the scalar product between a PyCtxt object with an other PyCtxt object or an int and to return a PyCtxt object that contain the scalar product (it will be an encrypted vector where all the elements will be the result of the scalar product). This operator modify the first operand.
 
     #@param: The method takes a mandatory parameter: a PyCtxt or an int.
-    #-param1: The PyCtxt object or the int to perform the scalar product.
+    #-param1: The PyCtxt object or the int to perform the scalar product, or a tuple (PyCtxt or int, partitionSize) to get one scalar product per block of partitionSize slots.
     """
     # '%=' operator
     def __imod__(self, other):
+        # A tuple (other, partitionSize) computes one scalar product per block of partitionSize slots.
+        partitionSize = 0
+        if isinstance(other, tuple):
+            if len(other) != 2:
+                raise TypeError("PyCtxt '%=' error: tuple must be (PyCtxt or int, partitionSize)")
+            other, partitionSize = other
         # If one wants to perform scalar product on a PyCtxt with an object that is not either a PyCtxt or an int, we throw an error.
         if not isinstance(other, (PyCtxt, int)):
             raise TypeError("PyCtxt '%=' error: lhs must be of type PyCtxt or int instead of type " + str(type(other)))
+        # In lazy mode, extend our expression instead (an int is not encrypted)
+        if self.__pyfhel.getLazy():
+            if not isinstance(other, PyCtxt):
+                other = [[other]*l for l in self.__length]
+            return self.__lazyResult(PyExpr("cumSum", (self.__lazyNode("mult", other),), partitionSize), True)
         # Perform the scalar product directly if other is PyCtxt.                                          
         if isinstance(other, PyCtxt):
-            self.__pyfhel.scalarProd(self, other)
+            self.__pyfhel.scalarProd(self, other, partitionSize)
         #Otherwise, if one wants to perform scalar product on a PyCtxt with an int, we have to create a vector of that int and then encrypted to transform it in PyCtxt.
         else:
             # Create new PyCtxt from other if int.
-            constCtxt = self.__pyfhel.encrypt(PyPtxt([other for _ in range(self.__length)],self.__pyfhel))
+            constCtxt = self.__pyfhel.encrypt(PyPtxt([[other]*l for l in self.__length],self.__pyfhel))
             # Perform scalar product.
-            self.__pyfhel.scalarProd(self, constCtxt)
+            self.__pyfhel.scalarProd(self, constCtxt, partitionSize)
             del constCtxt
         return self
 
@@ -287,28 +345,19 @@ class PyCtxt:
         # If one wants to perfor power n of a PyCtxt where n is not an int, we throw an error.
         if not isinstance(other, int):
             raise TypeError("PyCtxt '**=' error: lhs must be of type int instead of type " + str(type(other)))
-        # Create new Ctxt for result.
-        newCtxt = self.copy(self) 
+        # In lazy mode, build the expression instead
+        if self.__pyfhel.getLazy() and other >= 1:
+            return self.__lazyResult(self.__lazyNode("power", const=other), False)
         # If we want to perform our PyCtxt to power 0, we return an encrypted vector of 1.                       
         if(other==0):
-            newCtxt = self.__pyfhel.encrypt(PyPtxt([1 for _ in range(self.__length)],self.__pyfhel))	# Create new PyCtxt of encrypted vector of 1. 
-        # If we want to perform our PyCtxt to power 1, we return our PyCtxt.
+            newCtxt = self.__pyfhel.encrypt(PyPtxt([[1]*l for l in self.__length],self.__pyfhel))	# Create new PyCtxt of encrypted vector of 1. 
+        # If we want to perform our PyCtxt to power 1, we return a copy of our PyCtxt.
         elif(other==1):
-            #Do nothing.
-            newCtxt = newCtxt
-        # If we want to perform our PyCtxt to power 2, we return our PyCtxt square.
-        elif(other==2):
-            self.__pyfhel.square(newCtxt)
-        # If we want to perform our PyCtxt to power 3, we return our PyCtxt cube.
-        elif(other==3):
-            self.__pyfhel.cube(newCtxt)
-        # If we want to perform our PyCtxt to power n with n!=[0,1,2,3], we return our product(PyCtxt, n).
+            newCtxt = self.copy(self)
+        # If we want to perform our PyCtxt to power n with n>=2, we use square-and-multiply (square and cube for 2 and 3).
         else:
-            # Create a copy of self.
-            copySelf = self.copy(self)
-            # Multiply the PyCtxt with himself to obtain PyCtxt*n.                        
-            for i in range(other - 1):
-                 newCtxt *= copySelf  
+            # Perform the power from Afhel::powerNew into a new Ctxt, with O(log n) multiplications and depth.
+            newCtxt = self.__pyfhel.powerNew(self, other)
         return newCtxt
 
 
@@ -323,27 +372,21 @@ class PyCtxt:
         # If one wants to perfor power n of a PyCtxt where n is not an int, we throw an error.
         if not isinstance(other, int):
             raise TypeError("PyCtxt '**=' error: lhs must be of type int instead of type " + str(type(other)))
+        # In lazy mode, extend our expression instead
+        if self.__pyfhel.getLazy() and other >= 1:
+            return self.__lazyResult(self.__lazyNode("power", const=other), True)
         # If we want to perform our PyCtxt to power 0, we return an encrypted vector of 1.                       
         if(other==0):
-            constCtxt = self.__pyfhel.encrypt(PyPtxt([1 for _ in range(self.__length)],self.__pyfhel))	# Create new PyCtxt of encrypted vector of 1.
+            constCtxt = self.__pyfhel.encrypt(PyPtxt([[1]*l for l in self.__length],self.__pyfhel))	# Create new PyCtxt of encrypted vector of 1.
             self = constCtxt
         # If we want to perform our PyCtxt to power 1, we return our PyCtxt.
         elif(other==1):
             #Do nothing.
             self = self
-        # If we want to perform our PyCtxt to power 2, we return our PyCtxt square.
-        elif(other==2):
-            self.__pyfhel.square(self)
-        # If we want to perform our PyCtxt to power 3, we return our PyCtxt cube.
-        elif(other==3):
-            self.__pyfhel.cube(self)
-        # If we want to perform our PyCtxt to power n with n!=[0,1,2,3], we return our product(PyCtxt, n).
+        # If we want to perform our PyCtxt to power n with n>=2, we use square-and-multiply (square and cube for 2 and 3).
         else:
-            # Create a copy of self.
-            copySelf = self.copy(self) 
-            # Multiply the PyCtxt with himself to obtain PyCtxt*n.                                              
-            for i in range(other - 1):
-                 self *= copySelf
+            # Perform the power from Afhel::power, with O(log n) multiplications and depth.
+            self.__pyfhel.power(self, other)
         return self
 
 
@@ -351,16 +394,33 @@ class PyCtxt:
     # CUMULATIVE SUM
     # '~' operator, total added value in all positions of the vector
     def __invert__(self):
+        if self.__pyfhel.getLazy():
+            return self.__lazyResult(self.__lazyNode("cumSum"), True)
         self.__pyfhel.cumSum(self)
         return self
 
 
+    # PREFIX SUM
+    # Running sum over the slots (slot i gets the sum of slots 0..i)
+    def prefixSum(self):
+        self.__pyfhel.prefixSum(self)
+        return self
+
+    # WINDOW SUM
+    # Sliding-window sum over the slots (slot i gets the sum of slots i-width+1..i)
+    def windowSum(self, width):
+        self.__pyfhel.windowSum(self, width)
+        return self
+
+
 
     # SHIFT
     # 'lshift' operator
     def __lshift__(self, c):
         if not isinstance(c, numbers.Number):
             raise TypeError("c '*' error: it must be of type number instead of " + str(type(c)))
+        if self.__pyfhel.getLazy():
+            return self.__lazyResult(self.__lazyNode("shift", const=int(c)), True)
         self.__pyfhel.shift(self, c)
         return self
 
@@ -368,53 +428,50 @@ class PyCtxt:
     def __ilshift__(self, c):
         if not isinstance(c, numbers.Number):
             raise TypeError("c '*' error: it must be of type number instead of " + str(type(c)))
+        if self.__pyfhel.getLazy():
+            return self.__lazyResult(self.__lazyNode("shift", const=int(c)), True)
         self.__pyfhel.shift(self,c)    
         return self
 
 #-----------------------------Class Methods------------------------------
 
     """@Description:
-    #The method polynomialMult allow to perform polyniomial computations on an encrypted vector PyCtxt. The polynome is of the form: P(x)= a0 + a1 * x + a2 * x**2 + ... + an * x**n.
+    #The method polynomialMult allow to perform polyniomial computations on an encrypted vector PyCtxt and to return a PyCtxt object that contain the result. The polynome is of the form: P(x)= a0 + a1 * x + a2 * x**2 + ... + an * x**n, of any degree n. This method doesn't modify the PyCtxt.
+
+    #@param: The method takes a mandatory parameter: a list of int or a list of PyCtxt that represent the coefficients of the polynome.
+    #-param1: A list of int (same coefficients for all the slots) or a list of PyCtxt (encrypted coefficients) of the polynome. The first element of the list represents a0. The second element represents a1, etc...
 
-    #@param: The method takes a mandatory parameter: a list of PyCtxt that represent the coefficients of the polynome.
-    #-param1: A list of PyCtxt that represent the encrypted coefficients of the polynome. The first elements of the list must be a PyCtxt that represent a0. The second element must be a PyCtxt that represent a1, etc...
+    #@note: Earlier versions computed a0 + (a1*x) + (a2*x)**2 + ... + (an*x)**n, raising each coefficient to the power of its monomial. Each coefficient now multiplies its monomial once, as in P(x) above; pass ai**i as the i-th coefficient to get the old result.
     """
     def polynomialMult(self, coefficients=[], *args):
 
         """Verifications on the type of the arguments given"""
         #If coefficients is not a list, we throw an error.
         if not isinstance(coefficients, list):
-                raise TypeError("PyCtxt '-' error: coefficients must be of type list instead of " + str(type(coefficients)))
+                raise TypeError("PyCtxt polynomialMult error: coefficients must be of type list instead of " + str(type(coefficients)))
         #Otherwise, if coefficients is a list...
         elif isinstance(coefficients, list):
-                #We verify if each items in the list coefficients are all of type PyCtxt. If not, we throw an error.
-                if not all(isinstance(item, PyCtxt) for item in coefficients):
-                       raise TypeError("PyCtxt '-' error: the coefficients must be of type PyCtxt instead of " + str(type(coefficients)))
+                #We verify if the items in the list coefficients are all of type int or all of type PyCtxt. If not, we throw an error.
+                if not (all(isinstance(item, (int, long)) for item in coefficients) or all(isinstance(item, PyCtxt) for item in coefficients)):
+                       raise TypeError("PyCtxt polynomialMult error: the coefficients must be all of type int or all of type PyCtxt")
 
         """Verifications on the lenght of the encrypted vectors."""
-        #The lenght of each coefficient must be equal to the lenght of the X vector of the polynome P(X).
+        #The lenght of each encrypted coefficient must be equal to the lenght of the X vector of the polynome P(X).
         for i, a in enumerate(coefficients):
-                    if not self.getLen() == a.getLen():
+                    if isinstance(a, PyCtxt) and not self.getLen() == a.getLen():
                            print("\n")
                            print("Ciphertexts coefficients and the Ciphertexts X of the polynome P(X) have mismatched lengths.")
                            raise PyCtxtLenError()
         
-        """Verifications on the degree of the polynome given. TODO: could be improve to support degree n."""
-        #Define the number of coefficients of the polynome ie the degree of the polynome.
-        n = len(coefficients)
-        if n == 0:
+        """Verifications on the number of coefficients of the polynome given."""
+        if len(coefficients) == 0:
            raise ValueError("No coefficients have been given.")
-        #If we have more than 4 coefficients, it means that the degree of the polynome is greater than 4. And currently, Pyfhel only supports square and cube exponents.
-        if n > 4:
-           raise ValueError("Pyfhel only supports square (2) and cube (3) exponents.")
 
         """Perform the polynomial computations."""
-        # Store the Pyctxt that represent a0 in a variable. 
-        polynome_computation = coefficients[0]
-        # Add to Pyctxt that represent a0, the other monomes.
-        for i, a in enumerate(coefficients):
-                 if i != 0:
-                     polynome_computation += (a*self)**i
+        # Create new Ctxt for result.
+        polynome_computation = self.copy(self)
+        # Evaluate P(x) in Afhel with Paterson-Stockmeyer over a table of powers of x.
+        self.__pyfhel.polyEval(polynome_computation, coefficients)
         return polynome_computation   
 
 
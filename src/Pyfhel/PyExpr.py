@@ -0,0 +1,318 @@
+#
+#   PyExpr
+#   --------------------------------------------------------------------
+#   PYthon EXPRession is a part of Pyfhel. PyExpr is a node of the graph
+#   built by PyCtxt operators in lazy mode. When the result is needed, the
+#   graph is optimized (common subexpressions, balanced products, fused
+#   plaintext constants, lazy relinearization and reused temporaries) and
+#   compiled into a program that Afhel::evalProgram runs in one pass.
+#   --------------------------------------------------------------------
+#   License: GNU GPL v3
+#
+#   PyExpr is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   PyExpr is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+
+
+# Opcodes of Afhel::evalProgram (Afhel::EvalOp). Each instruction is made of
+#   4 integers: opcode, destination register, source and argument. Sources
+#   >= 0 are registers, and sources < 0 are the inputs (-1 is input 0).
+(OP_COPY, OP_ADD, OP_MUL, OP_MULNR, OP_RELIN, OP_NEG, OP_ADDC, OP_ADDV,
+ OP_MULC, OP_MULV, OP_POW, OP_SUMS, OP_SHIFT, OP_FREE, OP_RET) = range(15)
+
+
+class PyExpr:
+
+    # INITIALIZATION
+    #   op: "ctxt" (leaf), "add", "sub", "mult", "addPlain", "subPlain",
+    #       "multPlain", "power", "cumSum" or "shift"
+    #   args: child PyExpr nodes, or the PyCtxt holding the leaf cyphertexts
+    #   const: plaintext operand (int, list or PyPtxt), exponent or shift
+    def __init__(self, op, args=(), const=None):
+        self.op = op
+        self.args = args
+        self.const = const
+
+
+# Iterative post-order traversal of a DAG (expressions can be deeper than
+#   the recursion limit), visiting each node once
+def _postorder(root, children, key=id):
+    order = []
+    seen = set()
+    stack = [(root, False)]
+    while stack:
+        node, done = stack.pop()
+        if done:
+            order.append(node)
+            continue
+        if key(node) in seen:
+            continue
+        seen.add(key(node))
+        stack.append((node, True))
+        for c in reversed(children(node)):
+            if key(c) not in seen:
+                stack.append((c, False))
+    return order
+
+def _exprChildren(node):
+    return () if node.op == "ctxt" else node.args
+
+def _identity(x):
+    return x
+
+
+# LEAVES of an expression: the PyCtxt objects holding its input cyphertexts,
+#   in order of appearance
+def exprLeaves(root):
+    return [n.args[0] for n in _postorder(root, _exprChildren) if n.op == "ctxt"]
+
+
+# COMPILE an expression into (code, inputs, consts) for Afhel::evalProgram:
+#   the flat program, the input cyphertext IDs and the plaintext vectors,
+#   both with one entry per cyphertext position inside the PyCtxt leaves.
+def compileExpr(root, pyfhel):
+    mod = pyfhel.getModulus()
+    nSlots = pyfhel.numSlots()
+    leaves = []
+    leafIndex = {}
+    nIds = [None]
+    lens = [None]
+
+    # Plaintext constants: ("s", value) applies to every slot within the
+    #   length of each cyphertext, and ("v", vectors) holds one vector of
+    #   nSlots values per cyphertext. Both are zero beyond the lengths.
+    def normConst(ptxt, neg):
+        sign = -1 if neg else 1
+        if isinstance(ptxt, (int, long)):
+            return ("s", (sign*ptxt) % mod)
+        vects = pyfhel._plainList(ptxt, nIds[0])
+        return ("v", tuple(tuple([(sign*v) % mod for v in vect] + [0]*(nSlots - len(vect)))
+                           for vect in vects))
+    def vectors(c):
+        if c[0] == "v":
+            return c[1]
+        return tuple(tuple([c[1]]*l + [0]*(nSlots - l)) for l in lens[0])
+    def combine(c1, c2, f):
+        if c1 is None: return c2
+        if c2 is None: return c1
+        if c1[0] == "s" and c2[0] == "s":
+            return ("s", f(c1[1], c2[1]) % mod)
+        return ("v", tuple(tuple([f(a, b) % mod for a, b in zip(v1, v2)])
+                           for v1, v2 in zip(vectors(c1), vectors(c2))))
+    def negConst(c):
+        return combine(c, ("s", mod - 1), lambda a, b: a*b)
+
+    # PASS 1: binary DAG with common subexpressions merged (hash-consing)
+    nodes = []
+    index = {}
+    def intern(table, lst, key):
+        if key not in table:
+            table[key] = len(lst)
+            lst.append(key)
+        return table[key]
+    memo = {}
+    for node in _postorder(root, _exprChildren):
+        op = node.op
+        a = memo[id(node.args[0])] if op != "ctxt" else None
+        if op == "ctxt":
+            ids = node.args[0].getIDs()
+            if nIds[0] is None:
+                nIds[0] = len(ids)
+                lens[0] = pyfhel._ctxtLens(node.args[0])
+            if id(node.args[0]) not in leafIndex:
+                leafIndex[id(node.args[0])] = len(leaves)
+                leaves.append(ids)
+            key = ("in", leafIndex[id(node.args[0])])
+        elif op in ("add", "sub", "mult"):
+            b = memo[id(node.args[1])]
+            if op == "sub":
+                key = ("add", a, b, True)
+            else:
+                key = ("add" if op == "add" else "mul", min(a, b), max(a, b), False)
+        elif op in ("addPlain", "subPlain"):
+            key = ("addc", a, normConst(node.const, op == "subPlain"))
+        elif op == "multPlain":
+            key = ("mulc", a, normConst(node.const, False))
+        elif op in ("power", "cumSum", "shift"):
+            key = (op, a, node.const)
+        else:
+            raise ValueError("PyExpr compile error: unknown operation " + str(op))
+        memo[id(node)] = intern(index, nodes, key)
+    top = memo[id(root)]
+
+    def binChildren(i):
+        k = nodes[i]
+        if k[0] == "in": return ()
+        if k[0] in ("add", "mul"): return (k[1], k[2])
+        return (k[1],)
+    binOrder = _postorder(top, binChildren, _identity)
+    uses = dict((i, 0) for i in binOrder)
+    for i in binOrder:
+        for c in binChildren(i):
+            uses[c] += 1
+
+    # PASS 2: n-ary DAG. Single-use chains of additions and products are
+    #   flattened (fusing their plaintext constants), and single-use products
+    #   of two factors inside sums are kept unrelinearized until the end.
+    naryNodes = []
+    naryIndex = {}
+    nary = {}
+    for i in binOrder:
+        k = nodes[i]
+        if k[0] == "in":
+            key = k
+        elif k[0] in ("add", "addc"):
+            terms, raws, const = [], [], None
+            pending = [(i, False)]
+            while pending:
+                j, neg = pending.pop()
+                kj = nodes[j]
+                if (j == i or uses[j] == 1) and kj[0] == "add":
+                    pending += [(kj[1], neg), (kj[2], neg != kj[3])]
+                elif (j == i or uses[j] == 1) and kj[0] == "addc":
+                    pending.append((kj[1], neg))
+                    const = combine(const, negConst(kj[2]) if neg else kj[2], lambda a, b: a + b)
+                elif uses[j] == 1 and kj[0] == "mul" and naryNodes[nary[j]][2] is None \
+                        and len(naryNodes[nary[j]][1]) == 2:
+                    fa, fb = naryNodes[nary[j]][1]
+                    raws.append((fa, fb, neg))
+                else:
+                    terms.append((nary[j], neg))
+            key = ("sum", tuple(sorted(terms)), tuple(sorted(raws)), const)
+        elif k[0] in ("mul", "mulc"):
+            factors, const = [], None
+            pending = [i]
+            while pending:
+                j = pending.pop()
+                kj = nodes[j]
+                if (j == i or uses[j] == 1) and kj[0] == "mul":
+                    pending += [kj[1], kj[2]]
+                elif (j == i or uses[j] == 1) and kj[0] == "mulc":
+                    pending.append(kj[1])
+                    const = combine(const, kj[2], lambda a, b: a*b)
+                else:
+                    factors.append(nary[j])
+            key = ("prod", tuple(sorted(factors)), const)
+        else:
+            key = (k[0], nary[k[1]], k[2])
+        nary[i] = intern(naryIndex, naryNodes, key)
+
+    def naryRefs(n):
+        k = naryNodes[n]
+        if k[0] == "in": return []
+        if k[0] == "sum": return [t for t, _ in k[1]] + [f for fa, fb, _ in k[2] for f in (fa, fb)]
+        if k[0] == "prod": return list(k[1])
+        return [k[1]]
+    naryTop = nary[top]
+    naryOrder = _postorder(naryTop, lambda n: list(set(naryRefs(n))), _identity)
+    rem = dict((n, 0) for n in naryOrder)
+    for n in naryOrder:
+        for c in naryRefs(n):
+            rem[c] += 1
+    rem[naryTop] += 1                           # Used by the final OP_RET
+
+    # PASS 3: code generation, reusing registers on the last use of a value
+    code = []
+    consts = [[] for _ in range(nIds[0])]
+    constIndex = {}
+    freeRegs = []
+    nRegs = [0]
+    loc = {}
+    def emit(op, dst, src=0, arg=0):
+        code.extend([op, dst, src, arg])
+    def newReg():
+        if freeRegs:
+            return freeRegs.pop()
+        nRegs[0] += 1
+        return nRegs[0] - 1
+    def release(n):
+        rem[n] -= 1
+        if rem[n] == 0 and loc[n] >= 0:         # Drop temporaries right away
+            emit(OP_FREE, loc[n])
+            freeRegs.append(loc[n])
+    def take(n):                                # Register that can be overwritten
+        if loc[n] >= 0 and rem[n] == 1:
+            rem[n] = 0
+            return loc[n]
+        r = newReg()
+        emit(OP_COPY, r, loc[n])
+        release(n)
+        return r
+    def applyConst(r, c, opVector, neutral):
+        if c is None or c == ("s", neutral):
+            return
+        if c[0] == "s":                         # Within the lengths only
+            c = ("v", vectors(c))
+        if c not in constIndex:
+            constIndex[c] = len(consts[0])
+            for j in range(nIds[0]):
+                consts[j].append(list(c[1][j]))
+        emit(opVector, r, 0, constIndex[c])
+
+    for n in naryOrder:
+        k = naryNodes[n]
+        if k[0] == "in":
+            loc[n] = -(k[1] + 1)
+            continue
+        if k[0] == "sum":
+            acc = None
+            for fa, fb, neg in k[2]:            # Products without relinearization
+                r = take(fa)
+                emit(OP_MULNR, r, loc[fb])
+                release(fb)
+                if acc is None:
+                    acc = r
+                    if neg: emit(OP_NEG, acc)
+                else:
+                    emit(OP_ADD, acc, r, int(neg))
+                    emit(OP_FREE, r)
+                    freeRegs.append(r)
+            if k[2]:
+                emit(OP_RELIN, acc)             # Single key switching for all of them
+            for t, neg in k[1]:
+                if acc is None:
+                    acc = take(t)
+                    if neg: emit(OP_NEG, acc)
+                else:
+                    emit(OP_ADD, acc, loc[t], int(neg))
+                    release(t)
+            applyConst(acc, k[3], OP_ADDV, 0)
+        elif k[0] == "prod":
+            level = [("node", f) for f in k[1]]
+            while len(level) > 1:               # Balanced tree: minimal depth
+                nxt = []
+                for x, y in zip(level[0::2], level[1::2]):
+                    r = take(x[1]) if x[0] == "node" else x[1]
+                    if y[0] == "node":
+                        emit(OP_MUL, r, loc[y[1]])
+                        release(y[1])
+                    else:
+                        emit(OP_MUL, r, y[1])
+                        emit(OP_FREE, y[1])
+                        freeRegs.append(y[1])
+                    nxt.append(("reg", r))
+                if len(level) % 2:
+                    nxt.append(level[-1])
+                level = nxt
+            acc = take(level[0][1]) if level[0][0] == "node" else level[0][1]
+            applyConst(acc, k[2], OP_MULV, None)    # Even 1 clears the filler slots
+        else:
+            acc = take(k[1])
+            op = {"power": OP_POW, "cumSum": OP_SUMS, "shift": OP_SHIFT}[k[0]]
+            emit(op, acc, 0, k[2] if k[2] is not None else 0)
+        loc[n] = acc
+    emit(OP_RET, take(naryTop))
+
+    inputs = [[ids[j] for ids in leaves] for j in range(nIds[0])]
+    return code, inputs, consts
@@ -0,0 +1,57 @@
+#
+#   PyMatrix
+#   --------------------------------------------------------------------
+#   PYthon MATRIX is a part of Pyfhel. PyMatrix holds an encrypted matrix
+#   packed into the slots of a single PyCtxt: padded with zeros up to a
+#   d x d square, slot d*i+j holds the element of row i and column j.
+#   PyMatrix overrides * with matMul from Pyfhel.
+#   --------------------------------------------------------------------
+#   License: GNU GPL v3
+#
+#   PyMatrix is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   PyMatrix is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+
+# Import the other modules from Pyfhel.
+from PyCtxt import PyCtxt
+
+
+class PyMatrix:
+
+    # INITIALIZATION
+    #   ctxt: PyCtxt with a single cyphertext holding the packed matrix
+    #   shape: (rows, cols) of the matrix
+    #   dim: side d of the packed square, with rows <= d and cols <= d
+    def __init__(self, ctxt, shape, dim):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("PyMatrix init error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        if len(shape) != 2 or shape[0] > dim or shape[1] > dim:
+            raise ValueError("PyMatrix init error: shape must be (rows, cols) with both at most dim")
+        self.__ctxt = ctxt
+        self.__shape = (shape[0], shape[1])
+        self.__dim = dim
+        return
+
+    def getCtxt(self):      return self.__ctxt
+    def getShape(self):     return self.__shape
+    def getDim(self):       return self.__dim
+    def getPyfhel(self):    return self.__ctxt.getPyfhel()
+
+
+    # MATRIX PRODUCT
+    # '*' operator -> encrypted matrix product with another PyMatrix
+    def __mul__(self, other):
+        if not isinstance(other, PyMatrix):
+            raise TypeError("PyMatrix '*' error: lhs must be of type PyMatrix instead of type " + str(type(other)))
+        return self.getPyfhel().matMul(self, other)
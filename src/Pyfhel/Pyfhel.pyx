@@ -31,59 +31,177 @@ from libcpp.vector cimport vector
 from libcpp.string cimport string
 from libcpp cimport bool
 
-# Using Ctypes to define the Afhel class
-cdef extern from "Afhel.h":
+# Using Ctypes to define the Afhel class. All its methods can run without the GIL
+cdef extern from "Afhel.h" nogil:
     cdef cppclass Afhel:
         Afhel() except +
         void keyGen(long p, long r, long c, long d, long sec, long w,
             long L, long m, long R, long s,
             const vector[long]& gens,
             const vector[long]& ords) except +
-        string encrypt(vector[long] ptxt_vect) except +
-        vector[long] decrypt(string id1) except +
-
-        void add(string id1, string id2, bool negative) except +
-        void mult(string id1, string id2) except +
-        void mult3(string id1, string id2, string id3) except +
-        void scalarProd(string id1, string id2, int partitionSize) except +
-        void cumSum(string id1) except +
-        void square(string id1) except +
-        void cube(string id1) except +
-        void negate(string id1) except +
-        bool equalsTo(string id1, string id2, bool comparePkeys) except +
-        void rotate(string id1, long c) except +
-        void shift(string id1, long c) except +
-
-        bool saveEnv(string fileName) except +
+        long encrypt(vector[long] ptxt_vect) except +
+        vector[long] encryptArray(const long* data, long nRows, long nCols,
+            long fill, long nThreads) except +
+        vector[long] decrypt(long id1) except +
+        void decryptArray(const vector[long]& ids, long* out, long nCols,
+            long nThreads) except +
+
+        void add(long id1, long id2, bool negative) except +
+        void add(const vector[long]& ids1, const vector[long]& ids2, bool negative) except +
+        void addConstant(long id1, long c, bool negative) except +
+        void addConstant(long id1, vector[long] ptxt_vect, bool negative) except +
+        void mult(long id1, long id2) except +
+        void mult3(long id1, long id2, long id3) except +
+        void mult(const vector[long]& ids1, const vector[long]& ids2) except +
+        void mult3(const vector[long]& ids1, const vector[long]& ids2,
+            const vector[long]& ids3) except +
+        void multNoRelin(const vector[long]& ids1, const vector[long]& ids2) except +
+        void relinearize(const vector[long]& ids) except +
+        long sumOfProducts(const vector[long]& ids1, const vector[long]& ids2) except +
+        void fma(const vector[long]& accs, const vector[long]& ids1,
+            const vector[long]& ids2) except +
+        void fmaPlain(long acc, long id1, long c) except +
+        void fmaPlain(const vector[long]& accs, const vector[long]& ids,
+            const vector[vector[long]]& ptxts) except +
+        void fmaSum(long acc, const vector[long]& ids1, const vector[long]& ids2) except +
+        void fmaPlainSum(long acc, const vector[long]& ids,
+            const vector[vector[long]]& ptxts) except +
+        vector[long] addNew(const vector[long]& ids1, const vector[long]& ids2,
+            bool negative) except +
+        vector[long] multNew(const vector[long]& ids1, const vector[long]& ids2) except +
+        vector[long] addConstantNew(const vector[long]& ids, long c, bool negative) except +
+        vector[long] addConstantNew(const vector[long]& ids,
+            const vector[vector[long]]& ptxts, bool negative) except +
+        vector[long] multByConstantNew(const vector[long]& ids, long c) except +
+        vector[long] multByConstantNew(const vector[long]& ids,
+            const vector[vector[long]]& ptxts) except +
+        vector[long] powerNew(const vector[long]& ids, long n) except +
+        void multByConstant(long id1, long c) except +
+        void multByConstant(long id1, vector[long] ptxt_vect) except +
+        void scalarProd(long id1, long id2, int partitionSize) except +
+        void scalarProd(const vector[long]& ids1, const vector[long]& ids2,
+            int partitionSize) except +
+        void cumSum(long id1) except +
+        void cumSum(const vector[long]& ids) except +
+        void prefixSum(const vector[long]& ids) except +
+        void windowSum(const vector[long]& ids, long width) except +
+        void square(long id1) except +
+        void square(const vector[long]& ids) except +
+        void cube(long id1) except +
+        void cube(const vector[long]& ids) except +
+        void power(long id1, long n) except +
+        void power(const vector[long]& ids, long n) except +
+        void polyEval(long id1, vector[long] coeffs) except +
+        void polyEvalCtxt(long id1, vector[long] coeffIds) except +
+        void negate(long id1) except +
+        void negate(const vector[long]& ids) except +
+        bool equalsTo(long id1, long id2, bool comparePkeys) except +
+        vector[long] matVec(const vector[long]& ids, const vector[vector[long]]& matrix) except +
+        vector[long] matMul(const vector[long]& idsA, const vector[long]& idsB, long d) except +
+        void rotate(long id1, long c) except +
+        void rotate(const vector[long]& ids, long c) except +
+        vector[vector[long]] rotateMany(const vector[long]& ids, const vector[long]& amounts) except +
+        void shift(long id1, long c) except +
+        void shift(const vector[long]& ids, long c) except +
+
+        vector[long] evalProgram(vector[long]& code, vector[vector[long]]& inputs,
+                                 vector[vector[vector[long]]]& consts) except +
+        void setNumWorkers(long n) except +
+        long getNumWorkers() except +
+        void setNumThreads(long n) except +
+        long getNumThreads() except +
+        void setParallelMode(long mode) except +
+        long getParallelMode() except +
+        double capacity(long id1) except +
+        double noiseBound(long id1) except +
+        void setCapacityGuard(double minBits) except +
+        double getCapacityGuard() except +
+        long level(long id1) except +
+        void modDownTo(vector[long]& ids, long lvl) except +
+        void setAutoModSwitch(bool on) except +
+        bool getAutoModSwitch() except +
+        void setDepthHint(long depth) except +
+        long getDepthHint() except +
+        void setRotationKeys(long mode) except +
+        long getRotationKeys() except +
+        void addRotationKeys(vector[long]& amounts) except +
+        void addFrobeniusKeys(vector[long]& powers) except +
+
+        void setPtxtCacheBudget(long nBytes) except +
+        void clearPtxtCache() except +
+        long getPtxtCacheBudget() except +
+        long getPtxtCacheBytes() except +
+        long getPtxtCacheHits() except +
+        long getPtxtCacheMisses() except +
+
+        bool saveEnv(string fileName, bool checksummed) except +
         bool restoreEnv(string fileName) except +
+        string serialize(long id1) except +
+        long deserialize(string& data) except +
+        bool saveCtxts(string fileName, vector[long]& ids, vector[long]& lens) except +
+        vector[long] loadCtxts(string fileName, vector[long]& lens, bool useMmap) except +
 
         long numSlots() except +
         long getM() except +
         long getP() except +
         long getR() except +
-        string set(string key) except +
-        void erase(string key) except +
+        long getL() except +
+        long set(long id1) except +
+        void erase(long id1) except +
+
+# NumPy arrays are read through typed memoryviews (buffer protocol)
+import numpy as np
+import struct
+import os
+import json
+import hashlib
+import tempfile
 
 # Import the Plaintext and Cyphertext classes for Python
 from PyPtxt import PyPtxt
 from PyCtxt import PyCtxt
 from PyCtxt import PyCtxtLenError
+from PyExpr import exprLeaves, compileExpr
+from PyMatrix import PyMatrix
+
+# Parallel modes of Afhel, by name
+PARALLEL_MODES = {"auto": 0, "intra": 1, "inter": 2}
+
+# Rotation key modes of Afhel, by name
+ROTATION_KEYS = {"some": 0, "none": 1, "lazy": 2}
+
+# keyGen parameters that identify an entry of the keyGen cache
+KEYGEN_CACHE_PARAMS = ("p", "r", "c", "d", "sec", "w", "L", "m", "R", "s", "gens", "ords")
 
 cdef class Pyfhel:
     cdef Afhel *afhel               # The C++ methods are accessed via a pointer
     cdef long modulus               # p^r, plaintext/cyphertext space size
+    cdef object keyGenCacheDir      # Directory of the keyGen cache, or None
+    cdef bint keyGenCacheKeys       # Whether the cache stores the keys too
+    cdef bint lazy                  # PyCtxt operators build expressions
 
 
     # INIT & DESTRUCT
     def __cinit__(self):
         self.afhel = new Afhel()
+        self.keyGenCacheDir = None
+        self.keyGenCacheKeys = False
+        self.lazy = False
     def __dealloc__(self):
         del self.afhel
 
     
     # ----------------------------- CRYPTOGRAPHY ------------------------------
-    # KEY GENERATION using the Afhel::keyGen for simplicity
+    # KEY GENERATION using the Afhel::keyGen for simplicity. If the keyGen cache
+    #   is enabled, the environment is restored from the cache when available.
     def keyGen(self, run_params):
+        if self.keyGenCacheDir is not None:
+            self._cachedKeyGen(run_params)
+        else:
+            self._keyGen(run_params)
+        self.modulus = long(pow(run_params["p"], run_params["r"]))
+
+    def _keyGen(self, run_params):
         cdef vector[long] gens;
         cdef vector[long] ords;
         for k in run_params["gens"]:
@@ -96,8 +214,54 @@ cdef class Pyfhel:
                            run_params["L"],  run_params["m"],
                            run_params["R"],  run_params["s"],
                              gens, ords)
-        self.modulus = long(pow(run_params["p"], run_params["r"]))
-    
+
+
+    # KEYGEN CACHE
+    # Enables an on-disk cache of keyGen results in cacheDir (None disables
+    #   it). Each entry, keyed by a hash of run_params, holds the derived m
+    #   and L and, if keys is True, the whole environment (context and keys).
+    #   keys=True stores the SECRET KEY unencrypted in cacheDir: only use it
+    #   with a directory no one else can read.
+    def setKeyGenCache(self, cacheDir, keys=False):
+        if cacheDir is not None and not isinstance(cacheDir, str):
+            raise TypeError("Pyfhel setKeyGenCache error: cacheDir must be of type str instead of type " + str(type(cacheDir)))
+        if cacheDir is not None and not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        self.keyGenCacheDir = cacheDir
+        self.keyGenCacheKeys = keys
+    def getKeyGenCache(self):
+        return self.keyGenCacheDir
+
+    def _cachedKeyGen(self, run_params):
+        params = {}
+        for k in KEYGEN_CACHE_PARAMS:
+            v = run_params[k]
+            params[k] = [long(x) for x in v] if k in ("gens", "ords") else long(v)
+        params["rotKeys"] = self.afhel.getRotationKeys()
+        key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        path = os.path.join(self.keyGenCacheDir, key)
+        if self.keyGenCacheKeys and os.path.exists(path + ".aenv"):
+            if self.afhel.restoreEnv(path):     # Context and keys from cache
+                return
+        if os.path.exists(path + ".json"):      # Skip FindM & the L heuristic
+            with open(path + ".json") as f:
+                derived = json.load(f)
+            params["m"], params["L"] = derived["m"], derived["L"]
+        self._keyGen(params)
+        derived = {"m": self.afhel.getM(), "L": self.afhel.getL()}
+        # Atomic writes through a temporary file of our own, so that workers
+        #   sharing cacheDir never write to the same one
+        fd, tmp = tempfile.mkstemp(dir=self.keyGenCacheDir, prefix=key + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(derived, f)
+            os.rename(tmp, path + ".json")
+            if self.keyGenCacheKeys and self.afhel.saveEnv(tmp, True):
+                os.rename(tmp + ".aenv", path + ".aenv")
+        finally:
+            for f in (tmp, tmp + ".aenv"):
+                if os.path.exists(f):
+                    os.remove(f)
 
     # ENCRYPTION encrypt a PyPtxt object into a PyCtxt object
     def encrypt(self, ptxt, fill=0):
@@ -121,6 +285,31 @@ cdef class Pyfhel:
         return ctxt                         # returns the PyCtxt with all the appended keys
 
 
+    # ENCRYPT ARRAY encrypt each row of a 2-D int64 array into a single PyCtxt.
+    #   Padding and encryption are done in Afhel without the GIL, spreading the
+    #   rows across nThreads threads (the worker pool if nThreads is 0).
+    def encryptArray(self, arr, fill=0, nThreads=0):
+        arr = np.ascontiguousarray(arr, dtype=np.int64)
+        if arr.ndim != 2:
+            raise ValueError("Pyfhel encryptArray error: array must be 2-D (rows x slots) instead of %d-D"%(arr.ndim))
+        cdef long[:, ::1] data = arr
+        cdef long nRows = data.shape[0]
+        cdef long nCols = data.shape[1]
+        cdef long cFill = fill
+        cdef long cThreads = nThreads
+        cdef vector[long] ids
+        if nRows == 0 or nCols == 0:
+            raise ValueError("Pyfhel encryptArray error: array must not be empty")
+        if self.numSlots() < nCols:
+            raise ValueError("Pyfhel encryptArray error: array has more columns than number of plaintext slots")
+        with nogil:                         # Pad & encrypt all rows in C++
+            ids = self.afhel.encryptArray(&data[0, 0], nRows, nCols, cFill, cThreads)
+        ctxt = PyCtxt(self, [nCols for _ in range(nRows)])
+        for i in ids:                       # Append the keys in row order
+            ctxt.appendID(i)
+        return ctxt
+
+
     # DECRYPT a PyCtxt object into a List of values
     def decrypt(self, ctxt):
         if not isinstance(ctxt, PyCtxt):
@@ -138,6 +327,37 @@ cdef class Pyfhel:
         return retList                      # Return only the non-filler values
 
 
+    # DECRYPT ARRAY decrypt all the cyphertexts of a PyCtxt into the rows of a
+    #   contiguous int64 array (newly allocated if out is None). Decryption is
+    #   done in Afhel without the GIL, spreading the rows across nThreads
+    #   threads (the worker pool if nThreads is 0).
+    #   Slots beyond the length of a row hold the filler values, as combined by
+    #   the operations between cyphertexts (plaintext constants are zero there).
+    def decryptArray(self, ctxt, out=None, nThreads=0):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel decryptArray error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef long nRows = ids.size()
+        cdef long nCols
+        cdef long cThreads = nThreads
+        if out is None:
+            out = np.empty((nRows, max(ctxt.getLen())), dtype=np.int64)
+        elif (not isinstance(out, np.ndarray) or out.dtype != np.int64
+              or out.ndim != 2 or not out.flags['C_CONTIGUOUS']):
+            raise TypeError("Pyfhel decryptArray error: out must be a C-contiguous 2-D int64 array")
+        cdef long[:, ::1] res = out
+        nCols = res.shape[1]
+        if res.shape[0] != nRows:
+            raise ValueError("Pyfhel decryptArray error: out must have one row per cyphertext in ctxt")
+        if self.numSlots() < nCols:
+            raise ValueError("Pyfhel decryptArray error: out has more columns than number of plaintext slots")
+        if nRows == 0 or nCols == 0:
+            return out
+        with nogil:                         # Decrypt all rows in C++
+            self.afhel.decryptArray(ids, &res[0, 0], nCols, cThreads)
+        return out
+
+
     # DUPLICATE a PyCtxt with all its parameters, useful to keep originals in ops
     def duplicate(self, ctxt):
         if not isinstance(ctxt, PyCtxt):
@@ -157,13 +377,35 @@ cdef class Pyfhel:
         if not isinstance(ctxt2, PyCtxt):
             raise TypeError("Pyfhel addCtxt error: ctxt2 must be of type PyCtxt instead of type " + str(type(ctxt2)))
 
-        ids1 = ctxt1.getIDs()
-        ids2 = ctxt2.getIDs()
-        n_ids = len(ids1)
-        if n_ids != len(ids2):              # They must have the same # of IDs
+        cdef vector[long] ids1 = ctxt1.getIDs()
+        cdef vector[long] ids2 = ctxt2.getIDs()
+        cdef bool cNeg = neg
+        if ids1.size() != ids2.size():      # They must have the same # of IDs
             raise PyCtxtLenError()
-        for i in range(n_ids):              # Use Afhel::add to + each pair of Ctxts by IDs
-            self.afhel.add(ids1[i],ids2[i], neg)
+        with nogil:                         # Use Afhel::add to + all pairs of Ctxts by IDs
+            self.afhel.add(ids1, ids2, cNeg)
+
+
+    # ADD a plaintext constant to each cyphertext inside PyCtxt ctxt without
+    #   encrypting it: an int (same value for all slots within the length of
+    #   the cyphertext), or a list or PyPtxt (one value per slot). If neg is
+    #   True the constant is substracted.
+    def addPlain(self, ctxt, ptxt, neg=False):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel addPlain error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        cdef long cId
+        cdef vector[long] ptxtVect
+        cdef bool cNeg = neg
+        ids = ctxt.getIDs()
+        n_ids = len(ids)
+        if isinstance(ptxt, (int, long)):
+            ptxtList = self._scalarList(ctxt, ptxt)
+        else:
+            ptxtList = self._plainList(ptxt, n_ids)
+        for i in range(n_ids):              # Use Afhel::addConstant with each vector
+            cId = ids[i]
+            ptxtVect = ptxtList[i]
+            self.afhel.addConstant(cId, ptxtVect, cNeg)
 
 
     # MULTiply two PyCtxt objects for each ID in both
@@ -172,13 +414,12 @@ cdef class Pyfhel:
             raise TypeError("Pyfhel multiplyBy error: ctxt1 must be of type PyCtxt instead of type " + str(type(ctxt1)))
         if not isinstance(ctxt2, PyCtxt):
             raise TypeError("Pyfhel multiplyBy error: ctxt2 must be of type PyCtxt instead of type " + str(type(ctxt2)))
-        ids1 = ctxt1.getIDs()
-        ids2 = ctxt2.getIDs()
-        n_ids = len(ids1)
-        if n_ids != len(ids2):              # They must have the same # of IDs
+        cdef vector[long] ids1 = ctxt1.getIDs()
+        cdef vector[long] ids2 = ctxt2.getIDs()
+        if ids1.size() != ids2.size():      # They must have the same # of IDs
             raise PyCtxtLenError()
-        for i in range(n_ids):              # Use Afhel::mult to * each pair of Ctxts by IDs
-            self.afhel.mult(ids1[i],ids2[i])
+        with nogil:                         # Use Afhel::mult to * all pairs of Ctxts by IDs
+            self.afhel.mult(ids1, ids2)
 
 
     # MULTIPLY 3 PyCtxt objects for each ID in both
@@ -189,33 +430,270 @@ cdef class Pyfhel:
             raise TypeError("Pyfhel multiplyBy error: ctxt2 must be of type PyCtxt instead of type " + str(type(ctxt2)))
         if not isinstance(ctxt3, PyCtxt):
             raise TypeError("Pyfhel multiplyBy error: ctxt3 must be of type PyCtxt instead of type " + str(type(ctxt3)))    
+        cdef vector[long] ids1 = ctxt1.getIDs()
+        cdef vector[long] ids2 = ctxt2.getIDs()
+        cdef vector[long] ids3 = ctxt3.getIDs()
+        if ids1.size() != ids2.size():      # They must have the same # of IDs
+            raise PyCtxtLenError()
+        if ids1.size() != ids3.size():      # They must have the same # of IDs
+            raise PyCtxtLenError()
+        with nogil:                         # Use Afhel::mult3 to * all triplets of Ctxts by IDs
+            self.afhel.mult3(ids1, ids2, ids3)
+
+
+    # MULTIPLY 2 PyCtxt objects for each ID in both, without relinearizing.
+    #   The result must be relinearized (or summed and then relinearized)
+    #   before any further multiplication.
+    def multNoRelin(self, ctxt1, ctxt2):
+        if not isinstance(ctxt1, PyCtxt):
+            raise TypeError("Pyfhel multNoRelin error: ctxt1 must be of type PyCtxt instead of type " + str(type(ctxt1)))
+        if not isinstance(ctxt2, PyCtxt):
+            raise TypeError("Pyfhel multNoRelin error: ctxt2 must be of type PyCtxt instead of type " + str(type(ctxt2)))
+        cdef vector[long] ids1 = ctxt1.getIDs()
+        cdef vector[long] ids2 = ctxt2.getIDs()
+        if ids1.size() != ids2.size():      # They must have the same # of IDs
+            raise PyCtxtLenError()
+        with nogil:
+            self.afhel.multNoRelin(ids1, ids2)
+
+
+    # RELINEARIZE each cyphertext inside PyCtxt ctxt
+    def relinearize(self, ctxt):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel relinearize error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        cdef vector[long] ids = ctxt.getIDs()
+        with nogil:
+            self.afhel.relinearize(ids)
+
+
+    # SUM OF PRODUCTS sum of ctxtsA[k]*ctxtsB[k] over two lists of PyCtxt,
+    #   relinearized once at the end. Returns a new PyCtxt.
+    def sumOfProducts(self, ctxtsA, ctxtsB):
+        if len(ctxtsA) != len(ctxtsB) or len(ctxtsA) == 0:
+            raise ValueError("Pyfhel sumOfProducts error: lists must be non-empty and of the same length")
+        for ctxt in list(ctxtsA) + list(ctxtsB):
+            if not isinstance(ctxt, PyCtxt):
+                raise TypeError("Pyfhel sumOfProducts error: elements must be of type PyCtxt instead of type " + str(type(ctxt)))
+            if len(ctxt.getIDs()) != len(ctxtsA[0].getIDs()):
+                raise PyCtxtLenError()
+        cdef vector[long] ids1
+        cdef vector[long] ids2
+        cdef long resId
+        res = PyCtxt(self, ctxtsA[0].getLen())
+        for j in range(len(ctxtsA[0].getIDs())):    # One sum per cyphertext position
+            ids1 = [ctxt.getIDs()[j] for ctxt in ctxtsA]
+            ids2 = [ctxt.getIDs()[j] for ctxt in ctxtsB]
+            with nogil:
+                resId = self.afhel.sumOfProducts(ids1, ids2)
+            res.appendID(resId)
+        return res
+
+
+    # FUSED MULTIPLY-ADD acc += ctxt1 * ctxt2, modifying only acc. If ctxt1 and
+    #   ctxt2 are lists of PyCtxt, acc += sum of ctxt1[k]*ctxt2[k] (relinearized
+    #   only once).
+    def fma(self, acc, ctxt1, ctxt2):
+        if not isinstance(acc, PyCtxt):
+            raise TypeError("Pyfhel fma error: acc must be of type PyCtxt instead of type " + str(type(acc)))
+        cdef vector[long] accIds = acc.getIDs()
+        cdef vector[long] ids1
+        cdef vector[long] ids2
+        cdef long accId
+        if isinstance(ctxt1, list) and isinstance(ctxt2, list):
+            if len(ctxt1) != len(ctxt2) or len(ctxt1) == 0:
+                raise ValueError("Pyfhel fma error: lists must be non-empty and of the same length")
+            for ctxt in ctxt1 + ctxt2:
+                if not isinstance(ctxt, PyCtxt):
+                    raise TypeError("Pyfhel fma error: elements must be of type PyCtxt instead of type " + str(type(ctxt)))
+                if len(ctxt.getIDs()) != accIds.size():
+                    raise PyCtxtLenError()
+            for j in range(accIds.size()):  # One batched sum per cyphertext position
+                accId = accIds[j]
+                ids1 = [ctxt.getIDs()[j] for ctxt in ctxt1]
+                ids2 = [ctxt.getIDs()[j] for ctxt in ctxt2]
+                with nogil:
+                    self.afhel.fmaSum(accId, ids1, ids2)
+            return
+        if not isinstance(ctxt1, PyCtxt):
+            raise TypeError("Pyfhel fma error: ctxt1 must be of type PyCtxt instead of type " + str(type(ctxt1)))
+        if not isinstance(ctxt2, PyCtxt):
+            raise TypeError("Pyfhel fma error: ctxt2 must be of type PyCtxt instead of type " + str(type(ctxt2)))
         ids1 = ctxt1.getIDs()
         ids2 = ctxt2.getIDs()
-        ids3 = ctxt3.getIDs()
-        n_ids = len(ids1)
-        if n_ids != len(ids2):              # They must have the same # of IDs
+        if ids1.size() != accIds.size() or ids2.size() != accIds.size():
+            raise PyCtxtLenError()
+        with nogil:
+            self.afhel.fma(accIds, ids1, ids2)
+
+
+    # FUSED MULTIPLY-ADD with plaintext acc += ctxt * ptxt, modifying only acc,
+    #   with ptxt an int, a list or a PyPtxt as in multPlain. If ctxt is a list
+    #   of PyCtxt and ptxt a list of as many plaintexts, acc += sum of
+    #   ctxt[k]*ptxt[k].
+    def fmaPlain(self, acc, ctxt, ptxt):
+        if not isinstance(acc, PyCtxt):
+            raise TypeError("Pyfhel fmaPlain error: acc must be of type PyCtxt instead of type " + str(type(acc)))
+        cdef vector[long] accIds = acc.getIDs()
+        cdef vector[long] ids
+        cdef vector[vector[long]] ptxts
+        cdef long accId
+        n_ids = accIds.size()
+        if isinstance(ctxt, list):
+            if not isinstance(ptxt, list) or len(ctxt) != len(ptxt) or len(ctxt) == 0:
+                raise ValueError("Pyfhel fmaPlain error: ctxt and ptxt must be non-empty lists of the same length")
+            for c in ctxt:
+                if not isinstance(c, PyCtxt):
+                    raise TypeError("Pyfhel fmaPlain error: elements must be of type PyCtxt instead of type " + str(type(c)))
+                if len(c.getIDs()) != n_ids:
+                    raise PyCtxtLenError()
+            ptxtLists = [self._scalarList(c, p) if isinstance(p, (int, long))
+                         else self._plainList(p, n_ids) for c, p in zip(ctxt, ptxt)]
+            for j in range(n_ids):          # One batched sum per cyphertext position
+                accId = accIds[j]
+                ids = [c.getIDs()[j] for c in ctxt]
+                ptxts = [p[j] for p in ptxtLists]
+                with nogil:
+                    self.afhel.fmaPlainSum(accId, ids, ptxts)
+            return
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel fmaPlain error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        ids = ctxt.getIDs()
+        if ids.size() != n_ids:
             raise PyCtxtLenError()
-        if n_ids != len(ids3):              # They must have the same # of IDs
+        if isinstance(ptxt, (int, long)):
+            ptxts = self._scalarList(ctxt, ptxt)
+        else:
+            ptxts = self._plainList(ptxt, n_ids)
+        with nogil:
+            self.afhel.fmaPlain(accIds, ids, ptxts)
+
+
+    # ------------------------- OUT-OF-PLACE OPERATIONS -----------------------
+    # These return a new PyCtxt with the result and leave the operands as they
+    #   are. The result is computed straight into new cyphertexts, instead of
+    #   duplicating the operand and then operating on the copy.
+
+    # ADD NEW: ctxt1 + ctxt2 (or ctxt1 - ctxt2 if neg is True)
+    def addNew(self, ctxt1, ctxt2, neg=False):
+        if not isinstance(ctxt1, PyCtxt):
+            raise TypeError("Pyfhel addNew error: ctxt1 must be of type PyCtxt instead of type " + str(type(ctxt1)))
+        if not isinstance(ctxt2, PyCtxt):
+            raise TypeError("Pyfhel addNew error: ctxt2 must be of type PyCtxt instead of type " + str(type(ctxt2)))
+        cdef vector[long] ids1 = ctxt1.getIDs()
+        cdef vector[long] ids2 = ctxt2.getIDs()
+        cdef vector[long] resIds
+        cdef bool cNeg = neg
+        if ids1.size() != ids2.size():      # They must have the same # of IDs
+            raise PyCtxtLenError()
+        with nogil:
+            resIds = self.afhel.addNew(ids1, ids2, cNeg)
+        return self._newCtxt(ctxt1, resIds)
+
+
+    # MULT NEW: ctxt1 * ctxt2
+    def multNew(self, ctxt1, ctxt2):
+        if not isinstance(ctxt1, PyCtxt):
+            raise TypeError("Pyfhel multNew error: ctxt1 must be of type PyCtxt instead of type " + str(type(ctxt1)))
+        if not isinstance(ctxt2, PyCtxt):
+            raise TypeError("Pyfhel multNew error: ctxt2 must be of type PyCtxt instead of type " + str(type(ctxt2)))
+        cdef vector[long] ids1 = ctxt1.getIDs()
+        cdef vector[long] ids2 = ctxt2.getIDs()
+        cdef vector[long] resIds
+        if ids1.size() != ids2.size():      # They must have the same # of IDs
             raise PyCtxtLenError()
-        for i in range(n_ids):              # Use Afhel::mult to * each pair of Ctxts by IDs
-            self.afhel.mult3(ids1[i],ids2[i], ids3[i])
+        with nogil:
+            resIds = self.afhel.multNew(ids1, ids2)
+        return self._newCtxt(ctxt1, resIds)
 
 
+    # ADD PLAIN NEW: ctxt + ptxt (or ctxt - ptxt if neg is True), with ptxt
+    #   an int, a list or a PyPtxt as in addPlain
+    def addPlainNew(self, ctxt, ptxt, neg=False):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel addPlainNew error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef vector[long] resIds
+        cdef vector[vector[long]] ptxts
+        cdef bool cNeg = neg
+        if isinstance(ptxt, (int, long)):
+            ptxts = self._scalarList(ctxt, ptxt)
+        else:
+            ptxts = self._plainList(ptxt, ids.size())
+        with nogil:
+            resIds = self.afhel.addConstantNew(ids, ptxts, cNeg)
+        return self._newCtxt(ctxt, resIds)
+
+
+    # MULT PLAIN NEW: ctxt * ptxt, with ptxt an int, a list or a PyPtxt as in
+    #   multPlain
+    def multPlainNew(self, ctxt, ptxt):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel multPlainNew error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef vector[long] resIds
+        cdef vector[vector[long]] ptxts
+        if isinstance(ptxt, (int, long)):
+            ptxts = self._scalarList(ctxt, ptxt)
+        else:
+            ptxts = self._plainList(ptxt, ids.size())
+        with nogil:
+            resIds = self.afhel.multByConstantNew(ids, ptxts)
+        return self._newCtxt(ctxt, resIds)
+
+
+    # POWER NEW: ctxt ** n, for an int n >= 1
+    def powerNew(self, ctxt, n):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel powerNew error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        if not isinstance(n, (int, long)) or n < 1:
+            raise ValueError("Pyfhel powerNew error: n must be an int >= 1")
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef vector[long] resIds
+        cdef long cN = n
+        with nogil:
+            resIds = self.afhel.powerNew(ids, cN)
+        return self._newCtxt(ctxt, resIds)
+
+
+
+
+    # MULTiply each cyphertext inside PyCtxt ctxt by a plaintext constant
+    #   without encrypting it: an int (same value for all slots within the
+    #   length of the cyphertext), or a list or PyPtxt (one value per slot).
+    def multPlain(self, ctxt, ptxt):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel multPlain error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        cdef long cId
+        cdef vector[long] ptxtVect
+        ids = ctxt.getIDs()
+        n_ids = len(ids)
+        if isinstance(ptxt, (int, long)):
+            ptxtList = self._scalarList(ctxt, ptxt)
+        else:
+            ptxtList = self._plainList(ptxt, n_ids)
+        for i in range(n_ids):              # Use Afhel::multByConstant with each vector
+            cId = ids[i]
+            ptxtVect = ptxtList[i]
+            self.afhel.multByConstant(cId, ptxtVect)
 
 
-    # SCALAR PRODuct between two PyCtxt objects for each ID in both
-    def scalarProd(self, ctxt1, ctxt2):
+    # SCALAR PRODuct between two PyCtxt objects for each ID in both. With a
+    #   partitionSize k (dividing the number of slots), each block of k slots
+    #   holds its own scalar product, replicated in all the slots of the block.
+    def scalarProd(self, ctxt1, ctxt2, partitionSize=0):
         if not isinstance(ctxt1, PyCtxt):
             raise TypeError("Pyfhel scalarProd error: ctxt1 must be of type PyCtxt instead of type " + str(type(ctxt1)))
         if not isinstance(ctxt2, PyCtxt):
             raise TypeError("Pyfhel scalarProd error: ctxt2 must be of type PyCtxt instead of type " + str(type(ctxt2)))
-        ids1 = ctxt1.getIDs()
-        ids2 = ctxt2.getIDs()
-        n_ids = len(ids1)
-        if n_ids != len(ids2):              # They must have the same # of IDs
+        if not isinstance(partitionSize, (int, long)) or partitionSize < 0:
+            raise ValueError("Pyfhel scalarProd error: partitionSize must be an int >= 0")
+        cdef vector[long] ids1 = ctxt1.getIDs()
+        cdef vector[long] ids2 = ctxt2.getIDs()
+        cdef int cPartition = partitionSize
+        if ids1.size() != ids2.size():      # They must have the same # of IDs
             raise PyCtxtLenError()
-        for i in range(n_ids):              # Use Afhel::scalarProd to compute each pair of Ctxts by IDs
-            self.afhel.scalarProd(ids1[i],ids2[i], 0)
+        with nogil:                         # Use Afhel::scalarProd to compute all pairs of Ctxts by IDs
+            self.afhel.scalarProd(ids1, ids2, cPartition)
             
 
     # SQUARE each cyphertext inside PyCtxt ctxt for each ID in it
@@ -223,11 +701,9 @@ cdef class Pyfhel:
         if not isinstance(ctxt, PyCtxt):
             raise TypeError("Pyfhel square error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
 
-        ids = ctxt.getIDs()
-        n_ids = len(ids)
-
-        for i in range(n_ids):
-            self.afhel.square(ids[i])
+        cdef vector[long] ids = ctxt.getIDs()
+        with nogil:                         # Use Afhel::square on all Ctxts by IDs
+            self.afhel.square(ids)
 
 
 
@@ -237,11 +713,32 @@ cdef class Pyfhel:
         if not isinstance(ctxt, PyCtxt):
             raise TypeError("Pyfhel cube error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
 
-        ids = ctxt.getIDs()
-        n_ids = len(ids)
+        cdef vector[long] ids = ctxt.getIDs()
+        with nogil:                         # Use Afhel::cumSum on all Ctxts by IDs
+            self.afhel.cumSum(ids)
+
+
+    # PREFIX SUM running sum over the slots of each cyphertext inside PyCtxt
+    #   ctxt: slot i gets the sum of slots 0..i
+    def prefixSum(self, ctxt):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel prefixSum error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        cdef vector[long] ids = ctxt.getIDs()
+        with nogil:                         # Use Afhel::prefixSum on all Ctxts by IDs
+            self.afhel.prefixSum(ids)
+
 
-        for i in range(n_ids):
-            self.afhel.cumSum(ids[i])
+    # WINDOW SUM sliding-window sum over the slots of each cyphertext inside
+    #   PyCtxt ctxt: slot i gets the sum of slots i-width+1..i
+    def windowSum(self, ctxt, width):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel windowSum error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        if not isinstance(width, (int, long)) or width < 1:
+            raise ValueError("Pyfhel windowSum error: width must be an int >= 1")
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef long cWidth = width
+        with nogil:                         # Use Afhel::windowSum on all Ctxts by IDs
+            self.afhel.windowSum(ids, cWidth)
 
 
 
@@ -251,11 +748,49 @@ cdef class Pyfhel:
         if not isinstance(ctxt, PyCtxt):
             raise TypeError("Pyfhel cube error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
 
+        cdef vector[long] ids = ctxt.getIDs()
+        with nogil:                         # Use Afhel::cube on all Ctxts by IDs
+            self.afhel.cube(ids)
+
+
+    # POWER each cyphertext inside PyCtxt ctxt to n (n>=1) for each ID in it,
+    #   using O(log n) multiplications and multiplicative depth
+    def power(self, ctxt, n):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel power error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        if not isinstance(n, (int, long)) or n < 1:
+            raise ValueError("Pyfhel power error: n must be an int >= 1")
+
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef long cN = n
+        with nogil:                         # Use Afhel::power on all Ctxts by IDs
+            self.afhel.power(ids, cN)
+
+
+    # POLYnomial EVALuation P(x) = a0 + a1*x + ... + an*x^n of each cyphertext
+    #   inside PyCtxt ctxt, of any degree. The coefficients are either all ints
+    #   (same for all slots) or all PyCtxt with the same number of IDs as ctxt.
+    def polyEval(self, ctxt, coeffs):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel polyEval error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        if not isinstance(coeffs, list) or len(coeffs) == 0:
+            raise ValueError("Pyfhel polyEval error: coeffs must be a non-empty list")
+        cdef vector[long] coeffVect
         ids = ctxt.getIDs()
         n_ids = len(ids)
-
-        for i in range(n_ids):
-            self.afhel.cube(ids[i])
+        if all(isinstance(a, (int, long)) for a in coeffs):
+            coeffVect = coeffs
+            for i in range(n_ids):          # Use Afhel::polyEval with plain coeffs
+                self.afhel.polyEval(ids[i], coeffVect)
+        elif all(isinstance(a, PyCtxt) for a in coeffs):
+            for a in coeffs:                # They must have the same # of IDs
+                if len(a.getIDs()) != n_ids:
+                    raise PyCtxtLenError()
+            for i in range(n_ids):          # Use Afhel::polyEvalCtxt with i-th IDs
+                coeffVect = [a.getIDs()[i] for a in coeffs]
+                self.afhel.polyEvalCtxt(ids[i], coeffVect)
+        else:
+            raise TypeError("Pyfhel polyEval error: coeffs must be all of type int or all of type PyCtxt")
 
 
     # NEGATE each cyphertext inside PyCtxt ctxt for each ID in it
@@ -263,11 +798,9 @@ cdef class Pyfhel:
         if not isinstance(ctxt, PyCtxt):
             raise TypeError("Pyfhel negate error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
 
-        ids = ctxt.getIDs()
-        n_ids = len(ids)
-
-        for i in range(n_ids):
-            self.afhel.negate(ids[i])
+        cdef vector[long] ids = ctxt.getIDs()
+        with nogil:                         # Use Afhel::negate on all Ctxts by IDs
+            self.afhel.negate(ids)
 
 
     # COMPARE two PyCtxt objects for each ID in both
@@ -282,8 +815,12 @@ cdef class Pyfhel:
         comparison = []
         if n_ids != len(ids2):              # They must have the same # of IDs
             raise PyCtxtLenError()
-        for i in range(n_ids):              # Use Afhel::equalsTo to * each pair of Ctxts by IDs
-            comparison.append(self.afhel.mult(ids1[i],ids2[i]))
+        cdef long cId1
+        cdef long cId2
+        for i in range(n_ids):              # Use Afhel::equalsTo to compare each pair of Ctxts by IDs
+            cId1 = ids1[i]
+            cId2 = ids2[i]
+            comparison.append(self.afhel.equalsTo(cId1, cId2, True))
         return comparison
 
 
@@ -292,11 +829,25 @@ cdef class Pyfhel:
         if not isinstance(ctxt, PyCtxt):
             raise TypeError("Pyfhel rotate error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
 
-        ids = ctxt.getIDs()
-        n_ids = len(ids)
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef long cC = c
+        with nogil:                         # Use Afhel::rotate on all Ctxts by IDs
+            self.afhel.rotate(ids, cC)
 
-        for i in range(n_ids):
-            self.afhel.rotate(ids[i], c)
+
+    # ROTATE MANY rotate PyCtxt ctxt by each amount in amounts at once,
+    #   returning a list with one new PyCtxt per amount. ctxt is unchanged.
+    def rotateMany(self, ctxt, amounts):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel rotateMany error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        if not all(isinstance(c, (int, long)) for c in amounts):
+            raise TypeError("Pyfhel rotateMany error: amounts must be a list of int")
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef vector[long] cAmounts = amounts
+        cdef vector[vector[long]] resIds
+        with nogil:                         # Use Afhel::rotateMany on all Ctxts by IDs
+            resIds = self.afhel.rotateMany(ids, cAmounts)
+        return [self._newCtxt(ctxt, rotIds) for rotIds in resIds]
 
 
     # SHIFT each cyphertext inside PyCtxt ctxt for each ID in it
@@ -304,39 +855,398 @@ cdef class Pyfhel:
         if not isinstance(ctxt, PyCtxt):
             raise TypeError("Pyfhel rotate error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
 
-        ids = ctxt.getIDs()
-        n_ids = len(ids)
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef long cC = c
+        with nogil:                         # Use Afhel::shift on all Ctxts by IDs
+            self.afhel.shift(ids, cC)
+
+
+
+    # --------------------------- LINEAR ALGEBRA ------------------------------
+    # MATrix-VECtor product plainMatrix * v for the vector v encrypted in each
+    #   cyphertext of PyCtxt ctxt (n values, the remaining slots being 0). The
+    #   plaintext matrix (m x n, list of rows or 2-D array) is applied with the
+    #   diagonal method, in O(sqrt(n)) rotations. Returns a new PyCtxt with m
+    #   values per cyphertext.
+    def matVec(self, plainMatrix, ctxt):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel matVec error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        rows = np.asarray(plainMatrix)
+        if rows.ndim != 2 or rows.shape[0] == 0 or rows.shape[1] == 0:
+            raise ValueError("Pyfhel matVec error: plainMatrix must be a non-empty 2-D matrix")
+        cdef vector[vector[long]] matrix = [[int(v) % self.modulus for v in row] for row in rows.tolist()]
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef vector[long] resIds
+        with nogil:
+            resIds = self.afhel.matVec(ids, matrix)
+        res = PyCtxt(self, [rows.shape[0] for _ in range(resIds.size())])
+        for i in resIds:
+            res.appendID(i)
+        return res
+
+
+    # ENCRYPT MATRIX packs a matrix (list of rows or 2-D array) into a single
+    #   cyphertext, padded with zeros up to a dim x dim square (slot dim*i+j
+    #   holds row i, column j). dim defaults to the largest side of the matrix,
+    #   and dim*dim must be the number of slots, or at most half of it.
+    def encryptMatrix(self, matrix, dim=0):
+        rows = np.asarray(matrix)
+        if rows.ndim != 2 or rows.shape[0] == 0 or rows.shape[1] == 0:
+            raise ValueError("Pyfhel encryptMatrix error: matrix must be a non-empty 2-D matrix")
+        d = dim if dim > 0 else max(rows.shape)
+        if d < max(rows.shape):
+            raise ValueError("Pyfhel encryptMatrix error: dim must be at least the largest side of the matrix")
+        self._checkMatrixDim(d)
+        slots = [0]*(d*d)
+        for i, row in enumerate(rows.tolist()):
+            slots[d*i : d*i + len(row)] = [int(v) for v in row]
+        return PyMatrix(self.encrypt(PyPtxt(slots, self)), rows.shape, d)
+
+
+    # DECRYPT MATRIX returns the list of rows of the matrix in a PyMatrix
+    def decryptMatrix(self, pmat):
+        if not isinstance(pmat, PyMatrix):
+            raise TypeError("Pyfhel decryptMatrix error: pmat must be of type PyMatrix instead of type " + str(type(pmat)))
+        d = pmat.getDim()
+        nRows, nCols = pmat.getShape()
+        vals = self.afhel.decrypt(pmat.getCtxt().getIDs()[0])
+        return [[vals[d*i + j] for j in range(nCols)] for i in range(nRows)]
+
+
+    # MATrix MULtiplication of two PyMatrix objects packed with the same dim,
+    #   with dim cyphertext multiplications (see Afhel::matMul). Returns a new
+    #   PyMatrix.
+    def matMul(self, pmatA, pmatB):
+        if not isinstance(pmatA, PyMatrix):
+            raise TypeError("Pyfhel matMul error: pmatA must be of type PyMatrix instead of type " + str(type(pmatA)))
+        if not isinstance(pmatB, PyMatrix):
+            raise TypeError("Pyfhel matMul error: pmatB must be of type PyMatrix instead of type " + str(type(pmatB)))
+        if pmatA.getShape()[1] != pmatB.getShape()[0]:
+            raise ValueError("Pyfhel matMul error: shapes " + str(pmatA.getShape()) + " and " + str(pmatB.getShape()) + " are not aligned")
+        if pmatA.getDim() != pmatB.getDim():
+            raise ValueError("Pyfhel matMul error: both matrices must be packed with the same dim")
+        cdef vector[long] idsA = pmatA.getCtxt().getIDs()
+        cdef vector[long] idsB = pmatB.getCtxt().getIDs()
+        cdef vector[long] resIds
+        cdef long d = pmatA.getDim()
+        if idsA.size() != 1 or idsB.size() != 1:
+            raise PyCtxtLenError()
+        with nogil:
+            resIds = self.afhel.matMul(idsA, idsB, d)
+        res = PyCtxt(self, [d*d])
+        res.appendID(resIds[0])
+        return PyMatrix(res, (pmatA.getShape()[0], pmatB.getShape()[1]), d)
+
+    def _checkMatrixDim(self, d):
+        numSlots = self.numSlots()
+        if d*d != numSlots and 2*d*d > numSlots:
+            raise ValueError("Pyfhel matrix error: dim*dim must be the number of slots (%d), or at most half of it"%(numSlots))
+
+
+
+    # --------------------------- LAZY EVALUATION -----------------------------
+    # SET lazy mode: PyCtxt operators (+, -, *, %, **, ~, <<) build an
+    #   expression graph instead of running each operation. The graph is
+    #   optimized and evaluated in one Afhel pass when the result is used
+    #   (decrypt or any other Pyfhel method) or on PyCtxt.evaluate().
+    def setLazy(self, on):
+        self.lazy = on
+    def getLazy(self):
+        return self.lazy
+
+    # EVALUATE an expression graph (PyExpr) and return the IDs of the result
+    def evalExpr(self, expr):
+        leaves = exprLeaves(expr)
+        for leaf in leaves:                 # All must have the same # of IDs
+            if len(leaf.getIDs()) != len(leaves[0].getIDs()):
+                raise PyCtxtLenError()
+        code, inputs, consts = compileExpr(expr, self)
+        cdef vector[long] codeVect = code
+        cdef vector[vector[long]] inputsVect = inputs
+        cdef vector[vector[vector[long]]] constsVect = consts
+        cdef vector[long] ids
+        with nogil:
+            ids = self.afhel.evalProgram(codeVect, inputsVect, constsVect)
+        return list(ids)
+
+
+    # ------------------------------- PARALLELISM -----------------------------
+    # SET the number of threads of the worker pool. The cyphertexts inside a
+    #   PyCtxt are processed in parallel by it in all operations.
+    def setNumWorkers(self, n):
+        if not isinstance(n, (int, long)) or n < 1:
+            raise ValueError("Pyfhel setNumWorkers error: n must be an int >= 1")
+        self.afhel.setNumWorkers(n)
+
+    # GET the number of threads of the worker pool
+    def getNumWorkers(self):
+        return self.afhel.getNumWorkers()
+
+    # SET the number of threads used both inside each HElib operation (NTL
+    #   thread pool, DoubleCRT level) and across cyphertexts (worker pool).
+    #   Defaults to the number of CPUs.
+    def setNumThreads(self, n):
+        if not isinstance(n, (int, long)) or n < 1:
+            raise ValueError("Pyfhel setNumThreads error: n must be an int >= 1")
+        self.afhel.setNumThreads(n)
 
-        for i in range(n_ids):
-            self.afhel.shift(ids[i], c)
+    # GET the number of threads of the NTL thread pool
+    def getNumThreads(self):
+        return self.afhel.getNumThreads()
 
+    # SET how operations over several cyphertexts use the threads:
+    #   "intra" parallelizes inside each operation (DoubleCRT level),
+    #   "inter" spreads the cyphertexts across the worker pool, and "auto"
+    #   picks "inter" when there are at least as many cyphertexts as workers.
+    def setParallelMode(self, mode):
+        if mode not in PARALLEL_MODES:
+            raise ValueError("Pyfhel setParallelMode error: mode must be one of " + str(sorted(PARALLEL_MODES.keys())))
+        self.afhel.setParallelMode(PARALLEL_MODES[mode])
+
+    # GET the parallel mode by name
+    def getParallelMode(self):
+        mode = self.afhel.getParallelMode()
+        return [k for k, v in PARALLEL_MODES.items() if v == mode][0]
+
+
+    # ---------------------------- NOISE & CAPACITY ---------------------------
+    # CAPACITY estimated bits of modulus left above the noise, log2(q/noise),
+    #   of the worst cyphertext in a PyCtxt. Decryption fails around 0.
+    def capacity(self, ctxt):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel capacity error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        return min([self.afhel.capacity(i) for i in ctxt.getIDs()])
+
+    # NOISE BOUND estimated noise (log2 of its standard deviation) of the
+    #   noisiest cyphertext in a PyCtxt
+    def noiseBound(self, ctxt):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel noiseBound error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        return max([self.afhel.noiseBound(i) for i in ctxt.getIDs()])
+
+    # SET the capacity guard: any operation whose result has less than minBits
+    #   of capacity raises ArithmeticError. 0 disables it.
+    def setCapacityGuard(self, minBits):
+        self.afhel.setCapacityGuard(minBits)
+    def getCapacityGuard(self):
+        return self.afhel.getCapacityGuard()
+
+
+    # ---------------------------- LEVEL MANAGEMENT ---------------------------
+    # LEVEL of the lowest cyphertext in a PyCtxt (size of its modulus)
+    def level(self, ctxt):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel level error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        return min([self.afhel.level(i) for i in ctxt.getIDs()])
+
+    # MOD DOWN TO modulus-switch a PyCtxt down to a lower level, keeping its
+    #   value. Use it to drop fresh cyphertexts to the lowest level that still
+    #   fits the remaining depth of the circuit.
+    def modDownTo(self, ctxt, level):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel modDownTo error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef long lvl = level
+        with nogil:
+            self.afhel.modDownTo(ids, lvl)
+        return ctxt
+
+    # SET automatic modulus switching: binary operations first bring their
+    #   operands down to a common level. The PyCtxt being written is switched
+    #   in place, the other operands only through a temporary copy.
+    def setAutoModSwitch(self, on):
+        self.afhel.setAutoModSwitch(on)
+    def getAutoModSwitch(self):
+        return self.afhel.getAutoModSwitch()
+
+    # SET the depth hint: multiplicative depth still to be evaluated on fresh
+    #   cyphertexts. encrypt and encryptArray then drop them to the lowest
+    #   level that fits it, so the whole circuit runs on smaller moduli.
+    #   0 disables it.
+    def setDepthHint(self, depth):
+        self.afhel.setDepthHint(depth)
+    def getDepthHint(self):
+        return self.afhel.getDepthHint()
+
+
+    # ------------------------------ ROTATION KEYS ----------------------------
+    # SET which key-switching matrices for rotations are generated (call it
+    #   before keyGen): "some" generates HElib's default set in keyGen, "none"
+    #   only the ones declared with addRotationKeys/addFrobeniusKeys, and
+    #   "lazy" the ones each rotation needs the first time it runs.
+    def setRotationKeys(self, mode):
+        if mode not in ROTATION_KEYS:
+            raise ValueError("Pyfhel setRotationKeys error: mode must be one of " + str(sorted(ROTATION_KEYS.keys())))
+        self.afhel.setRotationKeys(ROTATION_KEYS[mode])
+
+    # GET the rotation keys mode by name
+    def getRotationKeys(self):
+        mode = self.afhel.getRotationKeys()
+        return [k for k, v in ROTATION_KEYS.items() if v == mode][0]
+
+    # ADD the key-switching matrices to rotate/shift by each amount in a list
+    def addRotationKeys(self, amounts):
+        cdef vector[long] amountsVect = list(amounts)
+        self.afhel.addRotationKeys(amountsVect)
+
+    # ADD the key-switching matrices of the Frobenius maps X -> X^(p^j)
+    def addFrobeniusKeys(self, powers):
+        cdef vector[long] powersVect = list(powers)
+        self.afhel.addFrobeniusKeys(powersVect)
+
+
+    # ----------------------------- PLAINTEXT CACHE ---------------------------
+    # SET the memory budget (in bytes) of the cache of encoded plaintexts used
+    #   by multPlain/addPlain with lists or PyPtxt. 0 disables the cache.
+    def setPtxtCacheBudget(self, nBytes):
+        if not isinstance(nBytes, (int, long)):
+            raise TypeError("Pyfhel setPtxtCacheBudget error: nBytes must be of type int instead of type " + str(type(nBytes)))
+        self.afhel.setPtxtCacheBudget(nBytes)
+
+    # CLEAR all the cached plaintexts and reset the hit/miss counters
+    def clearPtxtCache(self):
+        self.afhel.clearPtxtCache()
+
+    # STATS of the plaintext cache: budget & used bytes, hits and misses
+    def getPtxtCacheStats(self):
+        return {"budget": self.afhel.getPtxtCacheBudget(),
+                "bytes":  self.afhel.getPtxtCacheBytes(),
+                "hits":   self.afhel.getPtxtCacheHits(),
+                "misses": self.afhel.getPtxtCacheMisses()}
 
 
     # ----------------------------------- I/O ---------------------------------
 
     # SAVE ENVIRONMENT
-    # Saves the environment into a .aenv file
-    def saveEnv(self, fileName):
+    # Saves the environment into a .aenv file, with a checksummed header by
+    #   default (checksummed=False writes the legacy text format alone, the
+    #   only one Pyfhel versions before the checksum can restore). Returns
+    #   True if the file was written.
+    def saveEnv(self, fileName, checksummed=True):
         if not isinstance(fileName, str):
             raise TypeError("Pyfhel saveEnv error: fileName must be of type str instead of type " + str(type(fileName)))
-        self.afhel.saveEnv(fileName)
-        return 
+        return bool(self.afhel.saveEnv(fileName, checksummed))
 
 
     # RESTORE ENVIRONMENT
-    # Restores the environment from a .aenv file
+    # Restores the environment from a checksummed or legacy text .aenv file.
+    #   Returns False if the file is missing, corrupted or unreadable.
     def restoreEnv(self, fileName):
         if not isinstance(fileName, str):
-            raise TypeError("Pyfhel saveEnv error: fileName must be of type str instead of type " + str(type(fileName)))
-        self.afhel.restoreEnv(fileName)
+            raise TypeError("Pyfhel restoreEnv error: fileName must be of type str instead of type " + str(type(fileName)))
+        if not self.afhel.restoreEnv(fileName):
+            return False
         self.modulus = long(pow(self.afhel.getP(), self.afhel.getR()))
-        return
+        return True
+
+    # TO BYTES
+    # Serializes a PyCtxt into a binary string: number of cyphertexts and,
+    #   for each cyphertext, its length, the size of its blob and the blob.
+    def toBytes(self, ctxt):
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel toBytes error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        ids = ctxt.getIDs()
+        lens = self._ctxtLens(ctxt)
+        out = [struct.pack("<q", len(ids))]
+        for i, l in zip(ids, lens):
+            blob = self.afhel.serialize(i)
+            out.append(struct.pack("<qq", l, len(blob)) + blob)
+        return b"".join(out)
+
+
+    # FROM BYTES
+    # Rebuilds a PyCtxt from a binary string created by toBytes
+    def fromBytes(self, data):
+        if not isinstance(data, bytes):
+            raise TypeError("Pyfhel fromBytes error: data must be of type bytes instead of type " + str(type(data)))
+        if len(data) < 8:
+            raise ValueError("Pyfhel fromBytes error: data is too short to contain a PyCtxt")
+        nCtxts, = struct.unpack_from("<q", data, 0)
+        offset = 8
+        lens = []
+        ctxt = PyCtxt(self, lens)           # Partial results are freed by PyCtxt
+        for _ in range(nCtxts):
+            if offset + 16 > len(data):
+                raise ValueError("Pyfhel fromBytes error: truncated PyCtxt data")
+            length, size = struct.unpack_from("<qq", data, offset)
+            offset += 16
+            if offset + size > len(data):
+                raise ValueError("Pyfhel fromBytes error: truncated PyCtxt data")
+            ctxt.appendID(self.afhel.deserialize(data[offset:offset+size]))
+            lens.append(length)
+            offset += size
+        return ctxt
+
+
+    # SAVE CYPHERTEXT
+    # Saves the cyphertexts of a PyCtxt in a binary .actx file
+    def saveCtxt(self, fileName, ctxt):
+        if not isinstance(fileName, str):
+            raise TypeError("Pyfhel saveCtxt error: fileName must be of type str instead of type " + str(type(fileName)))
+        if not isinstance(ctxt, PyCtxt):
+            raise TypeError("Pyfhel saveCtxt error: ctxt must be of type PyCtxt instead of type " + str(type(ctxt)))
+        cdef vector[long] ids = ctxt.getIDs()
+        cdef vector[long] lens = self._ctxtLens(ctxt)
+        return self.afhel.saveCtxts(fileName, ids, lens)
+
+
+    # LOAD CYPHERTEXT
+    # Loads a PyCtxt from a .actx file, memory-mapping it if useMmap is True
+    def loadCtxt(self, fileName, useMmap=True):
+        if not isinstance(fileName, str):
+            raise TypeError("Pyfhel loadCtxt error: fileName must be of type str instead of type " + str(type(fileName)))
+        cdef vector[long] lens
+        cdef vector[long] ids = self.afhel.loadCtxts(fileName, lens, useMmap)
+        ctxt = PyCtxt(self, [l for l in lens])
+        for i in ids:
+            ctxt.appendID(i)
+        return ctxt
+
+    # One length per cyphertext of a PyCtxt (PyCtxt built by hand may hold a
+    #   single length shared by all of them)
+    def _ctxtLens(self, ctxt):
+        n_ids = len(ctxt.getIDs())
+        lens = ctxt.getLen()
+        if not isinstance(lens, list):
+            return [int(lens)] * n_ids
+        if len(lens) != n_ids:
+            raise PyCtxtLenError()
+        return list(lens)
+
+    # One vector per cyphertext of a PyCtxt holding the int c in the slots
+    #   within its length, padded with zeros as for a PyPtxt: adding it leaves
+    #   the filler slots beyond the length as they are, and multiplying by it
+    #   clears them
+    def _scalarList(self, ctxt, c):
+        c = c % self.modulus
+        return [[c]*l for l in self._ctxtLens(ctxt)]
 
     #--------------------------------- AUXILIARY ------------------------------
     def numSlots(self):
         return self.afhel.numSlots()
     def getModulus(self):
         return self.modulus
+    def getM(self):
+        return self.afhel.getM()
+    def getL(self):
+        return self.afhel.getL()
+    # New PyCtxt with the same lengths as ctxt holding the cyphertexts at ids
+    def _newCtxt(self, ctxt, ids):
+        new_ctxt = PyCtxt(self, ctxt.getLen())
+        for i in ids:
+            new_ctxt.appendID(i)
+        return new_ctxt
+
+    # Split a list or a PyPtxt into one list of values per cyphertext
+    def _plainList(self, ptxt, n_ids):
+        if isinstance(ptxt, list):
+            ptxt = PyPtxt(ptxt, self)
+        if not isinstance(ptxt, PyPtxt):
+            raise TypeError("Pyfhel plaintext error: ptxt must be of type int, list or PyPtxt instead of type " + str(type(ptxt)))
+        ptxtList = ptxt.getPtxtList()
+        if len(ptxtList) != n_ids:          # Must have one list per cyphertext
+            raise PyCtxtLenError()
+        return ptxtList
     def delete(self, ctxt):
         for i in ctxt.getIDs():
             self.afhel.erase(i)
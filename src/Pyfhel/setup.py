@@ -20,7 +20,7 @@ ext_modules = [
                       "/usr/include/x86_64-linux-gnu/python2.7",
                     ],
         language="c++",
-        extra_compile_args=["-std=c++11",
+        extra_compile_args=["-std=c++14",
                             "-DNDEBUG",
                             "-g",
                             "-fwrapv",
@@ -49,6 +49,22 @@ ext_modules = [
         libraries=[],
         library_dirs=[],
         language="python",
+    ),
+    Extension(
+        name="PyExpr",
+        sources=["PyExpr.py"],
+        include_dirs=[],
+        libraries=[],
+        library_dirs=[],
+        language="python",
+    ),
+    Extension(
+        name="PyMatrix",
+        sources=["PyMatrix.py"],
+        include_dirs=[],
+        libraries=[],
+        library_dirs=[],
+        language="python",
     )
 ]
 